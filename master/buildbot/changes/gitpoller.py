@@ -1,23 +1,25 @@
 import time
 import tempfile
 import os
-import subprocess
 
-import select
-import errno
-
-from twisted.python import log, failure
-from twisted.internet import reactor, utils
+from twisted.python import log
+from twisted.internet import defer, reactor, utils
 from twisted.internet.task import LoopingCall
-from twisted.web.client import getPage
 
 from buildbot.changes import base, changes
 
+# 'git log' is asked to start each commit with LOG_START, and to separate
+# its fields with LOG_SEP; the files changed by the commit follow the last
+# field, one per line
+LOG_START = '\x01'
+LOG_SEP = '\x02'
+LOG_FORMAT = r'--format=%x01%H%x02%ct%x02%cn%x02%s%n%b%x02'
+
 class GitPoller(base.ChangeSource):
     """This source will poll a remote git repo for changes and submit
     them to the change master."""
     
-    compare_attrs = ["repourl", "branch", "workdir",
+    compare_attrs = ["repourl", "branches", "workdir",
                      "pollinterval", "gitbin", "usetimestamps",
                      "category", "project"]
                      
@@ -30,7 +32,7 @@ class GitPoller(base.ChangeSource):
     def __init__(self, repourl, branch='master', 
                  workdir=None, pollinterval=10*60, 
                  gitbin='git', usetimestamps=True,
-                 category=None, project=None):
+                 category=None, project=None, branches=None):
         """
         @type  repourl: string
         @param repourl: the url that describes the remote repository,
@@ -63,10 +65,17 @@ class GitPoller(base.ChangeSource):
         @param project       project that the changes are associated to. Attached to
                              the Change object produced by this changesource such that
                              it can be targeted by change filters.
+
+        @type  branches:     list of strings
+        @param branches:     several branches to watch, all fetched at once;
+                             this overrides branch
         """
         
         self.repourl = repourl
-        self.branch = branch
+        if not branches:
+            branches = [branch]
+        self.branches = branches
+        self.branch = branches[0]
         self.pollinterval = pollinterval
         self.lastChange = time.time()
         self.lastPoll = time.time()
@@ -106,171 +115,145 @@ class GitPoller(base.ChangeSource):
         if not self.running:
             status = "[STOPPED - check log]"
         str = 'GitPoller watching the remote git repository %s, branch: %s %s' \
-                % (self.repourl, self.branch, status)
+                % (self.repourl, ', '.join(self.branches), status)
         return str
 
     def poll(self):
         if self.working:
             log.msg('gitpoller: not polling git repo because last poll is still working')
-        else:
-            self.working = True
-            d = self._get_changes()
-            d.addCallback(self._process_changes)
-            d.addCallbacks(self._changes_finished_ok, self._changes_finished_failure)
-            d.addCallback(self._catch_up)
-            d.addCallbacks(self._catch_up_finished_ok, self._catch_up__finished_failure)
-        return
+            return
+        self.working = True
+        d = self._get_refs()
+        d.addCallback(self._fetch)
+        d.addCallback(self._get_changes)
+        d.addCallback(self._submit_changes)
+        d.addErrback(self._poll_failed)
+        d.addBoth(self._poll_finished)
+        return d
 
-    def _get_git_output(self, args):
-        git_args = [self.gitbin] + args
-        
-        p = subprocess.Popen(git_args,
-                             cwd=self.workdir,
-                             stdout=subprocess.PIPE)
-        
-        # dirty hack - work around EINTR oddness on Mac builder
-        while True:
-            try:
-                output = p.communicate()[0]
-                break
-            except (OSError, select.error), e:
-                if e[0] == errno.EINTR:
-                    continue
-                else:
-                    raise
-        
-        if p.returncode != 0:
-            raise EnvironmentError('call \'%s\' exited with error \'%s\', output: \'%s\'' % 
-                                    (args, p.returncode, output))
-        return output
+    def _dovccmd(self, args, env=None):
+        """Run git with the given arguments in our working directory, and
+        return a Deferred that fires with its output. It errbacks with
+        EnvironmentError if git fails."""
+        if env is None:
+            env = os.environ
+        d = utils.getProcessOutputAndValue(self.gitbin, args,
+                                           path=self.workdir, env=env)
+        def check((stdout, stderr, code)):
+            if code != 0:
+                raise EnvironmentError('call \'%s\' exited with error \'%s\', output: \'%s\'' %
+                                       (args, code, stdout + stderr))
+            return stdout
+        d.addCallback(check)
+        return d
 
-    def _get_commit_comments(self, rev):
-        args = ['log', rev, '--no-walk', r'--format=%s%n%b']
-        output = self._get_git_output(args)
-        
-        if len(output.strip()) == 0:
-            raise EnvironmentError('could not get commit comment for rev %s' % rev)
-        
-        return output
+    def _tracking_ref(self, branch):
+        # remembers the last commit on each branch whose changes have been
+        # submitted
+        return 'refs/buildbot/' + branch
 
-    def _get_commit_timestamp(self, rev):
-        # unix timestamp
-        args = ['log', rev, '--no-walk', r'--format=%ct']
-        output = self._get_git_output(args)
-        
-        try:
-            stamp = float(output)
-        except Exception, e:
-            log.msg('gitpoller: caught exception converting output \'%s\' to timestamp' % output)
-            raise e
-        
-        return stamp
-        
-    def _get_commit_files(self, rev):
-        args = ['log', rev, '--name-only', '--no-walk', r'--format=%n']
-        fileList = self._get_git_output(args).split()
-        return fileList
-            
-    def _get_commit_name(self, rev):
-        args = ['log', rev, '--no-walk', r'--format=%cn']
-        output = self._get_git_output(args)
-        
-        if len(output.strip()) == 0:
-            raise EnvironmentError('could not get commit name for rev %s' % rev)
+    def _fetched_ref(self, branch):
+        # each branch is fetched into a scratch ref; the tracking ref only
+        # catches up with it once the new changes have been submitted
+        return 'refs/buildbot-fetch/' + branch
 
-        return output
+    def _get_refs(self):
+        d = self._dovccmd(['for-each-ref', '--format=%(refname) %(objectname)',
+                           'refs/buildbot/'])
+        def parse(output):
+            refs = {}
+            for line in output.splitlines():
+                if line.strip():
+                    ref, rev = line.split()
+                    refs[ref] = rev
+            return refs
+        d.addCallback(parse)
+        return d
 
-    def _get_changes(self):
+    def _fetch(self, old_refs):
         log.msg('gitpoller: polling git repo at %s' % self.repourl)
-
         self.lastPoll = time.time()
-        
-        # get a deferred object that performs the fetch
-        args = ['fetch', self.repourl, self.branch]
-        d = utils.getProcessOutput(self.gitbin, args, path=self.workdir, env={}, errortoo=1 )
 
+        # fetch all of the branches at once
+        args = ['fetch', self.repourl]
+        for branch in self.branches:
+            args.append('+%s:%s' % (branch, self._fetched_ref(branch)))
+        d = self._dovccmd(args, env={})
+        d.addCallback(lambda _ : old_refs)
         return d
 
-    def _process_changes(self, res):
-        # get the change list
-        revListArgs = ['log', 'HEAD..FETCH_HEAD', r'--format=%H']
-        revs = self._get_git_output(revListArgs);
-        revCount = 0
-        
-        # process oldest change first
-        revList = revs.split()
-        if revList:
-            revList.reverse()
-            revCount = len(revList)
-            
-        log.msg('gitpoller: processing %d changes' % revCount )
+    def _get_changes(self, old_refs):
+        dl = []
+        for branch in self.branches:
+            old = old_refs.get(self._tracking_ref(branch))
+            if old is None:
+                if branch != self.branch:
+                    # a new branch: start watching it from here
+                    continue
+                # the main branch is compared with the working copy, as
+                # older versions of this poller did
+                old = 'HEAD'
+            d = self._dovccmd(['log', '--reverse', '--name-only', LOG_FORMAT,
+                               '%s..%s' % (old, self._fetched_ref(branch))])
+            d.addCallback(self._parse_log, branch)
+            dl.append(d)
+        d = defer.DeferredList(dl, fireOnOneErrback=True, consumeErrors=True)
+        def flatten(results):
+            all_changes = []
+            for (success, branch_changes) in results:
+                all_changes.extend(branch_changes)
+            return all_changes
+        d.addCallback(flatten)
+        return d
 
-        for rev in revList:
+    def _parse_log(self, output, branch):
+        """Make a Change from each commit in the output of 'git log' with
+        LOG_FORMAT and --name-only, in the same order."""
+        result = []
+        for commit in output.split(LOG_START)[1:]:
+            fields = commit.split(LOG_SEP)
+            if len(fields) != 5:
+                raise EnvironmentError('could not parse git log output: %r' % commit)
+            rev, timestamp, name, comments, files = fields
+            if not name.strip():
+                raise EnvironmentError('could not get commit name for rev %s' % rev)
+            if not comments.strip():
+                raise EnvironmentError('could not get commit comment for rev %s' % rev)
             if self.usetimestamps:
-                commit_timestamp = self._get_commit_timestamp(rev)
+                commit_timestamp = float(timestamp)
             else:
                 commit_timestamp = None # use current time
-                
-            c = changes.Change(who = self._get_commit_name(rev),
+            c = changes.Change(who = name,
                                revision = rev,
-                               files = self._get_commit_files(rev),
-                               comments = self._get_commit_comments(rev),
+                               files = [ f for f in files.splitlines() if f ],
+                               comments = comments,
                                when = commit_timestamp,
-                               branch = self.branch,
+                               branch = branch,
                                category = self.category,
                                project = self.project,
                                repository = self.repourl)
-            self.parent.addChange(c)
-            self.lastChange = self.lastPoll
-            
-    def _catch_up(self, res):
-        log.msg('gitpoller: catching up to FETCH_HEAD')
-        
-        args = ['reset', '--hard', 'FETCH_HEAD']
-        d = utils.getProcessOutputAndValue(self.gitbin, args, path=self.workdir, env={})
-        return d;
+            result.append(c)
+        return result
 
-    def _changes_finished_ok(self, res):
-        assert self.working
-        # check for failure -- this is probably never hit but the twisted docs
-        # are not clear enough to be sure. it is being kept "just in case"
-        if isinstance(res, failure.Failure):
-            return self._changes_finished_failure(res)
-
-        return res
+    def _submit_changes(self, all_changes):
+        log.msg('gitpoller: processing %d changes' % len(all_changes))
+        if all_changes:
+            # submitted together, so the master adds them in one transaction
+            self.parent.addChanges(all_changes)
+            self.lastChange = self.lastPoll
+        # only now is it safe to move on: if anything before this failed, the
+        # same commits are read again by the next poll
+        dl = [ self._dovccmd(['update-ref', self._tracking_ref(branch),
+                              self._fetched_ref(branch)])
+               for branch in self.branches ]
+        return defer.DeferredList(dl, fireOnOneErrback=True,
+                                  consumeErrors=True)
 
-    def _changes_finished_failure(self, res):
-        log.msg('gitpoller: repo poll failed: %s' % res)
-        assert self.working
-        # eat the failure to continue along the defered chain 
-        # - we still want to catch up
+    def _poll_failed(self, f):
+        log.msg('gitpoller: repo poll failed: %s' % f)
         return None
-        
-    def _catch_up_finished_ok(self, res):
-        assert self.working
-
-        # check for failure -- this is probably never hit but the twisted docs
-        # are not clear enough to be sure. it is being kept "just in case"
-        if isinstance(res, failure.Failure):
-            return self._catch_up__finished_failure(res)
-            
-        elif isinstance(res, tuple):
-            (stdout, stderr, code) = res
-            if code != 0:
-                e = EnvironmentError('catch up failed with exit code: %d' % code)
-                return self._catch_up__finished_failure(failure.Failure(e))
-        
-        self.working = False
-        return res
 
-    def _catch_up__finished_failure(self, res):
+    def _poll_finished(self, res):
         assert self.working
-        assert isinstance(res, failure.Failure)
         self.working = False
-
-        log.msg('gitpoller: catch up failed: %s' % res)
-        log.msg('gitpoller: stopping service - please resolve issues in local repo: %s' %
-                self.workdir)
-        self.stopService()
         return res
-        
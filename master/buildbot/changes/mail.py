@@ -39,12 +39,37 @@ class MaildirSource(MaildirService, util.ComparableMixin):
         return "%s mailing list in maildir %s" % (self.name, self.basedir)
 
     def messageReceived(self, filename):
-        path = os.path.join(self.basedir, "new", filename)
-        change = self.parse_file(open(path, "r"), self.prefix)
+        change = self.parse_message(filename)
         if change:
             self.parent.addChange(change)
+
+    def messagesReceived(self, filenames):
+        # the changes from a batch of messages are added together
+        changes = []
+        for filename in filenames:
+            try:
+                change = self.parse_message(filename)
+            except:
+                log.msg("error while parsing message %s" % filename)
+                log.err()
+                continue
+            if change:
+                changes.append(change)
+        if changes:
+            self.parent.addChanges(changes)
+
+    def parse_message(self, filename):
+        """Parse the given message in new/, and move it to cur/. Returns a
+        Change, or None if the message did not describe one."""
+        path = os.path.join(self.basedir, "new", filename)
+        f = open(path, "r")
+        try:
+            change = self.parse_file(f, self.prefix)
+        finally:
+            f.close()
         os.rename(os.path.join(self.basedir, "new", filename),
                   os.path.join(self.basedir, "cur", filename))
+        return change
 
     def parse_file(self, fd, prefix=None):
         m = message_from_file(fd)
@@ -1,19 +1,26 @@
 
 # This is a class which watches a maildir for new messages. It uses the
-# linux dirwatcher API (if available) to look for new files. The
+# linux inotify or dirwatcher APIs (if available) to look for new files. The
 # .messageReceived method is invoked with the filename of the new message,
 # relative to the top of the maildir (so it will look like "new/blahblah").
 
 import os
 from twisted.python import log
+from twisted.python.filepath import FilePath
 from twisted.application import service, internet
 from twisted.internet import reactor
+inotify = None
+try:
+    from twisted.internet import inotify
+except ImportError:
+    pass
 dnotify = None
 try:
     import dnotify
 except:
     # I'm not actually sure this log message gets recorded
-    log.msg("unable to import dnotify, so Maildir will use polling instead")
+    if not inotify:
+        log.msg("unable to import dnotify, so Maildir will use polling instead")
 
 class NoSuchMaildir(Exception):
     pass
@@ -21,16 +28,17 @@ class NoSuchMaildir(Exception):
 class MaildirService(service.MultiService):
     """I watch a maildir for new messages. I should be placed as the service
     child of some MultiService instance. When running, I use the linux
-    dirwatcher API (if available) or poll for new files in the 'new'
-    subdirectory of my maildir path. When I discover a new message, I invoke
-    my .messageReceived() method with the short filename of the new message,
-    so the full name of the new file can be obtained with
-    os.path.join(maildir, 'new', filename). messageReceived() should be
-    overridden by a subclass to do something useful. I will not move or
-    delete the file on my own: the subclass's messageReceived() should
-    probably do that.
+    inotify or dirwatcher APIs (if available) or poll for new files in the
+    'new' subdirectory of my maildir path. When I discover new messages, I
+    invoke my .messagesReceived() method with their short filenames, oldest
+    first, and it invokes .messageReceived() for each one, so the full name
+    of the new file can be obtained with os.path.join(maildir, 'new',
+    filename). messageReceived() (or messagesReceived(), to handle a batch at
+    once) should be overridden by a subclass to do something useful. I will
+    not move or delete the file on my own: the subclass's messageReceived()
+    should probably do that.
     """
-    pollinterval = 10  # only used if we don't have DNotify
+    pollinterval = 10  # only used if we don't have INotify or DNotify
 
     def __init__(self, basedir=None):
         """Create the Maildir watcher. BASEDIR is the maildir directory (the
@@ -38,8 +46,10 @@ class MaildirService(service.MultiService):
         """
         service.MultiService.__init__(self)
         self.basedir = basedir
-        self.files = []
+        self.files = set() # the messages we have already reported
+        self.inotify = None
         self.dnotify = None
+        self.pending_poll = None
 
     def setBasedir(self, basedir):
         # some users of MaildirService (scheduler.Try_Jobdir, in particular)
@@ -53,8 +63,19 @@ class MaildirService(service.MultiService):
         self.newdir = os.path.join(self.basedir, "new")
         if not os.path.isdir(self.basedir) or not os.path.isdir(self.newdir):
             raise NoSuchMaildir("invalid maildir '%s'" % self.basedir)
+        if inotify:
+            try:
+                self.inotify = inotify.INotify()
+            except Exception:
+                # not linux, or a kernel without inotify
+                log.msg("INotify failed, trying DNotify")
+            else:
+                self.inotify.startReading()
+                self.inotify.watch(FilePath(self.newdir),
+                                   mask=inotify.IN_CREATE|inotify.IN_MOVED_TO,
+                                   callbacks=[self.inotify_callback])
         try:
-            if dnotify:
+            if dnotify and not self.inotify:
                 # we must hold an fd open on the directory, so we can get
                 # notified when it changes.
                 self.dnotify = dnotify.DNotify(self.newdir,
@@ -65,11 +86,21 @@ class MaildirService(service.MultiService):
             # dnotify. OverflowError will occur on some 64-bit machines
             # because of a python bug
             log.msg("DNotify failed, falling back to polling")
-        if not self.dnotify:
+        if not self.inotify and not self.dnotify:
             t = internet.TimerService(self.pollinterval, self.poll)
             t.setServiceParent(self)
         self.poll()
 
+    def _stopINotify(self):
+        if self.inotify:
+            self.inotify.loseConnection()
+            self.inotify = None
+
+    def inotify_callback(self, ignored, filepath, mask):
+        # this is called for each new file, so a burst of deliveries is
+        # handled by a single poll
+        self.schedulePoll()
+
     def dnotify_callback(self):
         log.msg("dnotify noticed something, now polling")
 
@@ -82,35 +113,60 @@ class MaildirService(service.MultiService):
         # why, and I'd have to hack qmail to investigate further, so it's
         # easier to just wait a second before yanking the message out of new/
 
-        reactor.callLater(0.1, self.poll)
+        self.schedulePoll()
 
+    def schedulePoll(self):
+        if self.pending_poll is None:
+            self.pending_poll = reactor.callLater(0.1, self._pendingPoll)
+
+    def _pendingPoll(self):
+        self.pending_poll = None
+        self.poll()
 
     def stopService(self):
+        self._stopINotify()
         if self.dnotify:
             self.dnotify.remove()
             self.dnotify = None
+        if self.pending_poll is not None:
+            self.pending_poll.cancel()
+            self.pending_poll = None
         return service.MultiService.stopService(self)
 
     def poll(self):
         assert self.basedir
-        # see what's new
-        for f in self.files:
-            if not os.path.isfile(os.path.join(self.newdir, f)):
-                self.files.remove(f)
+        # see what's new, and forget the messages which have gone
+        current = set(os.listdir(self.newdir))
+        self.files &= current
         newfiles = []
-        for f in os.listdir(self.newdir):
-            if not f in self.files:
-                newfiles.append(f)
-        self.files.extend(newfiles)
-        # TODO: sort by ctime, then filename, since safecat uses a rather
+        for f in current - self.files:
+            try:
+                ctime = os.stat(os.path.join(self.newdir, f)).st_ctime
+            except OSError:
+                continue # it has gone already
+            newfiles.append((ctime, f))
+        if not newfiles:
+            return
+        # sort by ctime, then filename, since safecat uses a rather
         # fine-grained timestamp in the filename
-        for n in newfiles:
-            # TODO: consider catching exceptions in messageReceived
-            self.messageReceived(n)
+        newfiles.sort()
+        newfiles = [ f for (ctime, f) in newfiles ]
+        self.files.update(newfiles)
+        self.messagesReceived(newfiles)
+
+    def messagesReceived(self, filenames):
+        """Called with a list of new files, oldest first. Calls
+        self.messageReceived() for each of them; override this to handle
+        them all at once."""
+        for filename in filenames:
+            try:
+                self.messageReceived(filename)
+            except:
+                log.msg("error while handling new message %s" % filename)
+                log.err()
 
     def messageReceived(self, filename):
         """Called when a new file is noticed. Will call
         self.parent.messageReceived() with a path relative to maildir/new.
         Should probably be overridden in subclasses."""
         self.parent.messageReceived(filename)
-
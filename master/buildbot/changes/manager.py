@@ -102,11 +102,7 @@ class ChangeManager(service.MultiService):
     def addChange(self, change):
         """Deliver a file change event. The event should be a Change object.
         This method will timestamp the object as it is received."""
-        msg = ("adding change, who %s, %d files, rev=%s, branch=%s, repository=%s, "
-                "comments %s, category %s, project %s" % (change.who, len(change.files),
-                                              change.revision, change.branch, change.repository,
-                                              change.comments, change.category, change.project))
-        log.msg(msg.encode('utf-8', 'replace'))
+        self._logChange(change)
 
         # this sets change.number, if it wasn't already set (by the
         # migration-from-pickle code). It also fires a notification which
@@ -115,6 +111,24 @@ class ChangeManager(service.MultiService):
 
         self.pruneChanges(change.number)
 
+    def addChanges(self, changes):
+        """Deliver several Change objects at once, oldest first. They are
+        added to the database in a single transaction, and the Schedulers
+        are woken once for all of them."""
+        if not changes:
+            return
+        for change in changes:
+            self._logChange(change)
+        self.parent.addChanges(changes)
+        self.pruneChanges(changes[-1].number)
+
+    def _logChange(self, change):
+        msg = ("adding change, who %s, %d files, rev=%s, branch=%s, repository=%s, "
+                "comments %s, category %s, project %s" % (change.who, len(change.files),
+                                              change.revision, change.branch, change.repository,
+                                              change.comments, change.category, change.project))
+        log.msg(msg.encode('utf-8', 'replace'))
+
     def pruneChanges(self, last_added_changeid):
         # this is an expensive operation, so only do it once per second, in case
         # addChanges is called frequently
@@ -1,11 +1,11 @@
-# -*- test-case-name: buildbot.test.test_svnpoller -*-
+# -*- test-case-name: buildbot.test.unit.test_svnpoller -*-
 
 # Based on the work of Dave Peticolas for the P4poll
 # Changed to svn (using xml.dom.minidom) by Niklaus Giger
 # Hacked beyond recognition by Brian Warner
 
-from twisted.python import log
-from twisted.internet import defer, reactor, utils
+from twisted.python import log, failure
+from twisted.internet import defer, reactor, utils, protocol, error
 from twisted.internet.task import LoopingCall
 
 from buildbot import util
@@ -13,6 +13,7 @@ from buildbot.changes import base
 from buildbot.changes.changes import Change
 
 import xml.dom.minidom
+import xml.parsers.expat
 import os, urllib
 
 def _assert(condition, msg):
@@ -36,6 +37,111 @@ def split_file_branches(path):
     else:
         return None
 
+class LogEntry:
+    """One revision from 'svn log --xml --verbose'. paths is a list of
+    (action, path) tuples, or None if the log had no <paths> element."""
+    def __init__(self, revision):
+        self.revision = revision
+        self.author = "<unknown>"
+        self.msg = "<unknown>"
+        self.paths = None
+
+class SVNLogParser:
+    """I parse the output of 'svn log --xml' into a list of L{LogEntry}
+    objects, oldest first. I use an event-driven (expat) parser, so the
+    output can be fed to me in pieces as it arrives, and no document tree is
+    built for it."""
+
+    def __init__(self):
+        self.entries = []
+        self.entry = None
+        self.text = None
+        self.action = None
+        self.parser = xml.parsers.expat.ParserCreate()
+        self.parser.buffer_text = True
+        self.parser.StartElementHandler = self.startElement
+        self.parser.EndElementHandler = self.endElement
+        self.parser.CharacterDataHandler = self.characters
+
+    def feed(self, data):
+        self.parser.Parse(data, False)
+
+    def close(self):
+        self.parser.Parse("", True)
+        # svn lists the newest first, unless asked for an ascending range
+        entries = [ (e.revision, e) for e in self.entries ]
+        entries.sort()
+        return [ e for (revision, e) in entries ]
+
+    def startElement(self, name, attrs):
+        if name == "logentry":
+            self.entry = LogEntry(int(attrs["revision"]))
+        elif self.entry is None:
+            return
+        elif name == "paths":
+            self.entry.paths = []
+        elif name in ("author", "msg", "path"):
+            self.text = []
+            self.action = attrs.get("action")
+
+    def characters(self, data):
+        if self.text is not None:
+            self.text.append(data)
+
+    def endElement(self, name):
+        if self.entry is None:
+            return
+        if name == "logentry":
+            self.entries.append(self.entry)
+            self.entry = None
+        elif self.text is None:
+            return
+        elif name == "author":
+            self.entry.author = "".join(self.text)
+        elif name == "msg":
+            self.entry.msg = "".join(self.text)
+        elif name == "path":
+            self.entry.paths.append((self.action, "".join(self.text)))
+        self.text = None
+
+class SVNLogProtocol(protocol.ProcessProtocol):
+    """I feed the output of 'svn log --xml' to an L{SVNLogParser} as it
+    arrives, and fire my Deferred with the parsed entries when svn exits."""
+
+    def __init__(self, parser, d):
+        self.parser = parser
+        self.d = d
+        self.stderr = []
+        self.failure = None
+
+    def outReceived(self, data):
+        if self.failure is not None:
+            return
+        try:
+            self.parser.feed(data)
+        except:
+            # most likely an ExpatError, but garbled output can upset the
+            # parser's handlers too
+            self.failure = failure.Failure()
+
+    def errReceived(self, data):
+        self.stderr.append(data)
+
+    def processEnded(self, reason):
+        if self.failure is None and not reason.check(error.ProcessDone):
+            self.failure = failure.Failure(EnvironmentError(
+                "svn log failed: %s" % "".join(self.stderr)))
+        if self.failure is None:
+            try:
+                entries = self.parser.close()
+            except xml.parsers.expat.ExpatError:
+                self.failure = failure.Failure()
+        if self.failure is not None:
+            log.msg("SVNPoller: svn log failed: %s" % self.failure.value)
+            self.d.errback(self.failure)
+        else:
+            self.d.callback(entries)
+
 
 class SVNPoller(base.ChangeSource, util.ComparableMixin):
     """This source will poll a Subversion repository for changes and submit
@@ -50,6 +156,9 @@ class SVNPoller(base.ChangeSource, util.ComparableMixin):
     last_change = None
     loop = None
     working = False
+    # the poll interval is doubled, up to this many times pollinterval, when
+    # a poll takes more than half of the interval or overruns it
+    max_backoff = 8
 
     def __init__(self, svnurl, split_file=None,
                  svnuser=None, svnpasswd=None,
@@ -147,14 +256,16 @@ class SVNPoller(base.ChangeSource, util.ComparableMixin):
                              is 600 seconds (10 minutes). Smaller values
                              decrease the latency between the time a change
                              is recorded and the time the buildbot notices
-                             it, but it also increases the system load.
+                             it, but it also increases the system load. If
+                             polls are slow, the interval is lengthened (up
+                             to max_backoff times pollinterval) until they
+                             speed up again.
 
         @type  histmax:      int
-        @param histmax:      maximum number of changes to look back through.
-                             The default is 100. Smaller values decrease
-                             system load, but if more than histmax changes
-                             are recorded between polls, the extra ones will
-                             be silently lost.
+        @param histmax:      maximum number of new revisions to fetch in one
+                             poll. The default is 100. If more than histmax
+                             revisions are committed between polls, the rest
+                             are fetched by the following polls.
 
         @type  svnbin:       string
         @param svnbin:       path to svn binary, defaults to just 'svn'. Use
@@ -196,6 +307,8 @@ class SVNPoller(base.ChangeSource, util.ComparableMixin):
         self.histmax = histmax
         self._prefix = None
         self.overrun_counter = 0
+        self.overrun = False
+        self.poll_started = None
         self.loop = LoopingCall(self.checksvn)
         self.category = category
         self.project = project
@@ -258,8 +371,10 @@ class SVNPoller(base.ChangeSource, util.ComparableMixin):
             log.msg("SVNPoller(%s) overrun: timer fired but the previous "
                     "poll had not yet finished." % self.svnurl)
             self.overrun_counter += 1
+            self.overrun = True
             return defer.succeed(None)
         self.working = True
+        self.poll_started = self.loop.clock.seconds()
 
         if self.project:
             log.msg("SVNPoller polling " + self.project)
@@ -275,7 +390,6 @@ class SVNPoller(base.ChangeSource, util.ComparableMixin):
             d = defer.succeed(self._prefix)
 
         d.addCallback(self.get_logs)
-        d.addCallback(self.parse_logs)
         d.addCallback(self.get_new_logentries)
         d.addCallback(self.create_changes)
         d.addCallback(self.submit_changes)
@@ -324,35 +438,42 @@ class SVNPoller(base.ChangeSource, util.ComparableMixin):
 
     def get_logs(self, ignored_prefix=None):
         args = []
-        args.extend(["log", "--xml", "--verbose", "--non-interactive"])
+        args.extend(["log", "--xml", "--non-interactive"])
         if self.svnuser:
             args.extend(["--username=%s" % self.svnuser])
         if self.svnpasswd:
             args.extend(["--password=%s" % self.svnpasswd])
-        args.extend(["--limit=%d" % (self.histmax), self.svnurl])
-        d = self.getProcessOutput(args)
+        if self.last_change is None:
+            # the first time, we only need the most recent revision
+            args.extend(["--limit=1"])
+        else:
+            # only ask for what is new, oldest first. The range starts at
+            # the last revision we saw, because svn rejects a range that
+            # starts after HEAD.
+            args.extend(["--verbose",
+                         "--revision=%d:HEAD" % self.last_change,
+                         "--limit=%d" % (self.histmax + 1)])
+        args.append(self.svnurl)
+        d = self.getLogEntries(args)
         return d
 
-    def parse_logs(self, output):
-        # parse the XML output, return a list of <logentry> nodes
-        try:
-            doc = xml.dom.minidom.parseString(output)
-        except xml.parsers.expat.ExpatError:
-            log.msg("SVNPoller.parse_logs: ExpatError in '%s'" % output)
-            raise
-        logentries = doc.getElementsByTagName("logentry")
-        return logentries
-
+    def getLogEntries(self, args):
+        # this exists so we can override it during the unit tests
+        d = defer.Deferred()
+        p = SVNLogProtocol(SVNLogParser(), d)
+        reactor.spawnProcess(p, self.svnbin, [self.svnbin] + args,
+                             env=self.environ)
+        return d
 
     def _filter_new_logentries(self, logentries, last_change):
-        # given a list of logentries, return a tuple of (new_last_change,
-        # new_logentries), where new_logentries contains only the ones after
-        # last_change
+        # given a list of logentries, oldest first, return a tuple of
+        # (new_last_change, new_logentries), where new_logentries contains
+        # only the ones after last_change
         if not logentries:
-            # no entries, so last_change must stay at None
-            return (None, [])
+            # no entries, so last_change stays where it is
+            return (last_change, [])
 
-        mostRecent = int(logentries[0].getAttribute("revision"))
+        mostRecent = logentries[-1].revision
 
         if last_change is None:
             # if this is the first time we've been run, ignore any changes
@@ -361,18 +482,13 @@ class SVNPoller(base.ChangeSource, util.ComparableMixin):
             log.msg('svnPoller: starting at change %s' % mostRecent)
             return (mostRecent, [])
 
-        if last_change == mostRecent:
+        new_logentries = [ el for el in logentries
+                           if el.revision > last_change ]
+        if not new_logentries:
             # an unmodified repository will hit this case
             log.msg('svnPoller: _process_changes last %s mostRecent %s' % (
                       last_change, mostRecent))
-            return (mostRecent, [])
-
-        new_logentries = []
-        for el in logentries:
-            if last_change == int(el.getAttribute("revision")):
-                break
-            new_logentries.append(el)
-        new_logentries.reverse() # return oldest first
+            return (last_change, [])
         return (mostRecent, new_logentries)
 
     def get_new_logentries(self, logentries):
@@ -386,14 +502,6 @@ class SVNPoller(base.ChangeSource, util.ComparableMixin):
         return new_logentries
 
 
-    def _get_text(self, element, tag_name):
-        try:
-            child_nodes = element.getElementsByTagName(tag_name)[0].childNodes
-            text = "".join([t.data for t in child_nodes])
-        except:
-            text = "<unknown>"
-        return text
-
     def _transform_path(self, path):
         _assert(path.startswith(self._prefix),
                 "filepath '%s' should start with prefix '%s'" %
@@ -409,7 +517,7 @@ class SVNPoller(base.ChangeSource, util.ComparableMixin):
         changes = []
 
         for el in new_logentries:
-            revision = str(el.getAttribute("revision"))
+            revision = str(el.revision)
 
             revlink=''
 
@@ -420,8 +528,8 @@ class SVNPoller(base.ChangeSource, util.ComparableMixin):
             log.msg("Adding change revision %s" % (revision,))
             # TODO: the rest of buildbot may not be ready for unicode 'who'
             # values
-            author   = self._get_text(el, "author")
-            comments = self._get_text(el, "msg")
+            author   = el.author
+            comments = el.msg
             # there is a "date" field, but it provides localtime in the
             # repository's timezone, whereas we care about buildmaster's
             # localtime (since this will get used to position the boxes on
@@ -431,15 +539,11 @@ class SVNPoller(base.ChangeSource, util.ComparableMixin):
             #when     = time.mktime(time.strptime("%.19s" % when,
             #                                     "%Y-%m-%dT%H:%M:%S"))
             branches = {}
-            try:
-                pathlist = el.getElementsByTagName("paths")[0]
-            except IndexError: # weird, we got an empty revision
+            if el.paths is None: # weird, we got an empty revision
                 log.msg("ignoring commit with no paths")
                 continue
 
-            for p in pathlist.getElementsByTagName("path"):
-                action = p.getAttribute("action")
-                path = "".join([t.data for t in p.childNodes])
+            for action, path in el.paths:
                 # the rest of buildbot is certaily not yet ready to handle
                 # unicode filenames, because they get put in RemoteCommands
                 # which get sent via PB to the buildslave, and PB doesn't
@@ -482,17 +586,37 @@ class SVNPoller(base.ChangeSource, util.ComparableMixin):
         return changes
 
     def submit_changes(self, changes):
-        for c in changes:
-            self.parent.addChange(c)
+        if changes:
+            self.parent.addChanges(changes)
 
     def finished_ok(self, res):
         log.msg("SVNPoller finished polling %s" % res)
         assert self.working
         self.working = False
+        self.adjust_interval()
         return res
 
     def finished_failure(self, f):
         log.msg("SVNPoller failed %s" % f)
         assert self.working
         self.working = False
+        self.adjust_interval()
         return None # eat the failure
+
+    def adjust_interval(self):
+        """Back off when the last poll was slow, or the timer fired while it
+        was still running, and return towards pollinterval when polls are
+        quick again."""
+        if not self.loop.running:
+            return
+        elapsed = self.loop.clock.seconds() - self.poll_started
+        interval = self.loop.interval
+        if self.overrun or elapsed > interval / 2.0:
+            interval = min(interval * 2, self.pollinterval * self.max_backoff)
+        elif interval > self.pollinterval:
+            interval = max(interval / 2, self.pollinterval)
+        self.overrun = False
+        if interval != self.loop.interval:
+            log.msg("SVNPoller(%s): poll took %.1fs, polling every %ds" %
+                    (self.svnurl, elapsed, interval))
+            self.loop.interval = interval
@@ -37,7 +37,7 @@
 #
 # ***** END LICENSE BLOCK *****
 
-import sys, collections, base64
+import sys, collections, base64, traceback
 
 from twisted.python import log, threadable
 from twisted.internet import defer
@@ -51,6 +51,7 @@ from buildbot.process.properties import Properties
 from buildbot.status.builder import SUCCESS, WARNINGS, FAILURE
 from buildbot.util.eventual import eventually
 from buildbot.util import json
+from buildbot.db import stats
 
 # Don't auto-resubmit queries that encounter a broken connection: let them
 # fail. Use the "notification doorbell" thing to provide the retry. Set
@@ -58,14 +59,51 @@ from buildbot.util import json
 # ConnectionPool to reconnect next time.
 
 class MyTransaction(adbapi.Transaction):
+    query_stats = None # set by DBConnector
+
     def execute(self, *args, **kwargs):
         #print "Q", args, kwargs
-        return self._cursor.execute(*args, **kwargs)
+        start = util.now()
+        try:
+            return self._cursor.execute(*args, **kwargs)
+        finally:
+            self.query_stats.addQuery(args[0], util.now() - start, 'async')
+    def executemany(self, *args, **kwargs):
+        start = util.now()
+        try:
+            return self._cursor.executemany(*args, **kwargs)
+        finally:
+            self.query_stats.addQuery(args[0], util.now() - start, 'async')
     def fetchall(self):
         rc = self._cursor.fetchall()
         #print " F", rc
         return rc
 
+class TimedCursor:
+    """I wrap a DBAPI cursor used by the synchronous (*Now) methods, and
+    record the time taken by each query."""
+
+    def __init__(self, cursor, query_stats):
+        self._cursor = cursor
+        self._query_stats = query_stats
+
+    def execute(self, *args, **kwargs):
+        start = util.now()
+        try:
+            return self._cursor.execute(*args, **kwargs)
+        finally:
+            self._query_stats.addQuery(args[0], util.now() - start, 'sync')
+
+    def executemany(self, *args, **kwargs):
+        start = util.now()
+        try:
+            return self._cursor.executemany(*args, **kwargs)
+        finally:
+            self._query_stats.addQuery(args[0], util.now() - start, 'sync')
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
 def _one_or_else(res, default=None, process_f=lambda x: x):
     if not res:
         return default
@@ -100,8 +138,14 @@ class DBConnector(util.ComparableMixin):
         # different style, we'll replace them.
         self.paramstyle = self._dbapi.paramstyle
 
+        self.query_stats = stats.QueryStats()
+
         self._pool = spec.get_async_connection_pool()
-        self._pool.transactionFactory = MyTransaction
+        def makeTransaction(pool, connection):
+            t = MyTransaction(pool, connection)
+            t.query_stats = self.query_stats
+            return t
+        self._pool.transactionFactory = makeTransaction
         # the pool must be started before it can be used. The real
         # buildmaster process will do this at reactor start. CLI tools (like
         # "buildbot upgrade-master") must do it manually. Unit tests are run
@@ -114,6 +158,7 @@ class DBConnector(util.ComparableMixin):
         self._subscribers = bbcollections.defaultdict(set)
 
         self._pending_operation_count = 0
+        self.log_sync_calls = False
 
         self._started = False
 
@@ -213,6 +258,26 @@ class DBConnector(util.ComparableMixin):
         finally:
             self._end_operation(t)
             self._add_query_time(start)
+            if self.log_sync_calls and threadable.isInIOThread():
+                self._log_sync_call(interaction, args, start)
+
+    def setLogSyncCalls(self, log_sync_calls):
+        """When enabled, every synchronous (*Now) call made from the reactor
+        thread is logged, with its duration and a stack trace, so that the
+        callers which block the reactor can be found and made
+        asynchronous."""
+        self.log_sync_calls = log_sync_calls
+
+    def _log_sync_call(self, interaction, args, start):
+        elapsed = self._getCurrentTime() - start
+        if interaction == self._runQuery:
+            what = "query %r" % (args[0],)
+        else:
+            what = getattr(interaction, "__name__", repr(interaction))
+        # leave out this method and runInteractionNow
+        stack = "".join(traceback.format_stack()[:-2])
+        log.msg("synchronous DB call on the reactor thread: %s took %.3fs\n%s"
+                % (what, elapsed, stack))
 
     def get_sync_connection(self):
         # This is a wrapper around spec.get_sync_connection that maintains a
@@ -232,7 +297,7 @@ class DBConnector(util.ComparableMixin):
 
     def _runInteractionNow(self, interaction, *args, **kwargs):
         conn = self.get_sync_connection()
-        c = conn.cursor()
+        c = TimedCursor(conn.cursor(), self.query_stats)
         try:
             result = interaction(c, *args, **kwargs)
             c.close()
@@ -273,7 +338,8 @@ class DBConnector(util.ComparableMixin):
         self._pending_operation_count += 1
         start = self._getCurrentTime()
         #t = self._start_operation()   # why is this commented out? -warner
-        d = self._pool.runQuery(*args, **kwargs)
+        d = self._pool.runInteraction(self._runPooled, start,
+                                      self._runQuery, *args, **kwargs)
         #d.addBoth(self._runQuery_done, start, t)
         return d
     def _runQuery_done(self, res, start, t):
@@ -288,12 +354,13 @@ class DBConnector(util.ComparableMixin):
         if len(self._query_times) > self.MAX_QUERY_TIMES:
             self._query_times.popleft()
 
-    def runInteraction(self, *args, **kwargs):
+    def runInteraction(self, interaction, *args, **kwargs):
         assert self._started
         self._pending_operation_count += 1
         start = self._getCurrentTime()
         t = self._start_operation()
-        d = self._pool.runInteraction(*args, **kwargs)
+        d = self._pool.runInteraction(self._runPooled, start,
+                                      interaction, *args, **kwargs)
         d.addBoth(self._runInteraction_done, start, t)
         return d
     def _runInteraction_done(self, res, start, t):
@@ -302,11 +369,33 @@ class DBConnector(util.ComparableMixin):
         self._pending_operation_count -= 1
         return res
 
+    def _runPooled(self, t, queued, interaction, *args, **kwargs):
+        # this runs in a pool thread, once a connection is available
+        self.query_stats.addPoolWait(self._getCurrentTime() - queued)
+        return interaction(t, *args, **kwargs)
+
+    def setSlowQueryTime(self, slow_query_time):
+        """Log any query which takes longer than this many seconds. None
+        disables the log."""
+        self.query_stats.setSlowQueryTime(slow_query_time)
+
     # ChangeManager methods
 
     def addChangeToDatabase(self, change):
-        self.runInteractionNow(self._txn_addChangeToDatabase, change)
-        self._change_cache.add(change.number, change)
+        self.addChangesToDatabase([change])
+
+    def addChangesToDatabase(self, changes):
+        """Add several changes, in order, in a single transaction. The
+        Schedulers are woken once for all of them."""
+        self.runInteractionNow(self._txn_addChangesToDatabase, changes)
+        for change in changes:
+            self._change_cache.add(change.number, change)
+
+    def _txn_addChangesToDatabase(self, t, changes):
+        for change in changes:
+            self._txn_addChangeToDatabase(t, change)
+        if changes:
+            self.notify("add-change", *[c.number for c in changes])
 
     def _txn_addChangeToDatabase(self, t, change):
         q = self.quoteq("INSERT INTO changes"
@@ -326,21 +415,22 @@ class DBConnector(util.ComparableMixin):
         t.execute(q, values)
         change.number = t.lastrowid
 
-        for link in change.links:
-            t.execute(self.quoteq("INSERT INTO change_links (changeid, link) "
-                                  "VALUES (?,?)"),
-                      (change.number, link))
-        for filename in change.files:
-            t.execute(self.quoteq("INSERT INTO change_files (changeid,filename)"
-                                  " VALUES (?,?)"),
-                      (change.number, filename))
-        for propname,propvalue in change.properties.properties.items():
-            encoded_value = json.dumps(propvalue)
-            t.execute(self.quoteq("INSERT INTO change_properties"
-                                  " (changeid, property_name, property_value)"
-                                  " VALUES (?,?,?)"),
-                      (change.number, propname, encoded_value))
-        self.notify("add-change", change.number)
+        if change.links:
+            t.executemany(self.quoteq("INSERT INTO change_links"
+                                      " (changeid, link) VALUES (?,?)"),
+                          [(change.number, link) for link in change.links])
+        if change.files:
+            t.executemany(self.quoteq("INSERT INTO change_files"
+                                      " (changeid,filename) VALUES (?,?)"),
+                          [(change.number, filename)
+                           for filename in change.files])
+        if change.properties.properties:
+            t.executemany(self.quoteq("INSERT INTO change_properties"
+                                      " (changeid, property_name,"
+                                      "  property_value) VALUES (?,?,?)"),
+                          [(change.number, propname, json.dumps(propvalue))
+                           for propname,propvalue
+                           in change.properties.properties.items()])
 
     def changeEventGenerator(self, branches=[], categories=[], committers=[], minTime=0):
         q = "SELECT changeid FROM changes"
@@ -362,122 +452,161 @@ class DBConnector(util.ComparableMixin):
             q += " AND ".join(pieces)
         q += " ORDER BY changeid DESC"
         rows = self.runQueryNow(q, tuple(args))
-        for (changeid,) in rows:
-            yield self.getChangeNumberedNow(changeid)
+        changeids = [changeid for (changeid,) in rows]
+        # fetch the changes a batch at a time, as they are consumed
+        while changeids:
+            batch, changeids = changeids[:100], changeids[100:]
+            for c in self.getChangesByIdsNow(batch):
+                yield c
 
     def getLatestChangeNumberNow(self, branch=None, t=None):
         if t:
             return self._txn_getLatestChangeNumber(branch=branch, t=t)
         else:
-            return self.runInteractionNow(self._txn_getLatestChangeNumber)
-    def _txn_getLatestChangeNumber(self, branch, t):
-        args = None
+            return self.runInteractionNow(self._txn_getLatestChangeNumber,
+                                          branch=branch)
+    def _txn_getLatestChangeNumber(self, t, branch):
+        br_clause = ""
+        args = ()
         if branch:
-            br_clause = "WHERE branch =? "
+            br_clause = " WHERE branch =? "
             args = ( branch, )
         q = self.quoteq("SELECT max(changeid) from changes"+ br_clause)
         t.execute(q, args)
         row = t.fetchone()
-        if not row:
+        if not row or row[0] is None:
             return 0
         return row[0]
 
     def getChangeNumberedNow(self, changeid, t=None):
         # this is a synchronous/blocking version of getChangeByNumber
         assert changeid >= 0
-        c = self._change_cache.get(changeid)
-        if c:
-            return c
-        if t:
-            c = self._txn_getChangeNumberedNow(t, changeid)
-        else:
-            c = self.runInteractionNow(self._txn_getChangeNumberedNow, changeid)
-        self._change_cache.add(changeid, c)
-        return c
-    def _txn_getChangeNumberedNow(self, t, changeid):
-        q = self.quoteq("SELECT author, comments,"
-                        " is_dir, branch, revision, revlink,"
-                        " when_timestamp, category,"
-                        " repository, project"
-                        " FROM changes WHERE changeid = ?")
-        t.execute(q, (changeid,))
-        rows = t.fetchall()
-        if not rows:
-            return None
-        (who, comments,
-         isdir, branch, revision, revlink,
-         when, category, repository, project) = rows[0]
-        branch = str_or_none(branch)
-        revision = str_or_none(revision)
-        q = self.quoteq("SELECT link FROM change_links WHERE changeid=?")
-        t.execute(q, (changeid,))
-        rows = t.fetchall()
-        links = [row[0] for row in rows]
-        links.sort()
-
-        q = self.quoteq("SELECT filename FROM change_files WHERE changeid=?")
-        t.execute(q, (changeid,))
-        rows = t.fetchall()
-        files = [row[0] for row in rows]
-        files.sort()
-
-        p = self.get_properties_from_db("change_properties", "changeid",
-                                        changeid, t)
-        c = Change(who=who, files=files, comments=comments, isdir=isdir,
-                   links=links, revision=revision, when=when,
-                   branch=branch, category=category, revlink=revlink,
-                   repository=repository, project=project)
-        c.properties.updateFromProperties(p)
-        c.number = changeid
-        return c
+        return self.getChangesByIdsNow([changeid], t)[0]
 
     def getChangeByNumber(self, changeid):
         # return a Deferred that fires with a Change instance, or None if
         # there is no Change with that number
         assert changeid >= 0
-        c = self._change_cache.get(changeid)
-        if c:
-            return defer.succeed(c)
-        d1 = self.runQuery(self.quoteq("SELECT author, comments,"
-                                       " is_dir, branch, revision, revlink,"
-                                       " when_timestamp, category,"
-                                       " repository, project"
-                                       " FROM changes WHERE changeid = ?"),
-                           (changeid,))
-        d2 = self.runQuery(self.quoteq("SELECT link FROM change_links"
-                                       " WHERE changeid=?"),
-                           (changeid,))
-        d3 = self.runQuery(self.quoteq("SELECT filename FROM change_files"
-                                       " WHERE changeid=?"),
-                           (changeid,))
-        d4 = self.runInteraction(self._txn_get_properties_from_db,
-                "change_properties", "changeid", changeid)
-        d = defer.gatherResults([d1,d2,d3,d4])
-        d.addCallback(self._getChangeByNumber_query_done, changeid)
+        d = self.getChangesByIds([changeid])
+        d.addCallback(lambda changes: changes[0])
         return d
 
-    def _getChangeByNumber_query_done(self, res, changeid):
-        (rows, link_rows, file_rows, properties) = res
-        if not rows:
-            return None
-        (who, comments,
-         isdir, branch, revision, revlink,
-         when, category, repository, project) = rows[0]
-        branch = str_or_none(branch)
-        revision = str_or_none(revision)
-        links = [row[0] for row in link_rows]
-        links.sort()
-        files = [row[0] for row in file_rows]
-        files.sort()
-
-        c = Change(who=who, files=files, comments=comments, isdir=isdir,
-                   links=links, revision=revision, when=when,
-                   branch=branch, category=category, revlink=revlink,
-                   repository=repository, project=project)
-        c.properties.updateFromProperties(properties)
-        c.number = changeid
-        self._change_cache.add(changeid, c)
-        return c
+    def getChangesByIdsNow(self, changeids, t=None):
+        """Return a list of Change instances for the given changeids, in the
+        same order, with None for any changeid that does not exist. Changes
+        that are not in the cache are fetched in batches, with four queries
+        per batch rather than four per change."""
+        changes, missing = self._getCachedChanges(changeids)
+        if missing:
+            if t:
+                fetched = self._txn_getChangesByIds(t, missing)
+            else:
+                fetched = self.runInteractionNow(self._txn_getChangesByIds,
+                                                 missing)
+            self._cacheChanges(fetched)
+            changes.update(fetched)
+        return [changes.get(changeid) for changeid in changeids]
+
+    def getChangesByIds(self, changeids):
+        """Like getChangesByIdsNow, but return a Deferred that fires with the
+        list of Change instances."""
+        changes, missing = self._getCachedChanges(changeids)
+        if not missing:
+            return defer.succeed([changes.get(changeid)
+                                  for changeid in changeids])
+        d = self.runInteraction(self._txn_getChangesByIds, missing)
+        def fetched(fetched):
+            self._cacheChanges(fetched)
+            changes.update(fetched)
+            return [changes.get(changeid) for changeid in changeids]
+        d.addCallback(fetched)
+        return d
+
+    def _getCachedChanges(self, changeids):
+        # returns a dict of the cached changes, and a list of the (distinct)
+        # changeids that must be fetched
+        changes = {}
+        missing = []
+        seen = set()
+        for changeid in changeids:
+            if changeid in seen:
+                continue
+            seen.add(changeid)
+            c = self._change_cache.get(changeid)
+            if c:
+                changes[changeid] = c
+            else:
+                missing.append(changeid)
+        return changes, missing
+
+    def _cacheChanges(self, changes):
+        for changeid, c in changes.items():
+            self._change_cache.add(changeid, c)
+
+    def _txn_getChangesByIds(self, t, changeids):
+        # returns a dict mapping changeid to Change, for those changeids
+        # which exist. This must not touch the cache, since it may run in a
+        # thread.
+        changes = {}
+        changeids = list(changeids)
+        while changeids:
+            # sqlite has a maximum of 999 parameters, so stay well short
+            batch, changeids = changeids[:100], changeids[100:]
+            changes.update(self._txn_getChangesBatch(t, batch))
+        return changes
+
+    def _txn_getChangesBatch(self, t, changeids):
+        where = " WHERE changeid IN " + self.parmlist(len(changeids))
+        args = tuple(changeids)
+
+        t.execute(self.quoteq("SELECT changeid, author, comments,"
+                              " is_dir, branch, revision, revlink,"
+                              " when_timestamp, category,"
+                              " repository, project"
+                              " FROM changes") + where, args)
+        change_rows = t.fetchall()
+        if not change_rows:
+            return {}
+
+        links = bbcollections.defaultdict(list)
+        t.execute(self.quoteq("SELECT changeid, link FROM change_links")
+                  + where, args)
+        for (changeid, link) in t.fetchall():
+            links[changeid].append(link)
+
+        files = bbcollections.defaultdict(list)
+        t.execute(self.quoteq("SELECT changeid, filename FROM change_files")
+                  + where, args)
+        for (changeid, filename) in t.fetchall():
+            files[changeid].append(filename)
+
+        properties = bbcollections.defaultdict(Properties)
+        t.execute(self.quoteq("SELECT changeid, property_name, property_value"
+                              " FROM change_properties") + where, args)
+        for (changeid, key, valuepair) in t.fetchall():
+            value, source = json.loads(valuepair)
+            properties[changeid].setProperty(str(key), value, source)
+
+        changes = {}
+        for (changeid, who, comments,
+             isdir, branch, revision, revlink,
+             when, category, repository, project) in change_rows:
+            branch = str_or_none(branch)
+            revision = str_or_none(revision)
+            change_links = links.get(changeid, [])
+            change_links.sort()
+            change_files = files.get(changeid, [])
+            change_files.sort()
+            c = Change(who=who, files=change_files, comments=comments,
+                       isdir=isdir, links=change_links, revision=revision,
+                       when=when, branch=branch, category=category,
+                       revlink=revlink, repository=repository,
+                       project=project)
+            if changeid in properties:
+                c.properties.updateFromProperties(properties[changeid])
+            c.number = changeid
+            changes[changeid] = c
+        return changes
 
     def getChangesGreaterThan(self, last_changeid, t=None):
         """Return a Deferred that fires with a list of all Change instances
@@ -493,8 +622,8 @@ class DBConnector(util.ComparableMixin):
     def _txn_getChangesGreaterThan(self, t, last_changeid):
         q = self.quoteq("SELECT changeid FROM changes WHERE changeid > ?")
         t.execute(q, (last_changeid,))
-        changes = [self.getChangeNumberedNow(changeid, t)
-                   for (changeid,) in t.fetchall()]
+        changes = self.getChangesByIdsNow([changeid
+                                           for (changeid,) in t.fetchall()], t)
         changes.sort(key=lambda c: c.number)
         return changes
 
@@ -520,8 +649,7 @@ class DBConnector(util.ComparableMixin):
         return self.runInteractionNow(txn)
 
     def getChangesByNumber(self, changeids):
-        return defer.gatherResults([self.getChangeByNumber(changeid)
-                                    for changeid in changeids])
+        return self.getChangesByIds(changeids)
 
     # SourceStamp-manipulating methods
 
@@ -571,8 +699,8 @@ class DBConnector(util.ComparableMixin):
         r = t.fetchall()
         changes = None
         if r:
-            changes = [self.getChangeNumberedNow(changeid, t)
-                       for (changeid,) in r]
+            changes = self.getChangesByIdsNow([changeid for (changeid,) in r],
+                                              t)
         ss = SourceStamp(branch, revision, patch, changes, project=project, repository=repository)
         ss.ssid = ssid
         return ss
@@ -656,6 +784,20 @@ class DBConnector(util.ComparableMixin):
         assert state_json is not None
         return json.loads(state_json)
 
+    def scheduler_get_states(self, schedulerids, t):
+        # like scheduler_get_state, for many schedulers at once. Returns a
+        # dict mapping schedulerid to state.
+        schedulerids = list(schedulerids)
+        states = {}
+        while schedulerids:
+            batch, schedulerids = schedulerids[:100], schedulerids[100:]
+            q = self.quoteq("SELECT schedulerid, state FROM schedulers"
+                            " WHERE schedulerid IN ") + self.parmlist(len(batch))
+            t.execute(q, batch)
+            for (schedulerid, state_json) in t.fetchall():
+                states[schedulerid] = json.loads(state_json)
+        return states
+
     def scheduler_set_state(self, schedulerid, t, state):
         state_json = json.dumps(state)
         q = self.quoteq("UPDATE schedulers SET state=? WHERE schedulerid=?")
@@ -685,10 +827,10 @@ class DBConnector(util.ComparableMixin):
                               " VALUES (?,?,?,?,?)"),
                   (ss.branch, ss.revision, patchid, ss.project, ss.repository))
         ss.ssid = t.lastrowid
-        q2 = self.quoteq("INSERT INTO sourcestamp_changes"
-                         " (sourcestampid, changeid) VALUES (?,?)")
-        for c in ss.changes:
-            t.execute(q2, (ss.ssid, c.number))
+        if ss.changes:
+            q2 = self.quoteq("INSERT INTO sourcestamp_changes"
+                             " (sourcestampid, changeid) VALUES (?,?)")
+            t.executemany(q2, [(ss.ssid, c.number) for c in ss.changes])
         return ss.ssid
 
     def create_buildset(self, ssid, reason, properties, builderNames, t,
@@ -707,33 +849,51 @@ class DBConnector(util.ComparableMixin):
                                   " (buildsetid, property_name, property_value)"
                                   " VALUES (?,?,?)"),
                       (bsid, propname, encoded_value))
-        brids = []
+        brids = bbcollections.defaultdict(list)
         for bn in builderNames:
             t.execute(self.quoteq("INSERT INTO buildrequests"
                                   " (buildsetid, buildername, submitted_at)"
                                   " VALUES (?,?,?)"),
                       (bsid, bn, now))
-            brid = t.lastrowid
-            brids.append(brid)
+            brids[bn].append(t.lastrowid)
         self.notify("add-buildset", bsid)
-        self.notify("add-buildrequest", *brids)
+        self._notify_buildrequests_added(brids)
         return bsid
 
+    def _notify_buildrequests_added(self, brids_by_builder):
+        # "add-buildrequest" is sent once per builder, as (buildername,
+        # brid..), so that only the builders involved need to wake up
+        for bn, brids in brids_by_builder.items():
+            self.notify("add-buildrequest", bn, *brids)
+
     def scheduler_classify_change(self, schedulerid, number, important, t):
         q = self.quoteq("INSERT INTO scheduler_changes"
                         " (schedulerid, changeid, important)"
                         " VALUES (?,?,?)")
         t.execute(q, (schedulerid, number, bool(important)))
 
+    def scheduler_classify_changes(self, schedulerid, classifications, t):
+        # classifications is a list of (changeid, important) pairs, which
+        # are inserted with a single executemany()
+        if not classifications:
+            return
+        q = self.quoteq("INSERT INTO scheduler_changes"
+                        " (schedulerid, changeid, important)"
+                        " VALUES (?,?,?)")
+        t.executemany(q, [(schedulerid, number, bool(important))
+                          for (number, important) in classifications])
+
     def scheduler_get_classified_changes(self, schedulerid, t):
         q = self.quoteq("SELECT changeid, important"
                         " FROM scheduler_changes"
                         " WHERE schedulerid=?")
         t.execute(q, (schedulerid,))
+        rows = t.fetchall()
+        changes = self.getChangesByIdsNow([changeid for (changeid, i) in rows],
+                                          t)
         important = []
         unimportant = []
-        for (changeid, is_important) in t.fetchall():
-            c = self.getChangeNumberedNow(changeid, t)
+        for ((changeid, is_important), c) in zip(rows, changes):
             if is_important:
                 important.append(c)
             else:
@@ -741,6 +901,7 @@ class DBConnector(util.ComparableMixin):
         return (important, unimportant)
 
     def scheduler_retire_changes(self, schedulerid, changeids, t):
+        changeids = list(changeids) # in case it's a set
         while changeids:
             # sqlite has a maximum of 999 parameters, but we'll try to come in far
             # short of that
@@ -788,25 +949,76 @@ class DBConnector(util.ComparableMixin):
         return br
     def _txn_getBuildRequestWithNumber(self, t, brid):
         assert isinstance(brid, (int, long))
-        t.execute(self.quoteq("SELECT br.buildsetid, bs.reason,"
-                              " bs.sourcestampid, br.buildername,"
-                              " bs.submitted_at, br.priority"
-                              " FROM buildrequests AS br, buildsets AS bs"
-                              " WHERE br.id=? AND br.buildsetid=bs.id"),
-                  (brid,))
-        r = t.fetchall()
-        if not r:
-            return None
-        (bsid, reason, ssid, builder_name, submitted_at, priority) = r[0]
-        ss = self.getSourceStampNumberedNow(ssid, t)
-        properties = self.get_properties_from_db("buildset_properties",
-                                                 "buildsetid", bsid, t)
-        br = BuildRequest(reason, ss, builder_name, properties)
-        br.submittedAt = submitted_at
-        br.priority = priority
-        br.id = brid
-        br.bsid = bsid
-        return br
+        return self._txn_getBuildRequestsWithNumbers(t, [brid])[0]
+
+    def getBuildRequestsWithNumbers(self, brids, t=None):
+        """Return a list of BuildRequest instances for the given brids, in
+        the same order, with None for any brid that does not exist. The
+        requests are fetched in batches, and requests from the same buildset
+        share their sourcestamp and property lookups."""
+        if t:
+            return self._txn_getBuildRequestsWithNumbers(t, brids)
+        else:
+            return self.runInteractionNow(
+                    self._txn_getBuildRequestsWithNumbers, brids)
+    def _txn_getBuildRequestsWithNumbers(self, t, brids):
+        rows = {}
+        remaining = list(brids)
+        while remaining:
+            # sqlite has a maximum of 999 parameters, so stay well short
+            batch, remaining = remaining[:100], remaining[100:]
+            t.execute(self.quoteq("SELECT br.id, br.buildsetid, bs.reason,"
+                                  " bs.sourcestampid, br.buildername,"
+                                  " bs.submitted_at, br.priority"
+                                  " FROM buildrequests AS br, buildsets AS bs"
+                                  " WHERE br.buildsetid=bs.id AND br.id IN ")
+                      + self.parmlist(len(batch)),
+                      tuple(batch))
+            for row in t.fetchall():
+                rows[row[0]] = row[1:]
+
+        sourcestamps = {}
+        bsids = set()
+        for (bsid, reason, ssid, builder_name,
+             submitted_at, priority) in rows.values():
+            if ssid not in sourcestamps:
+                sourcestamps[ssid] = self.getSourceStampNumberedNow(ssid, t)
+            bsids.add(bsid)
+        properties = self._txn_get_buildset_properties(t, bsids)
+
+        requests = []
+        for brid in brids:
+            if brid not in rows:
+                requests.append(None)
+                continue
+            (bsid, reason, ssid, builder_name,
+             submitted_at, priority) = rows[brid]
+            br = BuildRequest(reason, sourcestamps[ssid], builder_name,
+                              properties[bsid])
+            br.submittedAt = submitted_at
+            br.priority = priority
+            br.id = brid
+            br.bsid = bsid
+            requests.append(br)
+        return requests
+
+    def _txn_get_buildset_properties(self, t, bsids):
+        # returns a dict mapping each of the given bsids to its Properties
+        properties = {}
+        for bsid in bsids:
+            properties[bsid] = Properties()
+        bsids = list(bsids)
+        while bsids:
+            batch, bsids = bsids[:100], bsids[100:]
+            t.execute(self.quoteq("SELECT buildsetid, property_name,"
+                                  " property_value FROM buildset_properties"
+                                  " WHERE buildsetid IN ")
+                      + self.parmlist(len(batch)),
+                      tuple(batch))
+            for (bsid, key, valuepair) in t.fetchall():
+                value, source = json.loads(valuepair)
+                properties[bsid].setProperty(str(key), value, source)
+        return properties
 
     def get_buildername_for_brid(self, brid):
         assert isinstance(brid, (int, long))
@@ -835,9 +1047,42 @@ class DBConnector(util.ComparableMixin):
             q += " LIMIT %s" % limit
         t.execute(self.quoteq(q),
                 (buildername, old, master_name, master_incarnation))
-        requests = [self.getBuildRequestWithNumber(brid, t)
-                    for (brid,) in t.fetchall()]
-        return requests
+        return self.getBuildRequestsWithNumbers([brid
+                                                 for (brid,) in t.fetchall()],
+                                                t)
+
+    def get_unclaimed_buildrequests_for_builders(self, buildernames, old,
+                                                 master_name,
+                                                 master_incarnation, t):
+        # like get_unclaimed_buildrequests, but for several builders at once.
+        # Returns a dict mapping buildername to a list of BuildRequests, in
+        # the same order. Builders without requests are left out.
+        buildernames = list(buildernames)
+        brids = []
+        by_builder = bbcollections.defaultdict(list)
+        while buildernames:
+            batch, buildernames = buildernames[:100], buildernames[100:]
+            q = ("SELECT br.id, br.buildername"
+                 " FROM buildrequests AS br, buildsets AS bs"
+                 " WHERE br.buildername IN " + self.parmlist(len(batch)) +
+                 " AND br.complete=0"
+                 " AND br.buildsetid=bs.id"
+                 " AND (br.claimed_at<?"
+                 "      OR (br.claimed_by_name=?"
+                 "          AND br.claimed_by_incarnation!=?))"
+                 " ORDER BY br.priority DESC,bs.submitted_at ASC")
+            t.execute(self.quoteq(q),
+                      batch + [old, master_name, master_incarnation])
+            for brid, bn in t.fetchall():
+                brids.append(brid)
+                by_builder[bn].append(brid)
+        brs = dict([(br.id, br)
+                    for br in self.getBuildRequestsWithNumbers(brids, t)
+                    if br])
+        result = {}
+        for bn, bn_brids in by_builder.items():
+            result[bn] = [brs[brid] for brid in bn_brids if brid in brs]
+        return result
 
     def claim_buildrequests(self, now, master_name, master_incarnation, brids,
                             t=None):
@@ -849,6 +1094,12 @@ class DBConnector(util.ComparableMixin):
         else:
             self.runInteractionNow(self._txn_claim_buildrequests,
                                    now, master_name, master_incarnation, brids)
+    def claim_buildrequests_async(self, now, master_name, master_incarnation,
+                                  brids):
+        if not brids:
+            return defer.succeed(None)
+        return self.runInteraction(self._txn_claim_buildrequests,
+                                   now, master_name, master_incarnation, brids)
     def _txn_claim_buildrequests(self, t, now, master_name, master_incarnation,
                                  brids):
         brids = list(brids) # in case it's a set
@@ -863,6 +1114,8 @@ class DBConnector(util.ComparableMixin):
 
     def build_started(self, brid, buildnumber):
         return self.runInteractionNow(self._txn_build_started, brid, buildnumber)
+    def build_started_async(self, brid, buildnumber):
+        return self.runInteraction(self._txn_build_started, brid, buildnumber)
     def _txn_build_started(self, t, brid, buildnumber):
         now = self._getCurrentTime()
         t.execute(self.quoteq("INSERT INTO builds (number, brid, start_time)"
@@ -874,6 +1127,8 @@ class DBConnector(util.ComparableMixin):
 
     def builds_finished(self, bids):
         return self.runInteractionNow(self._txn_build_finished, bids)
+    def builds_finished_async(self, bids):
+        return self.runInteraction(self._txn_build_finished, bids)
     def _txn_build_finished(self, t, bids):
         now = self._getCurrentTime()
         while bids:
@@ -908,6 +1163,7 @@ class DBConnector(util.ComparableMixin):
     def _txn_resubmit_buildreqs(self, t, brids):
         # the interrupted build that gets resubmitted will still have the
         # same submitted_at value, so it should be re-started first
+        by_builder = bbcollections.defaultdict(list)
         while brids:
             batch, brids = brids[:100], brids[100:]
             q = self.quoteq("UPDATE buildrequests"
@@ -915,10 +1171,17 @@ class DBConnector(util.ComparableMixin):
                             "     claimed_by_name=NULL, claimed_by_incarnation=NULL"
                             " WHERE id IN " + self.parmlist(len(batch)))
             t.execute(q, batch)
-        self.notify("add-buildrequest", *brids)
+            q = self.quoteq("SELECT id, buildername FROM buildrequests"
+                            " WHERE id IN " + self.parmlist(len(batch)))
+            t.execute(q, batch)
+            for brid, bn in t.fetchall():
+                by_builder[bn].append(brid)
+        self._notify_buildrequests_added(by_builder)
 
     def retire_buildrequests(self, brids, results):
         return self.runInteractionNow(self._txn_retire_buildreqs, brids,results)
+    def retire_buildrequests_async(self, brids, results):
+        return self.runInteraction(self._txn_retire_buildreqs, brids, results)
     def _txn_retire_buildreqs(self, t, brids, results):
         now = self._getCurrentTime()
         #q = self.db.quoteq("DELETE FROM buildrequests WHERE id IN "
@@ -945,6 +1208,8 @@ class DBConnector(util.ComparableMixin):
 
     def cancel_buildrequests(self, brids):
         return self.runInteractionNow(self._txn_cancel_buildrequest, brids)
+    def cancel_buildrequests_async(self, brids):
+        return self.runInteraction(self._txn_cancel_buildrequest, brids)
     def _txn_cancel_buildrequest(self, t, brids):
         # TODO: we aren't entirely sure if it'd be safe to just delete the
         # buildrequest: what else might be waiting on it that would then just
@@ -0,0 +1,146 @@
+# -*- test-case-name: buildbot.test.unit.test_db_stats -*-
+
+import re, threading
+
+from twisted.python import log
+
+_literal_re = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_in_list_re = re.compile(r"\bIN\s*\(\s*(?:\?|%s)(?:\s*,\s*(?:\?|%s))*\s*\)",
+                         re.I)
+_whitespace_re = re.compile(r"\s+")
+
+def normalize(sql):
+    """Reduce a query to its shape: literals become '?', lists of
+    placeholders (as made by DBConnector.parmlist) become '(...)', and
+    whitespace is collapsed. Queries that differ only in their parameters
+    have the same shape."""
+    sql = _literal_re.sub("?", sql)
+    sql = _in_list_re.sub("IN (...)", sql)
+    return _whitespace_re.sub(" ", sql).strip()
+
+class Histogram:
+    """I count durations, in buckets bounded by BUCKETS (in seconds), and
+    keep their total and maximum."""
+
+    BUCKETS = (0.001, 0.01, 0.1, 1.0, 10.0)
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        # the last bucket is for anything longer than BUCKETS[-1]
+        self.counts = [0] * (len(self.BUCKETS) + 1)
+
+    def add(self, elapsed):
+        self.count += 1
+        self.total += elapsed
+        if elapsed > self.max:
+            self.max = elapsed
+        for i in range(len(self.BUCKETS)):
+            if elapsed <= self.BUCKETS[i]:
+                self.counts[i] += 1
+                break
+        else:
+            self.counts[-1] += 1
+
+    def asDict(self):
+        mean = 0.0
+        if self.count:
+            mean = self.total / self.count
+        return dict(count=self.count, total=self.total, mean=mean,
+                    max=self.max, histogram=list(self.counts))
+
+class QueryStats:
+    """I keep latency statistics for the queries run by a DBConnector,
+    grouped by the shape of the query (see L{normalize}), and log queries
+    which take longer than slow_query_time seconds. Queries are recorded
+    from the DB threads, so all access is protected by a lock."""
+
+    # the number of query shapes to track; the shapes come from the source
+    # code, so this is only reached if something is building queries with
+    # unusual literals in them
+    MAX_SHAPES = 1000
+
+    def __init__(self, slow_query_time=None):
+        self.slow_query_time = slow_query_time
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self._lock.acquire()
+        try:
+            self.queries = {}
+            self.paths = {'sync': 0, 'async': 0}
+            self.pool_wait = Histogram()
+        finally:
+            self._lock.release()
+
+    def setSlowQueryTime(self, slow_query_time):
+        self.slow_query_time = slow_query_time
+
+    def addQuery(self, sql, elapsed, path):
+        """Record that the given query took elapsed seconds. path is 'sync'
+        for queries run on the reactor thread with the *Now methods, or
+        'async' for queries run in the connection pool."""
+        shape = normalize(sql)
+        self._lock.acquire()
+        try:
+            if shape not in self.queries:
+                if len(self.queries) >= self.MAX_SHAPES:
+                    shape = "(other)"
+                if shape not in self.queries:
+                    self.queries[shape] = (Histogram(), {'sync': 0, 'async': 0})
+            histogram, paths = self.queries[shape]
+            histogram.add(elapsed)
+            paths[path] += 1
+            self.paths[path] += 1
+        finally:
+            self._lock.release()
+        if self.slow_query_time is not None and \
+                elapsed >= self.slow_query_time:
+            log.msg("slow DB query (%.3fs, %s): %s" % (elapsed, path, shape))
+
+    def addPoolWait(self, elapsed):
+        """Record that an interaction waited elapsed seconds for a connection
+        from the pool."""
+        self._lock.acquire()
+        try:
+            self.pool_wait.add(elapsed)
+        finally:
+            self._lock.release()
+
+    def asDict(self):
+        self._lock.acquire()
+        try:
+            queries = []
+            for shape, (histogram, paths) in self.queries.items():
+                q = histogram.asDict()
+                q['query'] = shape
+                q['sync'] = paths['sync']
+                q['async'] = paths['async']
+                queries.append(q)
+            result = dict(buckets=list(Histogram.BUCKETS),
+                          slow_query_time=self.slow_query_time,
+                          sync=self.paths['sync'],
+                          async=self.paths['async'],
+                          pool_wait=self.pool_wait.asDict())
+        finally:
+            self._lock.release()
+        # the queries that cost the most come first
+        queries.sort(key=lambda q: q['total'], reverse=True)
+        result['queries'] = queries
+        return result
+
+    def report(self, count=10):
+        """Return a summary of the count most expensive query shapes, for
+        reading in a manhole."""
+        stats = self.asDict()
+        lines = ["%d sync and %d async queries; pool wait %.3fs total,"
+                 " %.3fs max" % (stats['sync'], stats['async'],
+                                 stats['pool_wait']['total'],
+                                 stats['pool_wait']['max'])]
+        for q in stats['queries'][:count]:
+            lines.append("%8.3fs total %8.4fs mean %8.4fs max %7d calls: %s"
+                         % (q['total'], q['mean'], q['max'], q['count'],
+                            q['query']))
+        return "\n".join(lines)
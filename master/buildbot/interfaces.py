@@ -196,7 +196,7 @@ class IStatus(Interface):
 
     def generateFinishedBuilds(builders=[], branches=[],
                                num_builds=None, finished_before=None,
-                               max_search=200):
+                               max_search=200, categories=[], results=None):
         """Return a generator that will produce IBuildStatus objects each
         time you invoke its .next() method, starting with the most recent
         finished build and working backwards.
@@ -226,6 +226,15 @@ class IStatus(Interface):
                            This argument imposes a hard limit on the number
                            of builds that will be examined within any given
                            Builder.
+
+        @param categories: this is a list of Builder categories, and the
+                           generator will only produce builds that ran on
+                           Builders in those categories. If the list is
+                           empty, produce builds from all categories.
+
+        @param results: if provided, this is a list of build results (like
+                        SUCCESS or FAILURE), and the generator will only
+                        produce builds with one of those results.
         """
 
     def subscribe(receiver):
@@ -849,20 +858,22 @@ class IStatusLog(Interface):
         """Return one big string with the contents of the Log. This merges
         all non-header chunks together."""
 
-    def readlines(channel=LOG_CHANNEL_STDOUT):
+    def readlines(channel=LOG_CHANNEL_STDOUT, tail=None):
         """Read lines from one channel of the logfile. This returns an
         iterator that will provide single lines of text (including the
-        trailing newline).
+        trailing newline). If 'tail' is given, only the last 'tail' lines
+        are returned.
         """
 
     def getTextWithHeaders():
         """Return one big string with the contents of the Log. This merges
         all chunks (including headers) together."""
 
-    def getChunks():
+    def getChunks(channels=[], onlyText=False, start=0, end=None):
         """Generate a list of (channel, text) tuples. 'channel' is a number,
         0 for stdout, 1 for stderr, 2 for header. (note that stderr is merged
-        into stdout if PTYs are in use)."""
+        into stdout if PTYs are in use). 'start' and 'end' select a range of
+        chunks, with the same meaning as a slice."""
 
 class IStatusLogConsumer(Interface):
     """I am an object which can be passed to IStatusLog.subscribeConsumer().
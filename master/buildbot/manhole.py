@@ -126,6 +126,7 @@ class _BaseManhole(service.MultiService):
             namespace = {
                 'master': master,
                 'status': master.getStatus(),
+                'db': master.db,
                 }
             return namespace
 
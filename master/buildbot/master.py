@@ -147,7 +147,23 @@ class BotMaster(service.MultiService):
     def _get_processors(self):
         if self.shuttingDown:
             return []
-        builders = self.builders.values()
+        return [self._dispatch]
+
+    def _dispatch(self):
+        # Look for work for every builder that has an available slave. The
+        # unclaimed requests for all of them are fetched, assigned and
+        # claimed in a single transaction, rather than one per builder.
+        # Builders are considered in priority order, which matters when they
+        # share a slave with max_builds set.
+        available = {}
+        for b in self.builders.values():
+            if b.running:
+                available_slaves = b.getAvailableSlaves()
+                if available_slaves:
+                    available[b] = available_slaves
+        builders = available.keys()
+        if not builders:
+            return
         sorter = self.prioritizeBuilders or self._sort_builders
         try:
             builders = sorter(self.parent, builders)
@@ -155,10 +171,76 @@ class BotMaster(service.MultiService):
             log.msg("Exception prioritizing builders")
             log.err(Failure())
             # leave them in the original order
-        return [b.run for b in builders]
 
-    def trigger_add_buildrequest(self, category, *brids):
-        # a buildrequest has been added or resubmitted
+        # slave capacity is worked out here, in the reactor thread
+        work = []
+        capacity = {}
+        for b in builders:
+            available_slaves = available[b]
+            for sb in available_slaves:
+                slave = sb.slave
+                if slave.max_builds and slave not in capacity:
+                    busy = [s for s in slave.slavebuilders.values()
+                            if s.isBusy()]
+                    capacity[slave] = slave.max_builds - len(busy)
+            work.append((b, available_slaves, b.request_generation))
+        d = self.db.runInteraction(self._claim_buildreqs, work, capacity)
+        d.addCallback(self._start_builds)
+        return d
+
+    def _claim_buildreqs(self, t, work, capacity):
+        claimed_at = now()
+        old = claimed_at - Builder.RECLAIM_INTERVAL
+        requests = self.db.get_unclaimed_buildrequests_for_builders(
+            [b.name for (b, available_slaves, generation) in work], old,
+            self.master_name, self.master_incarnation, t)
+        results = []
+        brids = []
+        for b, available_slaves, generation in work:
+            # a slave shared by several builders may already have been given
+            # as many builds as it is allowed
+            available_slaves = [sb for sb in available_slaves
+                                if capacity.get(sb.slave, 1) > 0]
+            try:
+                assignments, b_brids, oldest = b.assignBuildRequests(
+                    available_slaves, requests.get(b.name, []))
+            except:
+                # e.g. from a user's mergeRequests function; this builder
+                # claims nothing, but the others still can
+                log.msg("Exception assigning build requests for %s" % b)
+                log.err(Failure())
+                continue
+            for sb in assignments:
+                if sb.slave in capacity:
+                    capacity[sb.slave] -= 1
+            brids.extend(b_brids)
+            results.append((b, (assignments, oldest), generation))
+        self.db.claim_buildrequests(claimed_at, self.master_name,
+                                    self.master_incarnation, brids, t)
+        return results
+
+    def _start_builds(self, results):
+        for b, res, generation in results:
+            try:
+                b.buildRequestsClaimed(res, generation)
+            except:
+                log.msg("Exception starting builds for %s" % b)
+                log.err(Failure())
+
+    def trigger_add_buildrequest(self, category, buildername, *brids):
+        # buildrequests have been added or resubmitted for one builder, so
+        # only that builder needs to look for new work
+        b = self.builders.get(buildername)
+        if b is None:
+            # not one of ours
+            return
+        b.requestsChanged()
+        self.loop.trigger_processors([self._dispatch])
+    def pollDatabase(self):
+        # other masters sharing the database may have added requests that we
+        # were not notified about, so every builder needs to look again
+        for b in self.builders.values():
+            b.requestsChanged()
         self.loop.trigger()
     def triggerNewBuildCheck(self):
         # called when a build finishes, or a slave attaches
@@ -548,6 +630,8 @@ class BuildMaster(service.MultiService):
         self.db = None
         self.db_url = None
         self.db_poll_interval = _Unset
+        self.db_log_sync_calls = False
+        self.db_slow_query_time = None
         if db_spec:
             self.loadDatabase(db_spec)
 
@@ -639,9 +723,11 @@ class BuildMaster(service.MultiService):
                       "manhole", "status", "projectName", "projectURL",
                       "buildbotURL", "properties", "prioritizeBuilders",
                       "eventHorizon", "buildCacheSize", "changeCacheSize",
+                      "buildCacheMaxBytes",
                       "logHorizon", "buildHorizon", "changeHorizon",
                       "logMaxSize", "logMaxTailSize", "logCompressionMethod",
                       "db_url", "multiMaster", "db_poll_interval",
+                      "db_log_sync_calls", "db_slow_query_time",
                       )
         for k in config.keys():
             if k not in known_keys:
@@ -658,6 +744,8 @@ class BuildMaster(service.MultiService):
             # optional
             db_url = config.get("db_url", "sqlite:///state.sqlite")
             db_poll_interval = config.get("db_poll_interval", None)
+            db_log_sync_calls = config.get("db_log_sync_calls", False)
+            db_slow_query_time = config.get("db_slow_query_time", None)
             debugPassword = config.get('debugPassword')
             manhole = config.get('manhole')
             status = config.get('status', [])
@@ -666,6 +754,12 @@ class BuildMaster(service.MultiService):
             buildbotURL = config.get('buildbotURL')
             properties = config.get('properties', {})
             buildCacheSize = config.get('buildCacheSize', None)
+            buildCacheMaxBytes = config.get('buildCacheMaxBytes', None)
+            if buildCacheMaxBytes is not None and not \
+                    (isinstance(buildCacheMaxBytes, (int, long)) and
+                     buildCacheMaxBytes > 0):
+                raise ValueError("buildCacheMaxBytes needs to be None or a "
+                                 "positive int")
             changeCacheSize = config.get('changeCacheSize', None)
             eventHorizon = config.get('eventHorizon', 50)
             logHorizon = config.get('logHorizon', None)
@@ -675,8 +769,8 @@ class BuildMaster(service.MultiService):
                     isinstance(logCompressionLimit, int):
                 raise ValueError("logCompressionLimit needs to be bool or int")
             logCompressionMethod = config.get('logCompressionMethod', "bz2")
-            if logCompressionMethod not in ('bz2', 'gz'):
-                raise ValueError("logCompressionMethod needs to be 'bz2', or 'gz'")
+            if logCompressionMethod not in ('bz2', 'gz', 'blocks'):
+                raise ValueError("logCompressionMethod needs to be 'bz2', 'gz', or 'blocks'")
             logMaxSize = config.get('logMaxSize')
             if logMaxSize is not None and not \
                     isinstance(logMaxSize, int):
@@ -880,6 +974,7 @@ class BuildMaster(service.MultiService):
         self.status.logCompressionMethod = logCompressionMethod
         self.status.logMaxSize = logMaxSize
         self.status.logMaxTailSize = logMaxTailSize
+        self.status.setBuildCacheMaxBytes(buildCacheMaxBytes)
         # Update any of our existing builders with the current log parameters.
         # This is required so that the new value is picked up after a
         # reconfig.
@@ -896,6 +991,11 @@ class BuildMaster(service.MultiService):
 
         self.buildCacheSize = buildCacheSize
         self.changeCacheSize = changeCacheSize
+        self.db_log_sync_calls = db_log_sync_calls
+        self.db_slow_query_time = db_slow_query_time
+        if self.db:
+            self.db.setLogSyncCalls(db_log_sync_calls)
+            self.db.setSlowQueryTime(db_slow_query_time)
         self.eventHorizon = eventHorizon
         self.logHorizon = logHorizon
         self.buildHorizon = buildHorizon
@@ -988,6 +1088,8 @@ class BuildMaster(service.MultiService):
         self.db = connector.DBConnector(db_spec)
         if self.changeCacheSize:
             self.db.setChangeCacheSize(self.changeCacheSize)
+        self.db.setLogSyncCalls(self.db_log_sync_calls)
+        self.db.setSlowQueryTime(self.db_slow_query_time)
         self.db.start()
 
         self.botmaster.db = self.db
@@ -1011,7 +1113,7 @@ class BuildMaster(service.MultiService):
             # it'd be nice if TimerService let us set now=False
             t1 = TimerService(db_poll_interval, sm.trigger)
             t1.setServiceParent(self)
-            t2 = TimerService(db_poll_interval, self.botmaster.loop.trigger)
+            t2 = TimerService(db_poll_interval, self.botmaster.pollDatabase)
             t2.setServiceParent(self)
         # adding schedulers (like when loadConfig happens) will trigger the
         # scheduler loop at least once, which we need to jump-start things
@@ -1146,6 +1248,11 @@ class BuildMaster(service.MultiService):
         self.db.addChangeToDatabase(change)
         self.status.changeAdded(change)
 
+    def addChanges(self, changes):
+        self.db.addChangesToDatabase(changes)
+        for change in changes:
+            self.status.changeAdded(change)
+
     def triggerSlaveManager(self):
         self.botmaster.triggerNewBuildCheck()
 
@@ -406,6 +406,15 @@ class Builder(pb.Referenceable, service.MultiService):
         # Build is about to start, to make sure that they're still alive.
         self.slaves = []
 
+        # the submit time of my oldest unclaimed build request, which the
+        # BotMaster uses to prioritize builders. It is refreshed every time
+        # I look through my requests, and marked stale when requests are
+        # added or cancelled. request_generation counts those changes, so
+        # that a refresh which raced with one of them can be discarded.
+        self._oldest_request_time = None
+        self._oldest_request_time_stale = True
+        self.request_generation = 0
+
         self.builder_status = builder_status
         self.builder_status.setSlavenames(self.slavenames)
         self.builder_status.buildHorizon = self.buildHorizon
@@ -485,30 +494,52 @@ class Builder(pb.Referenceable, service.MultiService):
         if not self.running:
             return
 
-        self.run_count += 1
-
-        available_slaves = [sb for sb in self.slaves if sb.isAvailable()]
+        available_slaves = self.getAvailableSlaves()
         if not available_slaves:
-            self.updateBigStatus()
             return
         d = self.db.runInteraction(self._claim_buildreqs, available_slaves)
-        d.addCallback(self._start_builds)
+        d.addCallback(self.buildRequestsClaimed, self.request_generation)
         return d
 
+    def getAvailableSlaves(self):
+        """Called when looking for work. Returns the SlaveBuilders which
+        could start a build right now, or updates my status if there are
+        none."""
+        self.run_count += 1
+        available_slaves = [sb for sb in self.slaves if sb.isAvailable()]
+        if not available_slaves:
+            self.updateBigStatus()
+        return available_slaves
+
     # slave-managers must refresh their claim on a build at least once an
     # hour, less any inter-manager clock skew
     RECLAIM_INTERVAL = 1*3600
 
     def _claim_buildreqs(self, t, available_slaves):
-        # return a dict mapping slave -> (brid,ssid)
         now = util.now()
         old = now - self.RECLAIM_INTERVAL
         requests = self.db.get_unclaimed_buildrequests(self.name, old,
                                                        self.master_name,
                                                        self.master_incarnation,
                                                        t)
-
+        assignments, brids, oldest = self.assignBuildRequests(available_slaves,
+                                                              requests)
+        self.db.claim_buildrequests(now, self.master_name,
+                                    self.master_incarnation, brids, t)
+        return (assignments, oldest)
+
+    def assignBuildRequests(self, available_slaves, requests):
+        """Decide which of the given unclaimed BuildRequests to start on
+        which of the given SlaveBuilders, using nextSlave, nextBuild and
+        mergeRequests. Both lists are consumed as they are assigned.
+
+        This runs in a DB thread, but does not touch the database: the
+        caller claims the requests. Returns (assignments, brids, oldest),
+        where assignments maps SlaveBuilder to a list of BuildRequests,
+        brids are the ids to claim, and oldest is the submit time of the
+        oldest request left unclaimed (or None)."""
         assignments = {}
+        brids = []
         while requests and available_slaves:
             sb = self._choose_slave(available_slaves)
             if not sb:
@@ -530,10 +561,22 @@ class Builder(pb.Referenceable, service.MultiService):
                     requests.remove(other_breq)
                     merged_requests.append(other_breq)
             assignments[sb] = merged_requests
-            brids = [br.id for br in merged_requests]
-            self.db.claim_buildrequests(now, self.master_name,
-                                        self.master_incarnation, brids, t)
-        return assignments
+            brids.extend([br.id for br in merged_requests])
+        # whatever is left over is still unclaimed
+        oldest = None
+        if requests:
+            oldest = min([br.getSubmitTime() for br in requests])
+        return (assignments, brids, oldest)
+
+    def buildRequestsClaimed(self, res, generation):
+        """Start the builds for requests claimed by L{assignBuildRequests}.
+        res is (assignments, oldest), and generation is the value of
+        request_generation from before the requests were fetched."""
+        assignments, oldest = res
+        if generation == self.request_generation:
+            self._oldest_request_time = oldest
+            self._oldest_request_time_stale = False
+        self._start_builds(assignments)
 
     def _choose_slave(self, available_slaves):
         # note: this might return None if the nextSlave() function decided to
@@ -588,15 +631,31 @@ class Builder(pb.Referenceable, service.MultiService):
     def getOldestRequestTime(self):
         """Returns the timestamp of the oldest build request for this builder.
 
-        If there are no build requests, None is returned."""
-        buildable = self.getBuildable(1)
-        if buildable:
-            # TODO: this is sorted by priority first, not strictly reqtime
-            return buildable[0].getSubmitTime()
-        return None
+        If there are no build requests, None is returned. The value is
+        cached, and only looked up in the database when requests have been
+        added or cancelled since I last looked at them."""
+        if self._oldest_request_time_stale:
+            buildable = self.getBuildable(1)
+            self._oldest_request_time = None
+            if buildable:
+                # TODO: this is sorted by priority first, not strictly reqtime
+                self._oldest_request_time = buildable[0].getSubmitTime()
+            self._oldest_request_time_stale = False
+        return self._oldest_request_time
+
+    def requestsChanged(self):
+        """Called when build requests for this builder have been added or
+        cancelled, so that the oldest request time is looked up again."""
+        self.request_generation += 1
+        self._oldest_request_time_stale = True
 
     def cancelBuildRequest(self, brid):
-        return self.db.cancel_buildrequests([brid])
+        d = self.db.cancel_buildrequests_async([brid])
+        def _cancelled(res):
+            self.requestsChanged()
+            return res
+        d.addCallback(_cancelled)
+        return d
 
     def consumeTheSoulOfYourPredecessor(self, old):
         """Suck the brain out of an old Builder.
@@ -668,8 +727,10 @@ class Builder(pb.Referenceable, service.MultiService):
             brids.update([br.id for br in b.requests])
         for b in self.old_building:
             brids.update([br.id for br in b.requests])
-        self.db.claim_buildrequests(now, self.master_name,
-                                    self.master_incarnation, brids)
+        d = self.db.claim_buildrequests_async(now, self.master_name,
+                                              self.master_incarnation, brids)
+        d.addErrback(log.err)
+        return d
 
     def getBuild(self, number):
         for b in self.building:
@@ -884,9 +945,27 @@ class Builder(pb.Referenceable, service.MultiService):
         # BuildStatus that it has started, which will announce it to the
         # world (through our BuilderStatus object, which is its parent).
         # Finally it will start the actual build process.
-        bids = [self.db.build_started(req.id, bs.number) for req in build.requests]
+        d_bids = defer.DeferredList([self.db.build_started_async(req.id,
+                                                                 bs.number)
+                                     for req in build.requests],
+                                    consumeErrors=True)
+        def gotBids(results):
+            # a failed insert must not stop buildFinished from running, so
+            # log it and carry on with the bids we did get
+            bids = []
+            for success, res in results:
+                if success:
+                    bids.append(res)
+                else:
+                    log.err(res)
+            return bids
+        d_bids.addCallback(gotBids)
         d = build.startBuild(bs, self.expectations, sb)
-        d.addCallback(self.buildFinished, sb, bids)
+        # the builds rows are certainly written by the time the build
+        # finishes, but wait for them anyway
+        d.addCallback(lambda build:
+                d_bids.addCallback(lambda bids:
+                    self.buildFinished(build, sb, bids)))
         # this shouldn't happen. if it does, the slave will be wedged
         d.addErrback(log.err)
         return build # this is the IBuildControl
@@ -918,7 +997,7 @@ class Builder(pb.Referenceable, service.MultiService):
         # by the time we get here, the Build has already released the slave
         # (which queues a call to maybeStartBuild)
 
-        self.db.builds_finished(bids)
+        self.db.builds_finished_async(bids).addErrback(log.err)
 
         results = build.build_status.getResults()
         self.building.remove(build)
@@ -926,7 +1005,8 @@ class Builder(pb.Referenceable, service.MultiService):
             self._resubmit_buildreqs(build).addErrback(log.err) # returns Deferred
         else:
             brids = [br.id for br in build.requests]
-            self.db.retire_buildrequests(brids, results)
+            d = self.db.retire_buildrequests_async(brids, results)
+            d.addErrback(log.err)
 
         if sb.slave:
             sb.slave.releaseLocks()
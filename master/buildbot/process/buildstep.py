@@ -1,6 +1,7 @@
 # -*- test-case-name: buildbot.test.test_steps -*-
 
 import re
+import zlib
 
 from zope.interface import implements
 from twisted.internet import reactor, defer, error
@@ -13,7 +14,7 @@ from twisted.web.util import formatFailure
 from buildbot import interfaces, locks
 from buildbot.status import progress
 from buildbot.status.builder import SUCCESS, WARNINGS, FAILURE, SKIPPED, \
-     EXCEPTION, RETRY, worst_status
+     EXCEPTION, RETRY, worst_status, STDOUT, STDERR
 
 """
 BuildStep and RemoteCommand classes for master-side representation of the
@@ -159,6 +160,8 @@ class RemoteCommand(pb.Referenceable):
             #log.msg("update[%d]:" % num)
             try:
                 if self.active: # ignore late updates
+                    if 'compressed' in update:
+                        update = self.decompressUpdate(update)
                     self.remoteUpdate(update)
             except:
                 # log failure, terminate build, let slave retire the update
@@ -169,6 +172,22 @@ class RemoteCommand(pb.Referenceable):
                 max_updatenum = num
         return max_updatenum
 
+    def decompressUpdate(self, update):
+        """Undo the compression of the output in an update from a slave
+        which was asked to compress it."""
+        method = update['compressed']
+        if method != 'zlib':
+            raise ValueError("unknown update compression %r" % (method,))
+        update = update.copy()
+        del update['compressed']
+        for key in ('stdout', 'stderr'):
+            if key in update:
+                update[key] = zlib.decompress(update[key])
+        if 'log' in update:
+            logname, data = update['log']
+            update['log'] = (logname, zlib.decompress(data))
+        return update
+
     def remoteUpdate(self, update):
         raise NotImplementedError("You must implement this in a subclass")
 
@@ -450,7 +469,7 @@ class RemoteShellCommand(LoggedRemoteCommand):
     def __init__(self, workdir, command, env=None,
                  want_stdout=1, want_stderr=1,
                  timeout=20*60, maxTime=None, logfiles={},
-                 usePTY="slave-config", logEnviron=True):
+                 usePTY="slave-config", logEnviron=True, compress=False):
         """
         @type  workdir: string
         @param workdir: directory where the command ought to run,
@@ -496,6 +515,11 @@ class RemoteShellCommand(LoggedRemoteCommand):
         @param maxTime: tell the remote that if the command fails to complete
                         in this number of seconds, the command should be
                         killed.  Use None to disable maxTime.
+
+        @type  compress: bool
+        @param compress: ask the slave to compress the command's output
+                         before sending it. Slaves which are too old to do
+                         so send it uncompressed.
         """
 
         self.command = command # stash .command, set it later
@@ -513,6 +537,7 @@ class RemoteShellCommand(LoggedRemoteCommand):
                 'maxTime': maxTime,
                 'usePTY': usePTY,
                 'logEnviron': logEnviron,
+                'compress': compress,
                 }
         LoggedRemoteCommand.__init__(self, "shell", args)
 
@@ -523,6 +548,9 @@ class RemoteShellCommand(LoggedRemoteCommand):
             # fixup themselves
             if self.step.slaveVersion("shell", "old") == "old":
                 self.args['dir'] = self.args['workdir']
+            if self.args['compress'] and \
+                    self.step.slaveVersionIsOlderThan("shell", "2.12"):
+                self.args['compress'] = False
         what = "command '%s' in dir '%s'" % (self.args['command'],
                                              self.args['workdir'])
         log.msg(what)
@@ -1210,7 +1238,18 @@ class LoggingBuildStep(BuildStep):
 #   ...,
 #   log_eval_func=lambda c,s: regex_log_evaluator(c, s, regexs)
 # )
+def _regex_spans_lines(regex):
+    # a pattern which mentions a newline, or in which '.' matches one, may
+    # match across lines
+    return ('\n' in regex.pattern or '\\n' in regex.pattern or
+            regex.flags & re.DOTALL)
+
 def regex_log_evaluator(cmd, step_status, regexes):
+    """Return the worst status whose regex matches the command's logs (or
+    FAILURE, if the command itself failed). The logs are read a line at a
+    time, unless the regex may match across lines: that is, it contains a
+    newline (or '\\n'), or was compiled with re.DOTALL. In a regex given as
+    a string, '.' does not match a newline."""
     worst = SUCCESS
     if cmd.rc != 0:
         worst = FAILURE
@@ -1220,10 +1259,16 @@ def regex_log_evaluator(cmd, step_status, regexes):
         # so we don't even need to check the log if that's the case
         if worst_status(worst, possible_status) == possible_status:
             if isinstance(err, (basestring)):
-                err = re.compile(".*%s.*" % err, re.DOTALL)
+                err = re.compile(err)
             for l in cmd.logs.values():
-                if err.search(l.getText()):
-                    worst = possible_status
+                if _regex_spans_lines(err):
+                    if err.search(l.getText()):
+                        worst = possible_status
+                    continue
+                for line in l.readlines([STDOUT, STDERR]):
+                    if err.search(line):
+                        worst = possible_status
+                        break
     return worst
 
 
@@ -127,7 +127,21 @@ class ClassifierMixin:
         if categories: cfargs['category'] = categories
         self.change_filter = filter.ChangeFilter(**cfargs)
 
+    def wants_changes(self):
+        """Return True if changes should be classified for me. The
+        SchedulerManager classifies changes for all such schedulers in one
+        pass, before running them."""
+        return True
+
+    def change_is_important(self, change):
+        if self.fileIsImportant:
+            return bool(self.fileIsImportant(change))
+        return True
+
     def classify_changes(self, t):
+        if getattr(self.parent, 'classifies_changes', False):
+            # already done by our SchedulerManager
+            return
         db = self.parent.db
         cm = self.parent.change_svc
         state = self.get_state(t)
@@ -135,17 +149,14 @@ class ClassifierMixin:
         last_processed = state.get("last_processed", None)
 
         if last_processed is None:
-            last_processed = state['last_processed'] = cm.getLatestChangeNumberNow(t)
+            last_processed = state['last_processed'] = cm.getLatestChangeNumberNow(t=t)
             state_changed = True
 
         changes = cm.getChangesGreaterThan(last_processed, t)
-        for c in changes:
-            if self.change_filter.filter_change(c):
-                important = True
-                if self.fileIsImportant:
-                    important = self.fileIsImportant(c)
-                db.scheduler_classify_change(self.schedulerid, c.number,
-                                             bool(important), t)
+        classifications = [(c.number, self.change_is_important(c))
+                           for c in changes
+                           if self.change_filter.filter_change(c)]
+        db.scheduler_classify_changes(self.schedulerid, classifications, t)
         # now that we've recorded a decision about each, we can update the
         # last_processed record
         if changes:
@@ -70,3 +70,46 @@ class ChangeFilter(ComparableMixin):
                 checks.append('%s(%s)' % (filt_fn.__name__, chg_attr))
         
         return "<%s on %s>" % (self.__class__.__name__, ' and '.join(checks))
+
+class ChangeFilterIndex:
+    """I match each Change against many ChangeFilters at once. A filter which
+    requires one of a list of exact values for some change attribute is
+    indexed on that attribute, so it is only consulted for changes with one
+    of those values. Filters with only regular expressions or functions are
+    consulted for every change."""
+
+    def __init__(self, filters):
+        # filters is a list of (ChangeFilter, value) pairs; match() returns
+        # the values whose filters accept the change
+        self.indexes = {} # attribute -> { attribute value: [entry,..] }
+        self.unindexed = []
+        for pos, (filt, value) in enumerate(filters):
+            entry = (pos, (filt, value))
+            for (filt_list, filt_re, filt_fn, chg_attr) in filt.checks:
+                if filt_list is not None:
+                    index = self.indexes.setdefault(chg_attr, {})
+                    for v in filt_list:
+                        index.setdefault(v, []).append(entry)
+                    break
+            else:
+                self.unindexed.append(entry)
+
+    def match(self, change):
+        """Return the values for all filters which accept this change, in
+        the order they were given."""
+        candidates = {}
+        for pos, entry in self.unindexed:
+            candidates[pos] = entry
+        for chg_attr, index in self.indexes.items():
+            for pos, entry in index.get(getattr(change, chg_attr, ''), []):
+                candidates[pos] = entry
+        # a filter object shared by several values is only run once
+        results = {}
+        values = []
+        for pos in sorted(candidates):
+            filt, value = candidates[pos]
+            if id(filt) not in results:
+                results[id(filt)] = filt.filter_change(change)
+            if results[id(filt)]:
+                values.append(value)
+        return values
@@ -40,14 +40,22 @@ from twisted.python import log
 from buildbot.util import loop
 from buildbot.util import collections
 from buildbot.util.eventual import eventually
+from buildbot.schedulers.base import ClassifierMixin
+from buildbot.schedulers.filter import ChangeFilterIndex
 
 class SchedulerManager(loop.MultiServiceLoop):
+    # new changes are classified for all schedulers at once, at the start of
+    # each run of the loop, so ClassifierMixin.classify_changes need not
+    classifies_changes = True
+
     def __init__(self, master, db, change_svc):
         loop.MultiServiceLoop.__init__(self)
         self.master = master
         self.db = db
         self.change_svc = change_svc
         self.upstream_subscribers = collections.defaultdict(list)
+        self.classifiers = []
+        self.filter_index = ChangeFilterIndex([])
 
     def updateSchedulers(self, newschedulers):
         """Add and start any Scheduler that isn't already a child of ours.
@@ -95,17 +103,88 @@ class SchedulerManager(loop.MultiServiceLoop):
             for s in list(self):
                 if s.upstream_name:
                     self.upstream_subscribers[s.upstream_name].append(s)
+            self.classifiers = [s for s in list(self)
+                                if isinstance(s, ClassifierMixin)
+                                and s.wants_changes()]
+            self.filter_index = ChangeFilterIndex(
+                    [(s.change_filter, s) for s in self.classifiers])
             eventually(self.trigger)
         d.addCallback(_attach)
         d.addErrback(log.err)
         return d
 
+    def get_processors(self):
+        return ([self.classify_changes] +
+                loop.MultiServiceLoop.get_processors(self))
+
+    def classify_changes(self):
+        """Classify any new changes for all of my schedulers that want
+        them. Each change is loaded once, and only checked against the
+        filters that could accept it."""
+        if not self.classifiers:
+            return
+        return self.db.runInteraction(self._classify_changes,
+                                      self.classifiers[:], self.filter_index)
+
+    def _classify_changes(self, t, classifiers, filter_index):
+        # everything here is keyed by schedulerid
+        states = self.db.scheduler_get_states(
+                [s.schedulerid for s in classifiers], t)
+        changed = set()
+        latest = None
+        for s in classifiers:
+            state = states[s.schedulerid]
+            if state.get("last_processed") is None:
+                if latest is None:
+                    latest = self.change_svc.getLatestChangeNumberNow(t=t)
+                state["last_processed"] = latest
+                changed.add(s.schedulerid)
+        last_processed = min([states[s.schedulerid]["last_processed"]
+                              for s in classifiers])
+
+        changes = self.change_svc.getChangesGreaterThan(last_processed, t)
+        classifications = collections.defaultdict(list)
+        failed = set()
+        for c in changes:
+            for s in filter_index.match(c):
+                sid = s.schedulerid
+                if sid in failed:
+                    continue
+                if c.number <= states[sid]["last_processed"]:
+                    continue
+                try:
+                    important = s.change_is_important(c)
+                except:
+                    # leave this scheduler's changes unprocessed, so that
+                    # they are tried again next time
+                    log.msg("Exception classifying change %d for %s"
+                            % (c.number, s.name))
+                    log.err()
+                    failed.add(sid)
+                    continue
+                classifications[sid].append((c.number, important))
+
+        if changes:
+            max_changeid = max([c.number for c in changes])
+            for s in classifiers:
+                sid = s.schedulerid
+                if sid in failed:
+                    continue
+                self.db.scheduler_classify_changes(sid, classifications[sid],
+                                                   t)
+                if states[sid]["last_processed"] < max_changeid:
+                    # retain other keys
+                    states[sid]["last_processed"] = max_changeid
+                    changed.add(sid)
+        for sid in changed - failed:
+            self.db.scheduler_set_state(sid, t, states[sid])
+
     def publish_buildset(self, upstream_name, bsid, t):
         if upstream_name in self.upstream_subscribers:
             for s in self.upstream_subscribers[upstream_name]:
                 s.buildSetSubmitted(bsid, t)
 
-    def trigger_add_change(self, category, changenumber):
+    def trigger_add_change(self, category, *changenumbers):
         self.trigger()
     def trigger_modify_buildset(self, category, *bsids):
         # TODO: this could just run the schedulers that have subscribed to
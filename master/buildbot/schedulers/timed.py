@@ -35,7 +35,7 @@
 #
 # ***** END LICENSE BLOCK *****
 
-import time
+import time, datetime
 from twisted.internet import defer
 from twisted.python import log
 from buildbot.sourcestamp import SourceStamp
@@ -217,6 +217,11 @@ class Nightly(base.BaseScheduler, base.ClassifierMixin, TimedBuildMixin):
             "last_processed": max_changeid,
         }
 
+    def wants_changes(self):
+        # changes are only recorded if we need them to decide whether to
+        # build
+        return self.onlyIfChanged
+
     def getPendingBuildTimes(self):
         now = time.time()
         next = self._calculateNextRunTimeFrom(now)
@@ -285,55 +290,92 @@ class Nightly(base.BaseScheduler, base.ClassifierMixin, TimedBuildMixin):
     def _addTime(self, timetuple, secs):
         return time.localtime(time.mktime(timetuple)+secs)
 
-    def _isRunTime(self, timetuple):
-        def check(ourvalue, value):
-            if ourvalue == '*': return True
-            if isinstance(ourvalue, int): return value == ourvalue
-            return (value in ourvalue)
-
-        if not check(self.minute, timetuple[4]):
-            #print 'bad minute', timetuple[4], self.minute
-            return False
-
-        if not check(self.hour, timetuple[3]):
-            #print 'bad hour', timetuple[3], self.hour
-            return False
-
-        if not check(self.month, timetuple[1]):
-            #print 'bad month', timetuple[1], self.month
-            return False
+    def _check(self, ourvalue, value):
+        if ourvalue == '*': return True
+        if isinstance(ourvalue, int): return value == ourvalue
+        return (value in ourvalue)
 
+    def _isRunDay(self, dayOfMonth, dayOfWeek):
         if self.dayOfMonth != '*' and self.dayOfWeek != '*':
             # They specified both day(s) of month AND day(s) of week.
             # This means that we only have to match one of the two. If
             # neither one matches, this time is not the right time.
-            if not (check(self.dayOfMonth, timetuple[2]) or
-                    check(self.dayOfWeek, timetuple[6])):
-                #print 'bad day'
-                return False
-        else:
-            if not check(self.dayOfMonth, timetuple[2]):
-                #print 'bad day of month'
-                return False
-
-            if not check(self.dayOfWeek, timetuple[6]):
-                #print 'bad day of week'
-                return False
+            return (self._check(self.dayOfMonth, dayOfMonth) or
+                    self._check(self.dayOfWeek, dayOfWeek))
+        return (self._check(self.dayOfMonth, dayOfMonth) and
+                self._check(self.dayOfWeek, dayOfWeek))
 
-        return True
+    def _isRunTime(self, timetuple):
+        return (self._check(self.minute, timetuple[4]) and
+                self._check(self.hour, timetuple[3]) and
+                self._check(self.month, timetuple[1]) and
+                self._isRunDay(timetuple[2], timetuple[6]))
+
+    def _values(self, ourvalue, allvalues):
+        # the values of a field to try, in order
+        if ourvalue == '*':
+            return allvalues
+        if isinstance(ourvalue, int):
+            return [ourvalue]
+        return sorted(set(ourvalue))
+
+    def _localTimes(self, day, hour, minute):
+        # return the timestamps at which the local time is hour:minute on
+        # the given day: none if it falls in a DST gap, two if it falls in
+        # the hour that is repeated when DST ends
+        fields = (day.year, day.month, day.day, hour, minute)
+        times = []
+        for isdst in (0, 1):
+            try:
+                t = time.mktime(fields + (0, 0, 0, isdst))
+            except (OverflowError, ValueError):
+                continue
+            if time.localtime(t)[:5] == fields and t not in times:
+                times.append(t)
+        times.sort()
+        return times
 
     def _calculateNextRunTimeFrom(self, now):
+        """Return the first time after now, on a minute boundary, that
+        matches my fields. Rather than trying every minute, this looks
+        for a matching month, then a matching day, then the matching hours
+        and minutes on that day."""
         dateTime = time.localtime(now)
 
         # Remove seconds by advancing to at least the next minute
-        dateTime = self._addTime(dateTime, 60-dateTime[5])
-
-        # Now we just keep adding minutes until we find something that matches
-
-        # It not an efficient algorithm, but it'll *work* for now
-        yearLimit = dateTime[0]+2
-        while not self._isRunTime(dateTime):
-            dateTime = self._addTime(dateTime, 60)
-            #print 'Trying', time.asctime(dateTime)
-            assert dateTime[0] < yearLimit, 'Something is wrong with this code'
-        return time.mktime(dateTime)
+        first = time.mktime(dateTime) + 60 - dateTime[5]
+        start = time.localtime(first)
+
+        hours = self._values(self.hour, range(24))
+        minutes = self._values(self.minute, range(60))
+        one_day = datetime.timedelta(days=1)
+        yearLimit = start[0]+2
+        day = datetime.date(start[0], start[1], start[2])
+        while True:
+            assert day.year < yearLimit, 'Something is wrong with this code'
+            if not self._check(self.month, day.month):
+                # skip to the first of next month
+                day = (day.replace(day=28) + 4*one_day).replace(day=1)
+                continue
+            if self._isRunDay(day.day, day.weekday()):
+                # times on the same day are in order, except around the
+                # end of DST, when an hour repeats; only then do all of the
+                # day's times need to be compared
+                next_day = day + one_day
+                day_length = (time.mktime(next_day.timetuple()) -
+                              time.mktime(day.timetuple()))
+                is_start = (day.timetuple()[:3] == start[:3])
+                best = None
+                for hour in hours:
+                    for minute in minutes:
+                        if (is_start and day_length == 24*3600
+                            and (hour, minute) < start[3:5]):
+                            continue
+                        for t in self._localTimes(day, hour, minute):
+                            if t >= first and (best is None or t < best):
+                                best = t
+                        if best is not None and day_length == 24*3600:
+                            return best
+                if best is not None:
+                    return best
+            day += one_day
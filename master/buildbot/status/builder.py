@@ -1,20 +1,29 @@
 # -*- test-case-name: buildbot.test.test_status -*-
 
 from zope.interface import implements
-from twisted.python import log, runtime
+from twisted.python import log, runtime, failure
 from twisted.persisted import styles
 from twisted.internet import reactor, defer, threads
 from twisted.protocols import basic
 from buildbot.process.properties import Properties
-from buildbot.util import collections
+from buildbot.util import collections, json
 from buildbot.util.eventual import eventually
+from buildbot.util.blockfile import BlockFile, BlockFileWriter
 
 import weakref
-import os, shutil, re, urllib, itertools
+import os, shutil, re, urllib, itertools, bisect
 import gc
 import time
-from cPickle import load, dump
+import struct
+import threading
+from cPickle import load, dump, dumps
 from cStringIO import StringIO
+from collections import deque
+try:
+    from hashlib import md5
+except ImportError:
+    # For Python 2.4 compatibility
+    from md5 import md5
 from bz2 import BZ2File
 from gzip import GzipFile
 
@@ -24,6 +33,19 @@ from buildbot import interfaces, util, sourcestamp
 SUCCESS, WARNINGS, FAILURE, SKIPPED, EXCEPTION, RETRY = range(6)
 Results = ["success", "warnings", "failure", "skipped", "exception", "retry"]
 
+# Twisted keeps a global registry of unpickled objects awaiting upgrade, so
+# build pickles are only loaded (and upgraded) by one thread at a time
+_unpickleLock = threading.Lock()
+
+def sourceStampKey(ss):
+    """Return a key which is the same for SourceStamps that describe the
+    same code: their branch, revision and a digest of their patch. Unlike
+    the patch itself, this is small enough to keep in the summary index."""
+    patch = None
+    if ss.patch:
+        patch = md5(repr(tuple(ss.patch))).hexdigest()
+    return (ss.branch, ss.revision, patch)
+
 def worst_status(a, b):
     # SUCCESS > SKIPPED > WARNINGS > FAILURE > EXCEPTION > RETRY
     # Retry needs to be considered the worst so that conusmers don't have to
@@ -65,6 +87,106 @@ class LogFileScanner(basic.NetstringReceiver):
         if not self.channels or (channel in self.channels):
             self.chunk_cb((channel, line[1:]))
 
+def linesFromChunks(chunks):
+    """Split an iterable of text chunks (like those from
+    LogFile.getChunks(onlyText=True)) into newline-terminated lines, handling
+    lines that are split across chunks. This is a pull-driven version of
+    twisted.protocols.basic.LineReceiver: chunks are only retrieved as lines
+    are consumed, so at most one chunk and one line are held in memory."""
+    pieces = []
+    for chunk in chunks:
+        start = 0
+        while True:
+            end = chunk.find("\n", start)
+            if end == -1:
+                break
+            if pieces:
+                pieces.append(chunk[start:end+1])
+                yield "".join(pieces)
+                pieces = []
+            else:
+                yield chunk[start:end+1]
+            start = end + 1
+        if start < len(chunk):
+            pieces.append(chunk[start:])
+    if pieces:
+        yield "".join(pieces)
+
+class LogFileIndex:
+    """I am the offset index for a LogFile, kept in a sidecar file next to
+    the log itself (12-log-compile-output.idx). Every netstring chunk that
+    LogFile.merge() writes gets one fixed-size record here, holding the
+    byte offset of the chunk within the (uncompressed) log, its channel,
+    and the number of lines that came before it in the log.
+
+    Because the records are fixed-size, chunk N can be found with a single
+    seek, and the number of chunks is just the size of the index file. That
+    lets readers jump straight to any range of the log, or to its tail,
+    without scanning from the beginning."""
+
+    RECORD = "!QBQ" # offset, channel, lines before this chunk
+    RECORD_SIZE = struct.calcsize(RECORD)
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.writefile = None
+
+    def exists(self):
+        return os.path.exists(self.filename)
+
+    def create(self):
+        self.writefile = open(self.filename, "wb")
+
+    def append(self, offset, channel, lines):
+        self.writefile.write(struct.pack(self.RECORD, offset, channel, lines))
+
+    def close(self):
+        if self.writefile:
+            self.writefile.close()
+            self.writefile = None
+
+    def flush(self):
+        if self.writefile:
+            self.writefile.flush()
+
+    def __len__(self):
+        self.flush()
+        try:
+            return os.path.getsize(self.filename) // self.RECORD_SIZE
+        except OSError:
+            return 0
+
+    def __getitem__(self, n):
+        """Return the (offset, channel, lines) record for chunk N."""
+        if n < 0:
+            n += len(self)
+        if n < 0:
+            raise IndexError("log chunk index out of range")
+        self.flush()
+        f = open(self.filename, "rb")
+        try:
+            f.seek(n * self.RECORD_SIZE)
+            data = f.read(self.RECORD_SIZE)
+        finally:
+            f.close()
+        if len(data) < self.RECORD_SIZE:
+            raise IndexError("log chunk index out of range")
+        return struct.unpack(self.RECORD, data)
+
+    def findLine(self, lineno):
+        """Return the number of the chunk in which line LINENO (counting
+        from zero) begins, by bisecting on the line counts."""
+        lo, hi = 0, len(self)
+        # the line begins just after the LINENO'th newline, so find the last
+        # chunk with fewer than LINENO newlines before it
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self[mid][2] < lineno:
+                lo = mid + 1
+            else:
+                hi = mid
+        return max(lo - 1, 0)
+
 class LogFileProducer:
     """What's the plan?
 
@@ -103,15 +225,21 @@ class LogFileProducer:
     subscribed = False
     BUFFERSIZE = 2048
 
-    def __init__(self, logfile, consumer):
+    def __init__(self, logfile, consumer, startChunk=0):
         self.logfile = logfile
         self.consumer = consumer
+        self.startChunk = startChunk
         self.chunkGenerator = self.getChunks()
         consumer.registerProducer(self, True)
 
     def getChunks(self):
         f = self.logfile.getFile()
-        offset = 0
+        offset = self.logfile.getChunkOffset(self.startChunk)
+        skip = 0
+        if offset is None:
+            # no index, so we have to scan for the starting chunk
+            offset = 0
+            skip = self.startChunk
         chunks = []
         p = LogFileScanner(chunks.append)
         f.seek(offset)
@@ -121,6 +249,9 @@ class LogFileProducer:
             p.dataReceived(data)
             while chunks:
                 c = chunks.pop(0)
+                if skip:
+                    skip -= 1
+                    continue
                 yield c
             f.seek(offset)
             data = f.read(self.BUFFERSIZE)
@@ -245,7 +376,16 @@ class LogFile:
     BUFFERSIZE = 2048
     filename = None # relative to the Builder's basedir
     openfile = None
+    index = None
+    numLines = 0
     compressMethod = "bz2"
+    compressLimit = False
+    # with compressMethod "blocks", the log is compressed in frames of this
+    # size, starting while the step is still running
+    compressFrameSize = 1024*1024
+    framedLength = 0 # how much of the log has been handed to frameWriter
+    frameWriter = None
+    frameWriting = None
 
     def __init__(self, parent, name, logfilename):
         """
@@ -270,6 +410,8 @@ class LogFile:
         if not os.path.exists(dirname):
             os.makedirs(dirname)
         self.openfile = open(fn, "w+")
+        self.index = LogFileIndex(fn + ".idx")
+        self.index.create()
         self.runEntries = []
         self.watchers = []
         self.finishedWatchers = []
@@ -279,7 +421,8 @@ class LogFile:
         return os.path.join(self.step.build.builder.basedir, self.filename)
 
     def hasContents(self):
-        return os.path.exists(self.getFilename() + '.bz2') or \
+        return os.path.exists(self.getFilename() + '.blocks') or \
+            os.path.exists(self.getFilename() + '.bz2') or \
             os.path.exists(self.getFilename() + '.gz') or \
             os.path.exists(self.getFilename())
 
@@ -306,6 +449,10 @@ class LogFile:
             return self.openfile
         # otherwise they get their own read-only handle
         # try a compressed log first
+        try:
+            return BlockFile(self.getFilename() + ".blocks")
+        except IOError:
+            pass
         try:
             return BZ2File(self.getFilename() + ".bz2", "r")
         except IOError:
@@ -316,6 +463,51 @@ class LogFile:
             pass
         return open(self.getFilename(), "r")
 
+    def getIndex(self):
+        """Return the L{LogFileIndex} for this log, or None if the log was
+        written before logs were indexed."""
+        if self.index is None:
+            index = LogFileIndex(self.getFilename() + ".idx")
+            if not index.exists():
+                return None
+            self.index = index
+        return self.index
+
+    def getNumChunks(self):
+        """Return the number of chunks that have been written to disk."""
+        index = self.getIndex()
+        if index is not None:
+            return len(index)
+        return len(list(self._generateChunks(self.getFile(), 0, None, None,
+                                             [], True)))
+
+    def getChunkOffset(self, chunk):
+        """Return the byte offset of the given chunk within the log, or None
+        if the log has no index. Chunk numbers past the end of the log give
+        the offset at which the next chunk will be written."""
+        if not chunk:
+            return 0
+        index = self.getIndex()
+        if index is None:
+            return None
+        if chunk < len(index):
+            return index[chunk][0]
+        f = self.getFile()
+        f.seek(0, 2)
+        return f.tell()
+
+    def getChunkForLine(self, lineno):
+        """Return the number of the chunk in which line LINENO (counting from
+        zero, across all channels) begins. Negative numbers count back from
+        the end of the log, so C{getChunkForLine(-100)} finds the start of
+        the last hundred lines."""
+        if lineno < 0:
+            lineno = max(self.numLines + lineno, 0)
+        index = self.getIndex()
+        if index is None:
+            return 0
+        return index.findLine(lineno)
+
     def getText(self):
         # this produces one ginormous string
         return "".join(self.getChunks([STDOUT, STDERR], onlyText=True))
@@ -323,11 +515,14 @@ class LogFile:
     def getTextWithHeaders(self):
         return "".join(self.getChunks(onlyText=True))
 
-    def getChunks(self, channels=[], onlyText=False):
+    def getChunks(self, channels=[], onlyText=False, start=0, end=None):
         # generate chunks for everything that was logged at the time we were
         # first called, so remember how long the file was when we started.
         # Don't read beyond that point. The current contents of
-        # self.runEntries will follow.
+        # self.runEntries will follow, unless 'end' is given.
+
+        # 'start' and 'end' select a range of on-disk chunks, with the usual
+        # slice semantics. If the log is indexed, we seek straight to them.
 
         # this returns an iterator, which means arbitrary things could happen
         # while we're yielding. This will faithfully deliver the log as it
@@ -338,18 +533,40 @@ class LogFile:
 
         f = self.getFile()
         if not self.finished:
-            offset = 0
             f.seek(0, 2)
             remaining = f.tell()
         else:
-            offset = 0
             remaining = None
 
         leftover = None
-        if self.runEntries and (not channels or
+        if self.runEntries and end is None and (not channels or
                                 (self.runEntries[0][0] in channels)):
             leftover = (self.runEntries[0][0],
                         "".join([c[1] for c in self.runEntries]))
+            if onlyText:
+                leftover = leftover[1]
+
+        if start or end is not None:
+            if start < 0 or (end is not None and end < 0):
+                numChunks = self.getNumChunks()
+                if start < 0:
+                    start = max(numChunks + start, 0)
+                if end is not None and end < 0:
+                    end = max(numChunks + end, 0)
+            offset = self.getChunkOffset(start)
+            if offset is None:
+                # no index: scan from the beginning and skip what we don't
+                # want
+                return self._generateChunks(f, 0, remaining, leftover,
+                                            channels, onlyText, start, end)
+            if end is not None:
+                endOffset = self.getChunkOffset(end)
+                if remaining is None or endOffset < remaining:
+                    remaining = endOffset
+            if remaining is not None:
+                remaining = max(remaining - offset, 0)
+        else:
+            offset = 0
 
         # freeze the state of the LogFile by passing a lot of parameters into
         # a generator
@@ -357,9 +574,11 @@ class LogFile:
                                     channels, onlyText)
 
     def _generateChunks(self, f, offset, remaining, leftover,
-                        channels, onlyText):
+                        channels, onlyText, skip=0, stop=None):
         chunks = []
-        p = LogFileScanner(chunks.append, channels)
+        # filter channels ourselves, so that skip and stop count every chunk
+        p = LogFileScanner(chunks.append)
+        chunkno = 0
         f.seek(offset)
         if remaining is not None:
             data = f.read(min(remaining, self.BUFFERSIZE))
@@ -372,6 +591,13 @@ class LogFile:
             p.dataReceived(data)
             while chunks:
                 channel, text = chunks.pop(0)
+                chunkno += 1
+                if chunkno <= skip:
+                    continue
+                if stop is not None and chunkno > stop:
+                    return
+                if channels and channel not in channels:
+                    continue
                 if onlyText:
                     yield text
                 else:
@@ -386,20 +612,40 @@ class LogFile:
         del f
 
         if leftover:
-            if onlyText:
-                yield leftover[1]
-            else:
-                yield leftover
+            yield leftover
 
-    def readlines(self, channel=STDOUT):
+    def readlines(self, channel=STDOUT, tail=None):
         """Return an iterator that produces newline-terminated lines,
-        excluding header chunks."""
-        # TODO: make this memory-efficient, by turning it into a generator
-        # that retrieves chunks as necessary, like a pull-driven version of
-        # twisted.protocols.basic.LineReceiver
-        alltext = "".join(self.getChunks([channel], onlyText=True))
-        io = StringIO(alltext)
-        return io.readlines()
+        excluding header chunks. 'channel' may also be a list of channels,
+        whose lines are then interleaved just as they are in getText(). If
+        'tail' is given, only the last 'tail' lines are produced, and an
+        indexed log is read from the nearest chunk rather than from the
+        beginning."""
+        if isinstance(channel, int):
+            channels = [channel]
+        else:
+            channels = channel
+        if not tail:
+            return linesFromChunks(self.getChunks(channels, onlyText=True))
+
+        # the line counts in the index cover all channels, so keep reaching
+        # further back until these channels have produced enough lines
+        want = tail
+        while True:
+            start = self.getChunkForLine(-want)
+            lines = deque()
+            count = 0
+            for line in linesFromChunks(self.getChunks(channels, onlyText=True,
+                                                       start=start)):
+                lines.append(line)
+                count += 1
+                if len(lines) > tail:
+                    lines.popleft()
+            # unless we started at the beginning, the first line may be a
+            # fragment of one that began earlier, so make sure it was dropped
+            if count > tail or not start:
+                return list(lines)
+            want *= 2
 
     def subscribe(self, receiver, catchup):
         if self.finished:
@@ -415,8 +661,8 @@ class LogFile:
         if receiver in self.watchers:
             self.watchers.remove(receiver)
 
-    def subscribeConsumer(self, consumer):
-        p = LogFileProducer(self, consumer)
+    def subscribeConsumer(self, consumer, startChunk=0):
+        p = LogFileProducer(self, consumer, startChunk)
         p.resumeProducing()
 
     # interface used by the build steps to add things to the log
@@ -434,12 +680,18 @@ class LogFile:
         offset = 0
         while offset < len(text):
             size = min(len(text)-offset, self.chunkSize)
+            if self.index is not None:
+                self.index.append(f.tell(), channel, self.numLines)
+            chunk = text[offset:offset+size]
             f.write("%d:%d" % (1 + size, channel))
-            f.write(text[offset:offset+size])
+            f.write(chunk)
             f.write(",")
+            self.numLines += chunk.count("\n")
             offset += size
         self.runEntries = []
         self.runLength = 0
+        if self.compressMethod == "blocks":
+            self.compressFrames()
 
     def addEntry(self, channel, text):
         assert not self.finished
@@ -510,6 +762,8 @@ class LogFile:
             # filehandle will be released and automatically closed.
             self.openfile.flush()
             del self.openfile
+        if self.index is not None:
+            self.index.close()
         self.finished = True
         watchers = self.finishedWatchers
         self.finishedWatchers = []
@@ -518,12 +772,45 @@ class LogFile:
         self.watchers = []
 
 
+    def compressFrames(self):
+        """Compress any complete frames of a running log in a thread, so
+        that compressLog has less to do when the step finishes. This is only
+        used with the 'blocks' compression method, and only for logs that
+        will be compressed anyway."""
+        f = self.openfile
+        f.seek(0, 2)
+        length = f.tell()
+        if self.compressLimit is False or length <= self.compressLimit:
+            return
+        while length - self.framedLength >= self.compressFrameSize:
+            if not self.frameWriter:
+                self.frameWriter = BlockFileWriter(self.getFilename() +
+                                                   ".blocks.tmp")
+                self.frameWriting = defer.succeed(None)
+            # read on the reactor thread, since readers share this handle
+            f.seek(self.framedLength)
+            data = f.read(self.compressFrameSize)
+            self.framedLength += len(data)
+            self.frameWriting.addCallback(lambda _, data=data:
+                threads.deferToThread(self.frameWriter.writeFrame, data))
+
     def compressLog(self):
         # bail out if there's no compression support
         if self.compressMethod == "bz2":
             compressed = self.getFilename() + ".bz2.tmp"
         elif self.compressMethod == "gz":
             compressed = self.getFilename() + ".gz.tmp"
+        elif self.compressMethod == "blocks":
+            compressed = self.getFilename() + ".blocks.tmp"
+            if self.frameWriting:
+                # wait for the frames that were started while running
+                d = self.frameWriting
+                self.frameWriting = None
+                d.addCallback(lambda _:
+                    threads.deferToThread(self._compressLog, compressed))
+                d.addCallback(self._renameCompressedLog, compressed)
+                d.addErrback(self._cleanupFailedCompress, compressed)
+                return d
         d = threads.deferToThread(self._compressLog, compressed)
         d.addCallback(self._renameCompressedLog, compressed)
         d.addErrback(self._cleanupFailedCompress, compressed)
@@ -531,6 +818,20 @@ class LogFile:
 
     def _compressLog(self, compressed):
         infile = self.getFile()
+        if self.compressMethod == "blocks":
+            # pick up where compressFrames left off
+            writer = self.frameWriter
+            if not writer:
+                writer = BlockFileWriter(compressed)
+            self.frameWriter = None
+            infile.seek(self.framedLength)
+            while True:
+                buf = infile.read(self.compressFrameSize)
+                writer.writeFrame(buf)
+                if len(buf) < self.compressFrameSize:
+                    break
+            writer.close()
+            return
         if self.compressMethod == "bz2":
             cf = BZ2File(compressed, 'w')
         elif self.compressMethod == "gz":
@@ -545,6 +846,8 @@ class LogFile:
     def _renameCompressedLog(self, rv, compressed):
         if self.compressMethod == "bz2":
             filename = self.getFilename() + '.bz2'
+        elif self.compressMethod == "blocks":
+            filename = self.getFilename() + '.blocks'
         else:
             filename = self.getFilename() + '.gz'
         if runtime.platformType  == 'win32':
@@ -573,6 +876,11 @@ class LogFile:
             del d['finished']
         if d.has_key('openfile'):
             del d['openfile']
+        if d.has_key('index'):
+            del d['index'] # reopened by getIndex()
+        for k in ('frameWriter', 'frameWriting'):
+            if d.has_key(k):
+                del d[k]
         return d
 
     def __setstate__(self, d):
@@ -589,6 +897,8 @@ class LogFile:
         self.filename = logfilename
         if not os.path.exists(self.getFilename()):
             self.openfile = open(self.getFilename(), "w")
+            self.index = LogFileIndex(self.getFilename() + ".idx")
+            self.index.create()
             self.finished = False
             for channel,text in self.entries:
                 self.addEntry(channel, text)
@@ -624,6 +934,11 @@ class HTMLLogFile:
         return self.html
     def getChunks(self):
         return [(STDERR, self.html)]
+    def readlines(self, channel=STDOUT, tail=None):
+        lines = StringIO(self.html).readlines()
+        if tail:
+            return lines[-tail:]
+        return lines
 
     def subscribe(self, receiver, catchup):
         pass
@@ -980,6 +1295,7 @@ class BuildStepStatus(styles.Versioned):
         log.logMaxSize = self.build.builder.logMaxSize
         log.logMaxTailSize = self.build.builder.logMaxTailSize
         log.compressMethod = self.build.builder.logCompressionMethod
+        log.compressLimit = self.build.builder.logCompressionLimit
         self.logs.append(log)
         for w in self.watchers:
             receiver = w.logStarted(self.build, self, log)
@@ -1122,6 +1438,8 @@ class BuildStatus(styles.Versioned):
     implements(interfaces.IBuildStatus, interfaces.IStatusEvent)
     persistenceVersion = 3
 
+    # a guess at our memory footprint, until we know how big our pickle is
+    estimatedSize = 64*1024
     source = None
     reason = None
     changes = []
@@ -1187,6 +1505,14 @@ class BuildStatus(styles.Versioned):
             return self.source
         return self.source.getAbsoluteSourceStamp(self.properties['got_revision'])
 
+    def getSourceStampKey(self):
+        """Return the L{sourceStampKey} of my absolute source stamp, or None
+        if I have no source stamp."""
+        ss = self.getSourceStamp(absolute=True)
+        if ss is None:
+            return None
+        return sourceStampKey(ss)
+
     def getReason(self):
         return self.reason
 
@@ -1274,6 +1600,25 @@ class BuildStatus(styles.Versioned):
     def getTestResults(self):
         return self.testResults
 
+    def getSummary(self):
+        """Return a dictionary with the few facts about this build that
+        history displays ask for most often. This is stored in the builder's
+        summary index, so that those displays need not load the build."""
+        ss = self.getSourceStamp()
+        branch = revision = None
+        if ss:
+            branch, revision = ss.branch, ss.revision
+        return {'number': self.number,
+                'times': self.getTimes(),
+                'results': self.results,
+                'text': self.getText(),
+                'branch': branch,
+                'revision': revision,
+                'slavename': self.slavename,
+                'reason': self.reason,
+                'blamelist': self.blamelist,
+                'source_key': self.getSourceStampKey()}
+
     def getTestResultsOrd(self):
         trs = self.testResults.keys()
         trs.sort()
@@ -1446,7 +1791,8 @@ class BuildStatus(styles.Versioned):
             # was interrupted. The builder will have a 'shutdown' event, but
             # someone looking at just this build will be confused as to why
             # the last log is truncated.
-        for k in 'builder', 'watchers', 'updates', 'finishedWatchers':
+        for k in ('builder', 'watchers', 'updates', 'finishedWatchers',
+                  'estimatedSize'):
             if k in d: del d[k]
         return d
 
@@ -1502,22 +1848,37 @@ class BuildStatus(styles.Versioned):
         for s in self.steps:
             s.checkLogfiles()
 
-    def saveYourself(self):
+    def getPickle(self):
+        """Return my pickle, as a string."""
+        data = dumps(self, -1)
+        # the size of the pickle is a fair estimate of our memory usage
+        self.estimatedSize = len(data)
+        return data
+
+    def writePickle(self, data):
+        """Write a pickle returned by getPickle to my file, raising an
+        exception if that fails. This does not look at the rest of my state,
+        so it may run in a thread."""
         filename = os.path.join(self.builder.basedir, "%d" % self.number)
         if os.path.isdir(filename):
             # leftover from 0.5.0, which stored builds in directories
             shutil.rmtree(filename, ignore_errors=True)
         tmpfilename = filename + ".tmp"
+        f = open(tmpfilename, "wb")
+        f.write(data)
+        f.close()
+        if runtime.platformType  == 'win32':
+            # windows cannot rename a file on top of an existing one, so
+            # fall back to delete-first. There are ways this can fail and
+            # lose the builder's history, so we avoid using it in the
+            # general (non-windows) case
+            if os.path.exists(filename):
+                os.unlink(filename)
+        os.rename(tmpfilename, filename)
+
+    def saveYourself(self):
         try:
-            dump(self, open(tmpfilename, "wb"), -1)
-            if runtime.platformType  == 'win32':
-                # windows cannot rename a file on top of an existing one, so
-                # fall back to delete-first. There are ways this can fail and
-                # lose the builder's history, so we avoid using it in the
-                # general (non-windows) case
-                if os.path.exists(filename):
-                    os.unlink(filename)
-            os.rename(tmpfilename, filename)
+            self.writePickle(self.getPickle())
         except:
             log.msg("unable to save build %s-#%d" % (self.builder.name,
                                                      self.number))
@@ -1552,6 +1913,88 @@ class BuildStatus(styles.Versioned):
 
 
 
+class BuildSummary:
+    """I stand in for a finished BuildStatus that is not in memory, answering
+    the questions that history displays ask most often from the builder's
+    summary index. Anything else loads the full BuildStatus from its pickle
+    and is delegated to it, so I can be used wherever a BuildStatus can."""
+
+    implements(interfaces.IBuildStatus, interfaces.IStatusEvent)
+
+    build = None
+
+    def __init__(self, builder, summary):
+        self.builder = builder
+        self.number = summary['number']
+        self.summary = summary
+        self.build = None
+
+    def __getattr__(self, name):
+        if name.startswith('__'):
+            # special methods (__conform__, __cmp__, ...) are looked up when
+            # adapting or comparing summaries, and must not load the build
+            raise AttributeError(name)
+        if self.build is None:
+            self.build = self.builder.getBuildByNumber(self.number)
+        return getattr(self.build, name)
+
+    def __repr__(self):
+        return "<BuildSummary %s #%d>" % (self.builder.name, self.number)
+    def __nonzero__(self):
+        # without this, truth tests would go through __getattr__ and load
+        # the build
+        return True
+    def __eq__(self, other):
+        if not isinstance(other, BuildSummary):
+            return False
+        return (self.builder.name, self.number) == \
+               (other.builder.name, other.number)
+    def __ne__(self, other):
+        return not self.__eq__(other)
+    def __hash__(self):
+        return hash((self.builder.name, self.number))
+
+    def getBuilder(self):
+        return self.builder
+    def getNumber(self):
+        return self.number
+    def getPreviousBuild(self):
+        if self.number == 0:
+            return None
+        return self.builder.getBuild(self.number-1)
+    def getBranch(self):
+        return self.summary['branch']
+    def getRevision(self):
+        return self.summary['revision']
+    def getReason(self):
+        return self.summary['reason']
+    def getResponsibleUsers(self):
+        return self.summary['blamelist']
+    def getTimes(self):
+        return tuple(self.summary['times'])
+    def isStarted(self):
+        return True
+    def isFinished(self):
+        return True
+    def getETA(self):
+        return None
+    def getCurrentStep(self):
+        return None
+    def getText(self):
+        return self.summary['text']
+    def getResults(self):
+        return self.summary['results']
+    def getSlavename(self):
+        return self.summary['slavename']
+    def getSourceStampKey(self):
+        if 'source_key' not in self.summary:
+            # summarized by an older version
+            return self.__getattr__('getSourceStampKey')()
+        key = self.summary['source_key']
+        if key is None:
+            return None
+        return tuple(key)
+
 class BuilderStatus(styles.Versioned):
     """I handle status information for a single process.base.Builder object.
     That object sends status changes to me (frequently as Events), and I
@@ -1576,7 +2019,9 @@ class BuilderStatus(styles.Versioned):
 
     # these limit the amount of memory we consume, as well as the size of the
     # main Builder pickle. The Build and LogFile pickles on disk must be
-    # handled separately.
+    # handled separately. Recently-used builds are kept in buildCacheLRU,
+    # which the Status object shares among all builders; buildCacheSize is
+    # this builder's contribution to its size.
     buildCacheSize = 15
     eventHorizon = 50 # forget events beyond this
 
@@ -1587,6 +2032,9 @@ class BuilderStatus(styles.Versioned):
     category = None
     currentBigState = "offline" # or idle/waiting/interlocked/building
     basedir = None # filled in by our parent
+    summaries = None # loaded from our summary index when first needed
+    backfillWaiters = None # set while backfillSummaries is running
+    backfillBatchSize = 100
 
     def __init__(self, buildername, category=None):
         self.name = buildername
@@ -1603,7 +2051,10 @@ class BuilderStatus(styles.Versioned):
         self.nextBuild = None
         self.watchers = []
         self.buildCache = weakref.WeakValueDictionary()
-        self.buildCache_LRU = []
+        self.buildCacheLRU = util.LRUCache(self.buildCacheSize)
+        self.buildsLoading = {}
+        self.buildsSaving = {}
+        self.buildsSaveQueued = {}
         self.logCompressionLimit = False # default to no compression for tests
         self.logCompressionMethod = "bz2"
         self.logMaxSize = None # No default limit
@@ -1619,7 +2070,11 @@ class BuilderStatus(styles.Versioned):
         d = styles.Versioned.__getstate__(self)
         d['watchers'] = []
         del d['buildCache']
-        del d['buildCache_LRU']
+        del d['buildCacheLRU']
+        d.pop('summaries', None)
+        d.pop('backfillWaiters', None)
+        for k in ('buildsLoading', 'buildsSaving', 'buildsSaveQueued'):
+            d.pop(k, None)
         for b in self.currentBuilds:
             b.saveYourself()
             # TODO: push a 'hey, build was interrupted' event
@@ -1636,7 +2091,10 @@ class BuilderStatus(styles.Versioned):
         # upgradeToVersion1 and such will be called after this finishes.
         styles.Versioned.__setstate__(self, d)
         self.buildCache = weakref.WeakValueDictionary()
-        self.buildCache_LRU = []
+        self.buildCacheLRU = util.LRUCache(self.buildCacheSize)
+        self.buildsLoading = {}
+        self.buildsSaving = {}
+        self.buildsSaveQueued = {}
         self.currentBuilds = []
         self.watchers = []
         self.slavenames = []
@@ -1648,6 +2106,10 @@ class BuilderStatus(styles.Versioned):
         # gets pickled and unpickled.
         if buildmaster.buildCacheSize:
             self.buildCacheSize = buildmaster.buildCacheSize
+            if getattr(self, 'status', None):
+                self.status.setBuildCacheShare(self.name, self.buildCacheSize)
+            else:
+                self.buildCacheLRU.setMaxSize(self.buildCacheSize)
 
     def upgradeToVersion1(self):
         if hasattr(self, 'slavename'):
@@ -1674,7 +2136,7 @@ class BuilderStatus(styles.Versioned):
         self.logCompressionLimit = lowerLimit
 
     def setLogCompressionMethod(self, method):
-        assert method in ("bz2", "gz")
+        assert method in ("bz2", "gz", "blocks")
         self.logCompressionMethod = method
 
     def setLogMaxSize(self, upperLimit):
@@ -1710,38 +2172,153 @@ class BuilderStatus(styles.Versioned):
 
     def touchBuildCache(self, build):
         self.buildCache[build.number] = build
-        if build in self.buildCache_LRU:
-            self.buildCache_LRU.remove(build)
-        self.buildCache_LRU = self.buildCache_LRU[-(self.buildCacheSize-1):] + [ build ]
+        self.buildCacheLRU.add((self.name, build.number), build,
+                        getattr(build, 'estimatedSize', BuildStatus.estimatedSize))
         return build
 
     def getBuildByNumber(self, number):
-        # first look in currentBuilds
+        # first look in currentBuilds and the buildCache (builds that have
+        # left the LRU may still be in memory)
+        build = self._getBuildFromMemory(number)
+        if build is not None:
+            return build
+
+        # then fall back to loading it from disk
+        return self._setupLoadedBuild(self._readBuildPickle(number), number)
+
+    def _getBuildFromMemory(self, number):
         for b in self.currentBuilds:
             if b.number == number:
                 return self.touchBuildCache(b)
-
-        # then in the buildCache
+        build = self.buildCacheLRU.get((self.name, number))
+        if build is not None:
+            return build
         if number in self.buildCache:
             return self.touchBuildCache(self.buildCache[number])
+        return None
 
-        # then fall back to loading it from disk
+    def _readBuildPickle(self, number):
+        # this may run in a thread, so it must not touch our state
         filename = self.makeBuildFilename(number)
+        log.msg("Loading builder %s's build %d from on-disk pickle"
+            % (self.name, number))
+        _unpickleLock.acquire()
         try:
-            log.msg("Loading builder %s's build %d from on-disk pickle"
-                % (self.name, number))
-            build = load(open(filename, "rb"))
-            styles.doUpgrade()
-            build.builder = self
-            # handle LogFiles from after 0.5.0 and before 0.6.5
-            build.upgradeLogfiles()
-            # check that logfiles exist
-            build.checkLogfiles()
-            return self.touchBuildCache(build)
-        except IOError:
-            raise IndexError("no such build %d" % number)
-        except EOFError:
-            raise IndexError("corrupted build pickle %d" % number)
+            try:
+                f = open(filename, "rb")
+                build = load(f)
+                build.estimatedSize = f.tell()
+                f.close()
+                styles.doUpgrade()
+            except IOError:
+                raise IndexError("no such build %d" % number)
+            except EOFError:
+                raise IndexError("corrupted build pickle %d" % number)
+        finally:
+            _unpickleLock.release()
+        return build
+
+    def _setupLoadedBuild(self, build, number):
+        build.builder = self
+        # handle LogFiles from after 0.5.0 and before 0.6.5
+        build.upgradeLogfiles()
+        # check that logfiles exist
+        build.checkLogfiles()
+        # builds from before the summary index get added to it now
+        if build.isFinished() and number not in self.getSummaries():
+            self.addSummary(build)
+        return self.touchBuildCache(build)
+
+    # asynchronous persistence: these keep pickling and unpickling off the
+    # reactor thread
+
+    def loadBuild(self, number):
+        """Return a Deferred that fires with the given build. If it is not
+        already in memory, it is read and unpickled in a thread. Concurrent
+        loads of the same build share a single read. As with getBuild,
+        negative numbers count back from the next build. The Deferred
+        errbacks with IndexError if there is no such build."""
+        if number < 0:
+            number = self.nextBuildNumber + number
+        if number < 0 or number >= self.nextBuildNumber:
+            return defer.fail(IndexError("no such build %d" % number))
+        build = self._getBuildFromMemory(number)
+        if build is not None:
+            return defer.succeed(build)
+        d = defer.Deferred()
+        if number in self.buildsLoading:
+            self.buildsLoading[number].append(d)
+            return d
+        waiters = self.buildsLoading[number] = [d]
+        def loaded(build):
+            del self.buildsLoading[number]
+            # a synchronous load may have beaten us to it
+            inMemory = self._getBuildFromMemory(number)
+            if inMemory is not None:
+                return inMemory
+            return self._setupLoadedBuild(build, number)
+        def failed(f):
+            self.buildsLoading.pop(number, None)
+            return f
+        dl = threads.deferToThread(self._readBuildPickle, number)
+        dl.addCallbacks(loaded, failed)
+        def distribute(res):
+            for w in waiters:
+                if isinstance(res, failure.Failure):
+                    w.errback(res)
+                else:
+                    w.callback(res)
+        dl.addBoth(distribute)
+        return d
+
+    def saveBuild(self, build):
+        """Save the given build's pickle, and return a Deferred that fires
+        when it has been written, or errbacks if it could not be. Requests to
+        save a build which is already being saved are coalesced: they wait
+        for the save in progress, then share a single further save.
+
+        The build is pickled when its save starts, on the reactor thread, so
+        later changes to it are left for the next save; only the writing is
+        done in a thread."""
+        number = build.number
+        d = defer.Deferred()
+        if number in self.buildsSaving:
+            self.buildsSaveQueued.setdefault(number, []).append(d)
+            return d
+        self._startSave(build, [d])
+        return d
+
+    def _startSave(self, build, waiters):
+        number = build.number
+        self.buildsSaving[number] = waiters
+        def saved(res):
+            del self.buildsSaving[number]
+            queued = self.buildsSaveQueued.pop(number, None)
+            if queued:
+                self._startSave(build, queued)
+            for w in waiters:
+                if isinstance(res, failure.Failure):
+                    w.errback(res)
+                else:
+                    w.callback(None)
+        try:
+            data = build.getPickle()
+        except:
+            d = defer.fail()
+        else:
+            d = threads.deferToThread(build.writePickle, data)
+        d.addBoth(saved)
+
+    def waitUntilSaved(self):
+        """Return a Deferred that fires when all saves started with
+        L{saveBuild} have finished."""
+        dl = []
+        for number, waiters in self.buildsSaving.items():
+            d = defer.Deferred()
+            self.buildsSaveQueued.get(number, waiters).append(d)
+            dl.append(d)
+        # failures are reported to the callers of saveBuild
+        return defer.DeferredList(dl, consumeErrors=True)
 
     def prune(self, events_only=False):
         # begin by pruning our own events
@@ -1769,6 +2346,8 @@ class BuilderStatus(styles.Versioned):
         if earliest_build == 0:
             return
 
+        self._pruneSummaries(earliest_build)
+
         # skim the directory and delete anything that shouldn't be there anymore
         build_re = re.compile(r"^([0-9]+)$")
         build_log_re = re.compile(r"^([0-9]+)-.*$")
@@ -1825,16 +2404,158 @@ class BuilderStatus(styles.Versioned):
         return self.category
 
     def getBuild(self, number):
+        """Return the given build. A finished build which is not in memory
+        is represented by a L{BuildSummary} from the summary index, which
+        will only load the build's pickle if details beyond the summary are
+        needed."""
         if number < 0:
             number = self.nextBuildNumber + number
         if number < 0 or number >= self.nextBuildNumber:
             return None
 
+        summary = self.getSummaries().get(number)
+        if summary is not None and not self.isBuildInMemory(number):
+            return BuildSummary(self, summary)
+
         try:
             return self.getBuildByNumber(number)
         except IndexError:
             return None
 
+    def isBuildInMemory(self, number):
+        for b in self.currentBuilds:
+            if b.number == number:
+                return True
+        return number in self.buildCache
+
+    # build summary index
+
+    def getSummaryFilename(self):
+        return os.path.join(self.basedir, "summaries")
+
+    def getSummaries(self):
+        """Return a dictionary mapping build number to the summary of that
+        finished build (see L{BuildStatus.getSummary}), as recorded in the
+        summary index. The index is an append-only file of JSON lines, in
+        which later lines supersede earlier ones for the same build."""
+        if self.summaries is None:
+            self.summaries = {}
+            try:
+                f = open(self.getSummaryFilename(), "r")
+            except IOError:
+                return self.summaries
+            for line in f:
+                try:
+                    summary = json.loads(line)
+                except ValueError:
+                    continue # probably a partial write
+                self.summaries[summary['number']] = summary
+            f.close()
+        return self.summaries
+
+    def addSummary(self, build):
+        summary = build.getSummary()
+        try:
+            line = json.dumps(summary)
+        except (TypeError, ValueError, UnicodeError):
+            log.msg("unable to summarize build %s-#%d" % (self.name,
+                                                          build.number))
+            return
+        # use the decoded form, so all summaries look alike
+        summary = json.loads(line)
+        self.getSummaries()[build.number] = summary
+        self.status.recentBuilds.buildSummarized(self, summary)
+        try:
+            f = open(self.getSummaryFilename(), "a")
+            f.write(line + "\n")
+            f.close()
+        except IOError:
+            log.msg("unable to update build summaries for %s" % self.name)
+            log.err()
+
+    def backfillSummaries(self):
+        """Add the finished builds which are missing from the summary index,
+        such as those saved before it existed. Their pickles are read in a
+        thread, newest first and backfillBatchSize at a time, without going
+        through the build cache, and each batch is summarized as it arrives.
+        Once added, they stay in the index, so this is only slow the first
+        time after an upgrade. Returns a Deferred that fires when it is
+        done."""
+        d = defer.Deferred()
+        if self.backfillWaiters is not None:
+            # already under way
+            self.backfillWaiters.append(d)
+            return d
+        self.backfillWaiters = [d]
+
+        summaries = self.getSummaries()
+        if self.buildHorizon:
+            earliest_build = max(0, self.nextBuildNumber - self.buildHorizon)
+        else:
+            earliest_build = 0
+        numbers = [ n for n in range(self.nextBuildNumber - 1,
+                                     earliest_build - 1, -1)
+                    if n not in summaries ]
+
+        def read(batch):
+            # this runs in a thread, so it must not touch our state
+            builds = []
+            for number in batch:
+                if not os.path.exists(self.makeBuildFilename(number)):
+                    continue # pruned, or never saved
+                try:
+                    builds.append(self._readBuildPickle(number))
+                except IndexError:
+                    pass
+            return builds
+        def add(builds):
+            summaries = self.getSummaries()
+            for build in builds:
+                # builds may have been summarized, or be running again,
+                # since they were read
+                if build.number in summaries or not build.isFinished():
+                    continue
+                build.builder = self
+                self.addSummary(build)
+        @defer.deferredGenerator
+        def backfill():
+            while numbers:
+                batch = numbers[:self.backfillBatchSize]
+                del numbers[:self.backfillBatchSize]
+                wfd = defer.waitForDeferred(threads.deferToThread(read, batch))
+                yield wfd
+                add(wfd.getResult())
+
+        def done(res):
+            waiters = self.backfillWaiters
+            self.backfillWaiters = None
+            for w in waiters:
+                w.callback(None)
+        d2 = backfill()
+        d2.addErrback(log.err)
+        d2.addCallback(done)
+        return d
+
+    def _pruneSummaries(self, earliest_build):
+        summaries = self.getSummaries()
+        pruned = [ n for n in summaries if n < earliest_build ]
+        if not pruned:
+            return
+        for n in pruned:
+            del summaries[n]
+        self.status.recentBuilds.buildsPruned(self, pruned)
+        numbers = summaries.keys()
+        numbers.sort()
+        filename = self.getSummaryFilename()
+        f = open(filename + ".tmp", "w")
+        for n in numbers:
+            f.write(json.dumps(summaries[n]) + "\n")
+        f.close()
+        if runtime.platformType  == 'win32':
+            if os.path.exists(filename):
+                os.unlink(filename)
+        os.rename(filename + ".tmp", filename)
+
     def getEvent(self, number):
         try:
             return self.events[number]
@@ -1865,7 +2586,7 @@ class BuilderStatus(styles.Versioned):
                 if end >= finished_before:
                     continue
             if branches:
-                if build.getSourceStamp().branch not in branches:
+                if self._getBranch(build) not in branches:
                     continue
             got += 1
             yield build
@@ -1876,7 +2597,12 @@ class BuilderStatus(styles.Versioned):
     def eventGenerator(self, branches=[], categories=[], committers=[], minTime=0):
         """This function creates a generator which will provide all of this
         Builder's status events, starting with the most recent and
-        progressing backwards in time. """
+        progressing backwards in time.
+
+        Builds are filtered by time, branch and category using the summary
+        index, but every build which is produced is loaded, because its
+        steps are produced too. Stop consuming the generator once events
+        are old enough to be of no interest."""
 
         # remember the oldest-to-earliest flow here. "next" means earlier.
 
@@ -1900,7 +2626,7 @@ class BuilderStatus(styles.Versioned):
                 break
             if b.getTimes()[0] < minTime:
                 break
-            if branches and not b.getSourceStamp().branch in branches:
+            if branches and not self._getBranch(b) in branches:
                 continue
             if categories and not b.getBuilder().getCategory() in categories:
                 continue
@@ -1923,6 +2649,12 @@ class BuilderStatus(styles.Versioned):
             if e and e.getTimes()[0] < minTime:
                 break
 
+    def _getBranch(self, build):
+        # a BuildSummary knows its branch without loading the build
+        if isinstance(build, BuildSummary):
+            return build.getBranch()
+        return build.getSourceStamp().branch
+
     def subscribe(self, receiver):
         # will get builderChangedState, buildStarted, buildFinished,
         # requestSubmitted, requestCancelled. Note that a request which is
@@ -2027,7 +2759,12 @@ class BuilderStatus(styles.Versioned):
 
     def _buildFinished(self, s):
         assert s in self.currentBuilds
-        s.saveYourself()
+        d = self.saveBuild(s)
+        def saveFailed(f):
+            log.msg("unable to save build %s-#%d" % (self.name, s.number))
+            log.err(f)
+        d.addErrback(saveFailed)
+        self.addSummary(s)
         self.currentBuilds.remove(s)
 
         name = self.getName()
@@ -2240,6 +2977,106 @@ class SlaveStatus:
         result['runningBuilds'] = [b.asDict() for b in self.getRunningBuilds()]
         return result
 
+class RecentBuilds:
+    """I am an index of the finished builds of every builder, ordered by the
+    time they finished. Each entry is (finish time, builder name, build
+    number, results), taken from the builders' summary indexes, so I can
+    find the most recent builds across all builders, by builder or by
+    result, without walking each builder's history.
+
+    A builder's summaries are only read when I am first asked about its
+    builds; after that I am told about each new summary, including those
+    of old builds which the builder adds to its index in the background,
+    and about builds which are pruned."""
+
+    def __init__(self):
+        self.entries = []
+        self.builders = {} # builder name -> BuilderStatus
+        self.pending = set() # builders whose summaries are not yet indexed
+        self.index = {} # (builder name, build number) -> entry
+
+    def addBuilder(self, builder_status):
+        self.removeBuilder(builder_status.name)
+        self.builders[builder_status.name] = builder_status
+        self.pending.add(builder_status.name)
+
+    def removeBuilder(self, name):
+        if name not in self.builders:
+            return
+        del self.builders[name]
+        self.pending.discard(name)
+        self.entries = [ e for e in self.entries if e[1] != name ]
+        for key in [ k for k in self.index if k[0] == name ]:
+            del self.index[key]
+
+    def _makeEntry(self, name, summary):
+        return (summary['times'][1], name, summary['number'],
+                summary['results'])
+
+    def _indexPending(self):
+        if not self.pending:
+            return
+        pending = list(self.pending)
+        self.pending.clear()
+        for name in pending:
+            summaries = self.builders[name].getSummaries()
+            for summary in summaries.values():
+                entry = self._makeEntry(name, summary)
+                self.index[(name, summary['number'])] = entry
+                self.entries.append(entry)
+        self.entries.sort()
+        for name in pending:
+            # builds from before the summary index are added to it in the
+            # background, and reach me through buildSummarized
+            d = self.builders[name].backfillSummaries()
+            d.addErrback(log.err)
+
+    def _remove(self, name, number):
+        entry = self.index.pop((name, number), None)
+        if entry is None:
+            return
+        i = bisect.bisect_left(self.entries, entry)
+        if i < len(self.entries) and self.entries[i] == entry:
+            del self.entries[i]
+
+    def buildSummarized(self, builder_status, summary):
+        """The given builder has added this summary to its index."""
+        name = builder_status.name
+        if self.builders.get(name) is not builder_status:
+            return
+        if name in self.pending:
+            return # it will be read with the rest
+        self._remove(name, summary['number'])
+        entry = self._makeEntry(name, summary)
+        self.index[(name, summary['number'])] = entry
+        bisect.insort(self.entries, entry)
+
+    def buildsPruned(self, builder_status, numbers):
+        """The given builder has removed these builds from its index."""
+        name = builder_status.name
+        if self.builders.get(name) is not builder_status:
+            return
+        for number in numbers:
+            self._remove(name, number)
+
+    def generateEntries(self, finished_before=None):
+        """Generate my entries, most recently finished first. Entries may be
+        added while this generator is suspended; each step finds its place
+        again, so that none are produced twice."""
+        self._indexPending()
+        if finished_before is None:
+            i = len(self.entries)
+        else:
+            i = bisect.bisect_left(self.entries, (finished_before,))
+        while i > 0:
+            entry = self.entries[i-1]
+            yield entry
+            i = bisect.bisect_left(self.entries, entry)
+
+    def __len__(self):
+        self._indexPending()
+        return len(self.entries)
+
 class Status:
     """
     I represent the status of the buildmaster.
@@ -2271,6 +3108,14 @@ class Status:
         # No default limit to the log size
         self.logMaxSize = None
         self.logMaxTailSize = None
+        # recently-used builds, shared among all builders. Each builder adds
+        # its buildCacheSize to the number of builds this can hold, and the
+        # total estimated size of the builds can also be limited.
+        self.buildCache = util.LRUCache(0)
+        self.buildCacheShares = {}
+        self.buildCacheMaxBytes = None
+        # finished builds of all builders, by the time they finished
+        self.recentBuilds = RecentBuilds()
 
         self._builder_observers = collections.KeyedSets()
         self._buildreq_observers = collections.KeyedSets()
@@ -2400,63 +3245,47 @@ class Status:
 
     def generateFinishedBuilds(self, builders=[], branches=[],
                                num_builds=None, finished_before=None,
-                               max_search=200):
-
-        def want_builder(bn):
-            if builders:
-                return bn in builders
-            return True
-        builder_names = [bn
-                         for bn in self.getBuilderNames()
-                         if want_builder(bn)]
-
-        # 'sources' is a list of generators, one for each Builder we're
-        # using. When the generator is exhausted, it is replaced in this list
-        # with None.
-        sources = []
-        for bn in builder_names:
-            b = self.getBuilder(bn)
-            g = b.generateFinishedBuilds(branches,
-                                         finished_before=finished_before,
-                                         max_search=max_search)
-            sources.append(g)
-
-        # next_build the next build from each source
-        next_build = [None] * len(sources)
-
-        def refill():
-            for i,g in enumerate(sources):
-                if next_build[i]:
-                    # already filled
-                    continue
-                if not g:
-                    # already exhausted
-                    continue
-                try:
-                    next_build[i] = g.next()
-                except StopIteration:
-                    next_build[i] = None
-                    sources[i] = None
-
+                               max_search=200, categories=[], results=None):
+        # the recent builds index is already ordered by finish time, and
+        # filtering by builder, category or result needs nothing more, so
+        # only builds which pass those filters are looked up and count
+        # towards max_search
+        wanted = {} # builder name -> builds examined
+        for bn, builder in self.recentBuilds.builders.items():
+            if builders and bn not in builders:
+                continue
+            if categories and builder.category not in categories:
+                continue
+            wanted[bn] = 0
+        if not wanted:
+            return
+        exhausted = 0
         got = 0
-        while True:
-            refill()
-            # find the latest build among all the candidates
-            candidates = [(i, b, b.getTimes()[1])
-                          for i,b in enumerate(next_build)
-                          if b is not None]
-            candidates.sort(lambda x,y: cmp(x[2], y[2]))
-            if not candidates:
-                return
-
-            # and remove it from the list
-            i, build, finshed_time = candidates[-1]
-            next_build[i] = None
+        for (finished, bn, number, result) in \
+                self.recentBuilds.generateEntries(finished_before):
+            if bn not in wanted:
+                continue
+            if results is not None and result not in results:
+                continue
+            wanted[bn] += 1
+            if wanted[bn] > max_search:
+                if wanted[bn] == max_search + 1:
+                    exhausted += 1
+                    if exhausted == len(wanted):
+                        return
+                continue
+            builder = self.recentBuilds.builders.get(bn)
+            if builder is None:
+                continue # removed since we started
+            build = builder.getBuild(number)
+            if build is None:
+                continue
+            if branches and builder._getBranch(build) not in branches:
+                continue
             got += 1
             yield build
-            if num_builds is not None:
-                if got >= num_builds:
-                    return
+            if num_builds is not None and got >= num_builds:
+                return
 
     def subscribe(self, target):
         self.watchers.append(target)
@@ -2509,6 +3338,9 @@ class Status:
         builder_status.setLogCompressionMethod(self.logCompressionMethod)
         builder_status.setLogMaxSize(self.logMaxSize)
         builder_status.setLogMaxTailSize(self.logMaxTailSize)
+        builder_status.buildCacheLRU = self.buildCache
+        self.setBuildCacheShare(name, builder_status.buildCacheSize)
+        self.recentBuilds.addBuilder(builder_status)
 
         for t in self.watchers:
             self.announceNewBuilder(t, name, builder_status)
@@ -2516,6 +3348,8 @@ class Status:
         return builder_status
 
     def builderRemoved(self, name):
+        self.setBuildCacheShare(name, 0)
+        self.recentBuilds.removeBuilder(name)
         for t in self.watchers:
             if hasattr(t, 'builderRemoved'):
                 t.builderRemoved(name)
@@ -2543,8 +3377,35 @@ class Status:
         result['buildbotURL'] = self.getBuildbotURL()
         # TODO: self.getSchedulers()
         # self.getChangeSources()
+        result['buildCache'] = self.getBuildCacheStats()
         return result
 
+    # build cache management
+
+    def setBuildCacheShare(self, buildername, size):
+        """Set the number of builds that the given builder contributes to the
+        shared build cache."""
+        if size:
+            self.buildCacheShares[buildername] = size
+        else:
+            self.buildCacheShares.pop(buildername, None)
+        self.buildCache.setMaxSize(sum(self.buildCacheShares.values()))
+
+    def setBuildCacheMaxBytes(self, maxBytes):
+        """Limit the estimated total size of the cached builds, or remove the
+        limit if maxBytes is None."""
+        self.buildCacheMaxBytes = maxBytes
+        self.buildCache.setMaxWeight(maxBytes)
+
+    def getBuildCacheStats(self):
+        c = self.buildCache
+        return {'builds': len(c),
+                'maxBuilds': sum(self.buildCacheShares.values()),
+                'estimatedBytes': c.weight,
+                'maxBytes': self.buildCacheMaxBytes,
+                'hits': c.hits,
+                'misses': c.misses}
+
     def buildreqs_retired(self, requests):
         for r in requests:
             #r.id: notify subscribers (none right now)
@@ -2612,22 +3473,26 @@ class Status:
     def _builder_unsubscribe(self, buildername, watcher):
         self._builder_observers.discard(buildername, watcher)
 
-    def _db_buildrequest_added(self, category, *brids):
-        self._handle_buildrequest_event("added", brids)
+    def _db_buildrequest_added(self, category, buildername, *brids):
+        self._handle_buildrequest_event("added", brids, buildername)
     def _db_buildrequest_cancelled(self, category, *brids):
         self._handle_buildrequest_event("cancelled", brids)
-    def _handle_buildrequest_event(self, mode, brids):
+    def _handle_buildrequest_event(self, mode, brids, buildername=None):
+        # "add-buildrequest" tells us the builder, "cancel-buildrequest"
+        # does not
         for brid in brids:
-            buildername = self.db.get_buildername_for_brid(brid)
-            if buildername in self._builder_observers:
+            bn = buildername
+            if bn is None:
+                bn = self.db.get_buildername_for_brid(brid)
+            if bn in self._builder_observers:
                 brs = BuildRequestStatus(brid, self, self.db)
-                for observer in self._builder_observers[buildername]:
+                for observer in self._builder_observers[bn]:
                     if mode == "added":
                         if hasattr(observer, 'requestSubmitted'):
                             eventually(observer.requestSubmitted, brs)
                     else:
                         if hasattr(observer, 'requestCancelled'):
-                            builder = self.getBuilder(buildername)
+                            builder = self.getBuilder(bn)
                             eventually(observer.requestCancelled, builder, brs)
 
 # vim: set ts=4 sts=4 sw=4 et:
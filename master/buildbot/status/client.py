@@ -90,7 +90,12 @@ class RemoteBuilder(pb.Referenceable):
         return [IRemote(b) for b in self.b.getCurrentBuilds()]
 
     def remote_getBuild(self, number):
-        return makeRemote(self.b.getBuild(number))
+        d = self.b.loadBuild(number)
+        def missing(f):
+            f.trap(IndexError)
+            return None
+        d.addCallbacks(makeRemote, missing)
+        return d
 
     def remote_getEvent(self, number):
         return IRemote(self.b.getEvent(number))
@@ -23,7 +23,7 @@ except ImportError:
 
 from buildbot import interfaces, util
 from buildbot.status import base
-from buildbot.status.builder import FAILURE, SUCCESS, Results
+from buildbot.status.builder import FAILURE, SUCCESS, Results, STDOUT, STDERR
 
 VALID_EMAIL = re.compile("[a-zA-Z0-9\.\_\%\-\+]+@[a-zA-Z0-9\.\_\%\-]+.[a-zA-Z]{2,6}")
 
@@ -363,6 +363,8 @@ class MailNotifier(base.StatusReceiverMultiService):
         #
         # logs is a list of tuples that contain the log
         # name, log url, and the log contents as a list of strings.
+        # The contents are read a line at a time, rather than splitting
+        # one string holding the whole log.
         #
         logs = list()
         for logf in build.getLogs():
@@ -370,9 +372,11 @@ class MailNotifier(base.StatusReceiverMultiService):
             stepName = logStep.getName()
             logStatus, dummy = logStep.getResults()
             logName = logf.getName()
+            lines = [ line.rstrip("\r\n")
+                      for line in logf.readlines([STDOUT, STDERR]) ]
             logs.append(('%s.%s' % (stepName, logName),
                          '%s/steps/%s/logs/%s' % (master_status.getURLForThing(build), stepName, logName),
-                         logf.getText().splitlines(),
+                         lines,
                          logStatus))
 
         attrs = {'builderName': name,
@@ -7,8 +7,10 @@ except ImportError:
     deque = None
 import os
 import pickle
+import struct
 
 from zope.interface import implements, Interface
+from twisted.python import runtime
 
 
 def ReadFile(path):
@@ -294,6 +296,300 @@ class DiskQueue(object):
             self.lastItemId = files[-1]
 
 
+class JournalQueue(object):
+    """Keeps a list of abstract items in a segmented, append-only journal on
+    disk.
+
+    Items are appended to the newest segment file, and a new segment is
+    started once it grows past segmentSize bytes. Popping items only moves
+    the head cursor, which is kept in a small file alongside the segments;
+    fully-consumed segments are deleted. Items inserted back are written to a
+    new segment ahead of the head. When the queue becomes empty, all of its
+    files are removed.
+
+    Each record is the length of the pickled item (4 bytes, network order)
+    followed by the pickled item. Numbered files left by DiskQueue are moved
+    into the journal on startup."""
+    implements(IQueue)
+
+    RECORD_HEADER = "!I"
+    RECORD_HEADER_SIZE = struct.calcsize(RECORD_HEADER)
+    SEGMENT_PREFIX = "segment."
+    CURSOR_FILE = "cursor"
+
+    def __init__(self, path, maxItems=None, pickleFn=pickle.dumps,
+                 unpickleFn=pickle.loads, segmentSize=2**20, fsync='never'):
+        """
+        @path: directory to save the journal.
+        @maxItems: maximum number of items to keep on disk, flush the
+        older ones.
+        @pickleFn: function used to pack the items to disk.
+        @unpickleFn: function used to unpack items from disk.
+        @segmentSize: size in bytes past which a new segment is started.
+        @fsync: 'never' to leave flushing to the OS, 'cursor' to fsync the
+        head cursor whenever items are popped (so they are not delivered
+        twice after a crash), or 'always' to also fsync every write to the
+        segments.
+        """
+        assert fsync in ('never', 'cursor', 'always'), \
+            "fsync must be 'never', 'cursor' or 'always'"
+        self.path = path
+        self._maxItems = maxItems
+        if self._maxItems is None:
+            self._maxItems = 100000
+        if not os.path.isdir(self.path):
+            os.mkdir(self.path)
+        self.pickleFn = pickleFn
+        self.unpickleFn = unpickleFn
+        self.segmentSize = segmentSize
+        self.fsync = fsync
+
+        # segment numbers, oldest first
+        self._segments = []
+        # the offset of the first unconsumed record in each segment
+        self._offsets = {}
+        # the number of unconsumed records in each segment
+        self._counts = {}
+        self._nbItems = 0
+        # file open for appending to the newest segment
+        self._tailFile = None
+        self._loadFromDisk()
+
+    def pushItem(self, item):
+        ret = None
+        if self._nbItems == self._maxItems:
+            ret = self.popChunk(1)[0]
+        self._appendRecords([self.pickleFn(item)])
+        return ret
+
+    def insertBackChunk(self, chunk):
+        ret = None
+        excess = self._nbItems + len(chunk) - self._maxItems
+        if excess > 0:
+            ret = chunk[0:excess]
+            chunk = chunk[excess:]
+        if not chunk:
+            return ret
+        if self._segments:
+            segment = self._segments[0] - 1
+        else:
+            segment = 0
+        f = open(self._segmentPath(segment), 'wb')
+        try:
+            for item in chunk:
+                self._writeRecord(f, self.pickleFn(item))
+            self._sync(f, 'always')
+        finally:
+            f.close()
+        self._segments.insert(0, segment)
+        self._offsets[segment] = 0
+        self._counts[segment] = len(chunk)
+        self._nbItems += len(chunk)
+        return ret
+
+    def popChunk(self, nbItems=None):
+        if nbItems is None:
+            nbItems = self._maxItems
+        ret = []
+        while len(ret) < nbItems and self._segments:
+            segment = self._segments[0]
+            if segment == self._segments[-1] and self._tailFile:
+                self._tailFile.flush()
+            f = open(self._segmentPath(segment), 'rb')
+            try:
+                f.seek(self._offsets[segment])
+                count = min(nbItems - len(ret), self._counts[segment])
+                for data in self._readRecords(f, count):
+                    ret.append(self.unpickleFn(data))
+                self._offsets[segment] = f.tell()
+            finally:
+                f.close()
+            self._counts[segment] -= count
+            self._nbItems -= count
+            if not self._counts[segment]:
+                self._removeSegment(segment)
+        if ret:
+            if self._nbItems:
+                self._writeCursor()
+            else:
+                self._clear()
+        return ret
+
+    def save(self):
+        if self._tailFile:
+            self._tailFile.flush()
+            if self.fsync != 'never':
+                os.fsync(self._tailFile.fileno())
+
+    def items(self):
+        """Warning, reads the whole journal."""
+        if self._tailFile:
+            self._tailFile.flush()
+        ret = []
+        for segment in self._segments:
+            f = open(self._segmentPath(segment), 'rb')
+            try:
+                f.seek(self._offsets[segment])
+                for data in self._readRecords(f, self._counts[segment]):
+                    ret.append(self.unpickleFn(data))
+            finally:
+                f.close()
+        return ret
+
+    def nbItems(self):
+        return self._nbItems
+
+    def maxItems(self):
+        return self._maxItems
+
+    #### Protected functions
+
+    def _segmentPath(self, segment):
+        return os.path.join(self.path, "%s%d" % (self.SEGMENT_PREFIX, segment))
+
+    def _sync(self, f, level):
+        # fsync f if the policy calls for it at this level
+        if self.fsync == 'always' or (level == 'cursor' and
+                                      self.fsync == 'cursor'):
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _writeRecord(self, f, data):
+        f.write(struct.pack(self.RECORD_HEADER, len(data)))
+        f.write(data)
+
+    def _readRecords(self, f, count):
+        for i in range(count):
+            size, = struct.unpack(self.RECORD_HEADER,
+                                  f.read(self.RECORD_HEADER_SIZE))
+            yield f.read(size)
+
+    def _appendRecords(self, records):
+        if self._tailFile and self._tailFile.tell() >= self.segmentSize:
+            self._tailFile.close()
+            self._tailFile = None
+        if not self._tailFile:
+            segment = 0
+            if self._segments:
+                segment = self._segments[-1]
+                if (os.path.getsize(self._segmentPath(segment))
+                    >= self.segmentSize):
+                    segment += 1
+            self._tailFile = open(self._segmentPath(segment), 'ab')
+            if segment not in self._counts:
+                self._segments.append(segment)
+                self._offsets[segment] = 0
+                self._counts[segment] = 0
+        for data in records:
+            self._writeRecord(self._tailFile, data)
+        self._tailFile.flush()
+        self._sync(self._tailFile, 'always')
+        self._counts[self._segments[-1]] += len(records)
+        self._nbItems += len(records)
+
+    def _removeSegment(self, segment):
+        if segment == self._segments[-1] and self._tailFile:
+            self._tailFile.close()
+            self._tailFile = None
+        os.remove(self._segmentPath(segment))
+        self._segments.remove(segment)
+        del self._offsets[segment]
+        del self._counts[segment]
+
+    def _writeCursor(self):
+        # only the segments that have been partially consumed are listed
+        lines = ["%d %d\n" % (segment, self._offsets[segment])
+                 for segment in self._segments if self._offsets[segment]]
+        path = os.path.join(self.path, self.CURSOR_FILE)
+        f = open(path + ".tmp", 'wb')
+        try:
+            f.write("".join(lines))
+            self._sync(f, 'cursor')
+        finally:
+            f.close()
+        if runtime.platformType == 'win32':
+            # windows cannot rename a file on top of an existing one
+            if os.path.exists(path):
+                os.unlink(path)
+        os.rename(path + ".tmp", path)
+
+    def _clear(self):
+        for segment in self._segments[:]:
+            self._removeSegment(segment)
+        path = os.path.join(self.path, self.CURSOR_FILE)
+        if os.path.exists(path):
+            os.remove(path)
+
+    def _loadFromDisk(self):
+        legacy = []
+        for name in os.listdir(self.path):
+            if name.startswith(self.SEGMENT_PREFIX):
+                try:
+                    self._segments.append(int(name[len(self.SEGMENT_PREFIX):]))
+                except ValueError:
+                    pass
+            else:
+                try:
+                    legacy.append(int(name))
+                except ValueError:
+                    pass
+        self._segments.sort()
+
+        offsets = {}
+        path = os.path.join(self.path, self.CURSOR_FILE)
+        if os.path.exists(path):
+            for line in ReadFile(path).splitlines():
+                segment, offset = [int(x) for x in line.split()]
+                offsets[segment] = offset
+
+        for segment in self._segments:
+            self._offsets[segment] = offsets.get(segment, 0)
+            self._counts[segment] = self._countRecords(segment)
+            self._nbItems += self._counts[segment]
+        for segment in self._segments[:]:
+            if not self._counts[segment]:
+                self._removeSegment(segment)
+
+        # items queued by DiskQueue are older than anything in the journal
+        legacy.sort()
+        if legacy:
+            records = [ReadFile(os.path.join(self.path, str(id)))
+                       for id in legacy]
+            if self._nbItems:
+                self.insertBackChunk([self.unpickleFn(r) for r in records])
+            else:
+                self._appendRecords(records)
+            for id in legacy:
+                os.remove(os.path.join(self.path, str(id)))
+
+    def _countRecords(self, segment):
+        # count the records after the head, and trim any partial record left
+        # by a crash in the middle of a write
+        path = self._segmentPath(segment)
+        size = os.path.getsize(path)
+        count = 0
+        f = open(path, 'rb')
+        try:
+            offset = self._offsets[segment]
+            while offset + self.RECORD_HEADER_SIZE <= size:
+                f.seek(offset)
+                length, = struct.unpack(self.RECORD_HEADER,
+                                        f.read(self.RECORD_HEADER_SIZE))
+                if offset + self.RECORD_HEADER_SIZE + length > size:
+                    break
+                offset += self.RECORD_HEADER_SIZE + length
+                count += 1
+        finally:
+            f.close()
+        if offset < size:
+            f = open(path, 'r+b')
+            try:
+                f.truncate(offset)
+            finally:
+                f.close()
+        return count
+
+
 class PersistentQueue(object):
     """Keeps a list of abstract items and serializes it to the disk.
 
@@ -315,7 +611,7 @@ class PersistentQueue(object):
             self.primaryQueue = MemoryQueue()
         self.secondaryQueue = secondaryQueue
         if self.secondaryQueue is None:
-            self.secondaryQueue = DiskQueue(path)
+            self.secondaryQueue = JournalQueue(path)
         # Preload data from the secondary queue only if we know we won't start
         # using the secondary queue right away.
         if self.secondaryQueue.nbItems() < self.primaryQueue.maxItems():
@@ -5,10 +5,13 @@
 Implements the HTTP receiver."""
 
 import datetime
+import gzip
 import logging
 import os
+import time
 import urllib
 import urlparse
+from cStringIO import StringIO
 
 try:
     import simplejson as json
@@ -16,7 +19,7 @@ except ImportError:
     import json
 
 from buildbot.status.base import StatusReceiverMultiService
-from buildbot.status.persistent_queue import DiskQueue, IndexedQueue, \
+from buildbot.status.persistent_queue import JournalQueue, IndexedQueue, \
         MemoryQueue, PersistentQueue
 from buildbot.status.web.status_json import FilterOut
 from twisted.internet import defer, reactor
@@ -216,11 +219,17 @@ class StatusPush(StatusReceiverMultiService):
             if self.filter:
                 obj = FilterOut(obj)
             packet['payload'][obj_name] = obj
-        self.queue.pushItem(packet)
+        self.queue.pushItem(self.encodePacket(packet))
         if self.task is None or not self.task.active():
             # No task queued since it was probably idle, let's queue a task.
             return self.queueNextServerPush()
 
+    def encodePacket(self, packet):
+        """Returns the form in which a packet is queued. The default is the
+        packet itself; subclasses can serialize it here, once, rather than
+        each time it is sent."""
+        return packet
+
     #### Events
 
     def initialPush(self):
@@ -313,7 +322,7 @@ class HttpStatusPush(StatusPush):
 
     def __init__(self, serverUrl, debug=None, maxMemoryItems=None,
                  maxDiskItems=None, chunkSize=200, maxHttpRequestSize=2**20,
-                 **kwargs):
+                 maxInFlight=1, compress=False, **kwargs):
         """
         @serverUrl: Base URL to be used to push events notifications.
         @maxMemoryItems: Maximum number of items to keep queued in memory.
@@ -323,6 +332,11 @@ class HttpStatusPush(StatusPush):
         @chunkSize: maximum number of items to send in each at each HTTP POST.
         @maxHttpRequestSize: limits the size of encoded data for AE, the default
         is 1MB.
+        @maxInFlight: maximum number of HTTP POSTs to have outstanding at once.
+        Events may then arrive out of order; the receiver can reorder them by
+        their 'id'.
+        @compress: gzip the body of each POST, and send it with
+        'Content-Encoding: gzip'. The receiver must support this.
         """
         # Parameters.
         self.serverUrl = serverUrl
@@ -330,13 +344,22 @@ class HttpStatusPush(StatusPush):
         self.chunkSize = chunkSize
         self.lastPushWasSuccessful = True
         self.maxHttpRequestSize = maxHttpRequestSize
+        self.maxInFlight = maxInFlight
+        self.compress = compress
+        # Chunks being sent, oldest first, as [items, Deferred, result] where
+        # result is None until the POST completes, then True or False.
+        self.inFlight = []
+        # Chunks which failed, waiting for the older ones to complete.
+        self.failedChunks = []
+        self.metrics = {'started': time.time(), 'pushes': 0, 'failures': 0,
+                        'events': 0, 'bytes': 0}
         if maxDiskItems != 0:
             # The queue directory is determined by the server url.
             path = ('events_' +
                     urlparse.urlparse(self.serverUrl)[1].split(':')[0])
             queue = PersistentQueue(
                         primaryQueue=MemoryQueue(maxItems=maxMemoryItems),
-                        secondaryQueue=DiskQueue(path, maxItems=maxDiskItems))
+                        secondaryQueue=JournalQueue(path, maxItems=maxDiskItems))
         else:
             path = None
             queue = MemoryQueue(maxItems=maxMemoryItems)
@@ -348,68 +371,197 @@ class HttpStatusPush(StatusPush):
     def wasLastPushSuccessful(self):
         return self.lastPushWasSuccessful
 
+    def stopService(self):
+        d = StatusPush.stopService(self)
+        # Also wait for the POSTs still outstanding; once stopped, each one
+        # chains whatever it sends next, until the queue is drained.
+        pending = [entry[1] for entry in self.inFlight if entry[2] is None]
+        if pending:
+            d = defer.DeferredList([d] + pending)
+        return d
+
+    def getMetrics(self):
+        """Returns a dict of counters: pushes, failures, events and bytes sent
+        since startup, with the events sent per second, the number of POSTs in
+        flight and the number of events waiting to be sent."""
+        metrics = self.metrics.copy()
+        elapsed = time.time() - metrics['started']
+        metrics['events_per_second'] = 0
+        if elapsed > 0:
+            metrics['events_per_second'] = metrics['events'] / elapsed
+        metrics['in_flight'] = len(self.inFlight)
+        metrics['backlog'] = self.queue.nbItems()
+        return metrics
+
+    def encodePacket(self, packet):
+        """Returns (id, data), where data is the packet JSON-encoded and
+        url-quoted, ready to be joined into the 'packets' field of a POST.
+        Quoting works character by character, so the quoted packets can be
+        joined with quoted separators, and their sizes summed."""
+        if self.debug:
+            packet_json = json.dumps(packet, indent=2, sort_keys=True)
+        else:
+            packet_json = json.dumps(packet, separators=(',',':'))
+        return (packet['id'], urllib.quote_plus(packet_json))
+
+    def _encodedItem(self, item):
+        # items queued by older versions are still plain packets
+        if isinstance(item, dict):
+            return self.encodePacket(item)
+        return item
+
     def popChunk(self):
-        """Pops items from the pending list.
+        """Pops items from the pending list, and returns them with the POST
+        data built from them.
+
+        The items are encoded when they are queued, so this only adds up
+        their sizes to find how many fit in maxHttpRequestSize; the rest are
+        put back. A packet which is too large on its own is dropped.
 
-        They must be queued back on failure."""
+        The items must be queued back on failure."""
         if self.wasLastPushSuccessful():
             chunkSize = self.chunkSize
         else:
             chunkSize = 1
 
+        if self.debug:
+            opening, separator, closing = '[\n', ',\n', '\n]'
+        else:
+            opening, separator, closing = '[', ',', ']'
+        opening, separator, closing = [urllib.quote_plus(x)
+                                       for x in (opening, separator, closing)]
+
         while True:
-            items = self.queue.popChunk(chunkSize)
-            if self.debug:
-                packets = json.dumps(items, indent=2, sort_keys=True)
-            else:
-                packets = json.dumps(items, separators=(',',':'))
-            data = urllib.urlencode({'packets': packets})
-            if (not self.maxHttpRequestSize or
-                len(data) < self.maxHttpRequestSize):
-                return (data, items)
-
-            if chunkSize == 1:
-                # This packet is just too large. Drop this packet.
-                log.msg("ERROR: packet %s was dropped, too large: %d > %d" %
-                        (items[0]['id'], len(data), self.maxHttpRequestSize))
-                chunkSize = self.chunkSize
-            else:
-                # Try with half the packets.
-                chunkSize /= 2
-                self.queue.insertBackChunk(items)
+            items = [self._encodedItem(item)
+                     for item in self.queue.popChunk(chunkSize)]
+            size = len('packets=') + len(opening) + len(closing)
+            count = 0
+            for (packet_id, packet) in items:
+                extra = len(packet)
+                if count:
+                    extra += len(separator)
+                if (self.maxHttpRequestSize and
+                    size + extra >= self.maxHttpRequestSize):
+                    break
+                size += extra
+                count += 1
+            if count or not items:
+                break
+            # This packet is just too large. Drop this packet.
+            log.msg("ERROR: packet %s was dropped, too large: %d > %d" %
+                    (items[0][0], size + len(items[0][1]),
+                     self.maxHttpRequestSize))
+            if items[1:]:
+                self.queue.insertBackChunk(items[1:])
+
+        if items[count:]:
+            self.queue.insertBackChunk(items[count:])
+        items = items[:count]
+        data = ('packets=' + opening +
+                separator.join([packet for (packet_id, packet) in items]) +
+                closing)
+        return (data, items)
 
     def pushHttp(self):
-        """Do the HTTP POST to the server."""
+        """Do HTTP POSTs to the server, until maxInFlight are outstanding or
+        the queue is empty.
+
+        Returns a Deferred that fires when all the POSTs started have
+        completed."""
+        started = []
+        while (len(self.inFlight) < self.maxInFlight and
+               self.queue.nbItems() and not self.failedChunks):
+            started.append(self._startPush())
+            if not self.wasLastPushSuccessful():
+                # Only probe the server with one request until it's back up.
+                break
+        if not started:
+            return None
+        return defer.DeferredList(started)
+
+    def _startPush(self):
         (encoded_packets, items) = self.popChunk()
+        entry = [items, None, None]
+        self.inFlight.append(entry)
 
         def Success(result):
-            """Queue up next push."""
             log.msg('Sent %d events to %s' % (len(items), self.serverUrl))
-            self.lastPushWasSuccessful = True
-            return self.queueNextServerPush()
+            self.metrics['pushes'] += 1
+            self.metrics['events'] += len(items)
+            self.metrics['bytes'] += len(body)
+            entry[2] = True
+            return self._pushCompleted()
 
         def Failure(result):
-            """Insert back items not sent and queue up next push."""
             # Server is now down.
             log.msg('Failed to push %d events to %s: %s' %
                     (len(items), self.serverUrl, str(result)))
-            self.queue.insertBackChunk(items)
-            if self.stopped:
-                # Bad timing, was being called on shutdown and the server died
-                # on us. Make sure the queue is saved since we just queued back
-                # items.
-                self.queue.save()
-            self.lastPushWasSuccessful = False
-            return self.queueNextServerPush()
+            self.metrics['failures'] += 1
+            entry[2] = False
+            return self._pushCompleted()
 
         # Trigger the HTTP POST request.
         headers = {'Content-Type': 'application/x-www-form-urlencoded'}
+        body = encoded_packets
+        if self.compress:
+            body = GzipString(body)
+            headers['Content-Encoding'] = 'gzip'
         connection = client.getPage(self.serverUrl,
                                     method='POST',
-                                    postdata=encoded_packets,
+                                    postdata=body,
                                     headers=headers,
                                     agent='buildbot')
+        entry[1] = connection
         connection.addCallbacks(Success, Failure)
         return connection
 
+    def _pushCompleted(self):
+        """Acknowledge completed POSTs in the order they were sent.
+
+        Failed chunks are held until every older POST has completed, then
+        inserted back into the queue together, so the queue keeps its order.
+        With maxInFlight > 1, while the pushes succeed and there is a
+        backlog, the slots freed up are refilled straight away, so up to
+        maxInFlight POSTs stay outstanding. Otherwise the next push is queued
+        once every POST has completed, bufferDelay later.
+
+        Once stopped, returns a Deferred for the pushes this started, so that
+        shutdown waits for them."""
+        while self.inFlight and self.inFlight[0][2] is not None:
+            items, connection, result = self.inFlight.pop(0)
+            if not result:
+                self.failedChunks.append(items)
+        if self.failedChunks and not self.inFlight:
+            failed = []
+            for items in self.failedChunks:
+                failed.extend(items)
+            self.failedChunks = []
+            self.queue.insertBackChunk(failed)
+            if self.stopped:
+                # Bad timing, was being called on shutdown and the server died
+                # on us. Make sure the queue is saved since we just queued back
+                # items.
+                self.queue.save()
+            self.lastPushWasSuccessful = False
+        elif not self.failedChunks:
+            self.lastPushWasSuccessful = True
+        d = None
+        if (self.maxInFlight > 1 and not self.failedChunks and
+            self.lastPushWasSuccessful and self.queue.nbItems()):
+            # Keep the pipeline full.
+            d = self.pushHttp()
+        if not (self.inFlight or self.failedChunks):
+            d = self.queueNextServerPush()
+        if self.stopped:
+            return d
+
+
+def GzipString(data):
+    """Returns data compressed in the gzip format."""
+    s = StringIO()
+    f = gzip.GzipFile(fileobj=s, mode='wb')
+    f.write(data)
+    f.close()
+    return s.getvalue()
+
 # vim: set ts=4 sts=4 sw=4 et:
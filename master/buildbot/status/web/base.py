@@ -3,8 +3,9 @@ import urlparse, urllib, time, re
 import os, cgi, sys, locale
 import jinja2
 from zope.interface import Interface
-from twisted.web import resource, static
+from twisted.web import resource, static, server
 from twisted.python import log
+from twisted.internet import defer
 from buildbot.status import builder
 from buildbot.status.builder import SUCCESS, WARNINGS, FAILURE, SKIPPED, EXCEPTION, RETRY
 from buildbot import version, util
@@ -74,7 +75,7 @@ def build_get_class(b):
     # FIXME: this getResults duplicity might need to be fixed
     result = b.getResults()
     #print "THOMAS: result for b %r: %r" % (b, result)
-    if isinstance(b, builder.BuildStatus):
+    if isinstance(b, (builder.BuildStatus, builder.BuildSummary)):
         result = b.getResults()
     elif isinstance(b, builder.BuildStepStatus):
         result = b.getResults()[0]
@@ -238,7 +239,19 @@ class HtmlResource(resource.Resource, ContextMixin):
 
         ctx = self.getContext(request)
 
+        # content() may return a Deferred, if it has to wait for something
+        # (such as a build being loaded)
         data = self.content(request, ctx)
+        if isinstance(data, defer.Deferred):
+            def finish(data):
+                request.write(self._finishContent(request, data))
+                request.finish()
+            data.addCallback(finish)
+            data.addErrback(request.processingFailed)
+            return server.NOT_DONE_YET
+        return self._finishContent(request, data)
+
+    def _finishContent(self, request, data):
         if isinstance(data, unicode):
             data = data.encode("utf-8")
         request.setHeader("content-type", self.contentType)
@@ -234,9 +234,13 @@ class BuildsResource(HtmlResource):
         except ValueError:
             num = None
         if num is not None:
-            build_status = self.builder_status.getBuild(num)
-            if build_status:
-                return StatusResourceBuild(build_status)
+            # load the build without blocking the reactor
+            d = self.builder_status.loadBuild(num)
+            def missing(f):
+                f.trap(IndexError)
+                return HtmlResource.getChild(self, path, req)
+            d.addCallbacks(StatusResourceBuild, missing)
+            return DeferredResource(d)
 
         return HtmlResource.getChild(self, path, req)
 
@@ -25,9 +25,19 @@ class BuildStatusStatusResource(HtmlResource):
         except:
             return "unknown builder"
 
-        # Check if the build in parameter exists.
-        build = builder.getBuild(int(number))
-        if not build:
+        # Check if the build in parameter exists, loading it without
+        # blocking the reactor.
+        d = builder.loadBuild(number)
+        def missing(f):
+            f.trap(IndexError)
+            return None
+        d.addErrback(missing)
+        d.addCallback(lambda build :
+                      self.buildContent(request, ctx, number, build))
+        return d
+
+    def buildContent(self, request, ctx, number, build):
+        if build is None:
             return "unknown build %s" % number
 
         rows = ctx['rows'] = []
@@ -27,7 +27,7 @@ import os
 import re
 import time
 from twisted.web import resource
-from buildbot.status.builder import FAILURE
+from buildbot.status.builder import FAILURE, STDOUT, STDERR
 
 class XmlResource(resource.Resource):
     contentType = "text/xml; charset=UTF-8"
@@ -71,7 +71,6 @@ class FeedResource(XmlResource):
         return fallback
 
     def getBuilds(self, request):
-        builds = []
         # THIS is lifted straight from the WaterfallStatusResource Class in
         # status/web/waterfall.py
         #
@@ -101,45 +100,17 @@ class FeedResource(XmlResource):
 
         maxFeeds = 25
 
-        # Copy all failed builds in a new list.
-        # This could clearly be implemented much better if we had
-        # access to a global list of builds.
-        for b in builders:
-            lastbuild = b.getLastFinishedBuild()
-            if lastbuild is None:
-                continue
-
-            lastnr = lastbuild.getNumber()
-
-            totalbuilds = 0
-            i = lastnr
-            while i >= 0:
-                build = b.getBuild(i)
-                i -= 1
-                if not build:
-                    continue
-
-                results = build.getResults()
-
-                if failures_only == "false" or results == FAILURE:
-                    totalbuilds += 1
-                    builds.append(build)
-
-                # stop for this builder when our total nr. of feeds is reached
-                if totalbuilds >= maxFeeds:
-                    break
-
-        # Sort build list by date, youngest first.
-        # To keep compatibility with python < 2.4, use this for sorting instead:
-        # We apply Decorate-Sort-Undecorate
-        deco = [(build.getTimes(), build) for build in builds]
-        deco.sort()
-        deco.reverse()
-        builds = [build for (b1, build) in deco]
-
-        if builds:
-            builds = builds[:min(len(builds), maxFeeds)]
-        return builds
+        if not builders:
+            return []
+        results = None
+        if failures_only != "false":
+            results = [FAILURE]
+        # the status keeps all builds in the order they finished, youngest
+        # first
+        g = self.status.generateFinishedBuilds(
+                builders=[b.name for b in builders], results=results,
+                num_builds=maxFeeds)
+        return list(g)
 
     def content(self, request):
         builds = self.getBuilds(request)
@@ -194,13 +165,14 @@ class FeedResource(XmlResource):
                                          log.getName())
                         log_lines.append([])
                         try:
-                            logdata = log.getText()
+                            loglines = log.readlines([STDOUT, STDERR],
+                                                     tail=30)
                         except IOError:
                             # Probably the log file has been removed
-                            logdata ='** log file not available **'
+                            loglines = ['** log file not available **']
                         unilist = list()
-                        for line in logdata.split('\n')[-30:]:
-                            unilist.append(unicode(line,'utf-8'))
+                        for line in loglines:
+                            unilist.append(unicode(line.rstrip('\n'),'utf-8'))
                         log_lines.extend(unilist)
 
             bc = {}
@@ -3,6 +3,7 @@ from __future__ import generators
 from buildbot.status.web.base import HtmlResource
 from buildbot.status.web.base import build_get_class, path_to_builder, path_to_build
 from buildbot.sourcestamp import SourceStamp
+from buildbot.status.builder import sourceStampKey
 
 class ANYBRANCH: pass # a flag value, used below
 
@@ -81,42 +82,80 @@ class GridStatusMixin(object):
 
         This function returns an appropriate comparison key for that.
         """
-        return (ss.branch, ss.revision, ss.patch)
+        return sourceStampKey(ss)
+
+    # how many of each builder's most recent builds to look through
+    max_search = 200
+
+    def getRecentBuilds(self, builder):
+        """Generate (key, build) for the most recent builds of the given
+        builder, newest first, where key is the build's source stamp key.
+        Finished builds come from the builder's summary index, so this does
+        not load them from disk."""
+        for n in range(1, self.max_search+1):
+            build = builder.getBuild(-n)
+            if build is None:
+                if n > builder.nextBuildNumber:
+                    return
+                continue
+            yield (build.getSourceStampKey(), build)
 
     def getRecentSourcestamps(self, status, numBuilds, categories, branch):
         """
         get a list of the most recent NUMBUILDS SourceStamp tuples, sorted
         by the earliest start we've seen for them
         """
-        # TODO: use baseweb's getLastNBuilds?
-        sourcestamps = { } # { ss-tuple : earliest time }
+        sourcestamps = { } # { ss-key : (build, earliest time) }
         for bn in status.getBuilderNames():
             builder = status.getBuilder(bn)
             if categories and builder.category not in categories:
                 continue
-            build = builder.getBuild(-1)
-            while build:
-                ss = build.getSourceStamp(absolute=True)
-                start = build.getTimes()[0]
-                build = build.getPreviousBuild()
+            # stop once this builder has shown us NUMBUILDS source stamps
+            seen = set()
+            for key, build in self.getRecentBuilds(builder):
+                if key is None:
+                    continue
+
+                # skip non-matching branches
+                if branch != ANYBRANCH and key[0] != branch: continue
+
+                if key not in seen:
+                    if len(seen) == numBuilds:
+                        break
+                    seen.add(key)
 
                 # skip un-started builds
+                start = build.getTimes()[0]
                 if not start: continue
 
-                # skip non-matching branches
-                if branch != ANYBRANCH and ss.branch != branch: continue
-
-                key= self.getSourceStampKey(ss)
                 if key not in sourcestamps or sourcestamps[key][1] > start:
-                    sourcestamps[key] = (ss, start)
+                    sourcestamps[key] = (build, start)
 
-        # now sort those and take the NUMBUILDS most recent
+        # now sort those and take the NUMBUILDS most recent. Only these
+        # builds are loaded, for their full source stamps.
         sourcestamps = sourcestamps.values()
         sourcestamps.sort(lambda x, y: cmp(x[1], y[1]))
-        sourcestamps = map(lambda tup : tup[0], sourcestamps)
         sourcestamps = sourcestamps[-numBuilds:]
-
-        return sourcestamps
+        return [build.getSourceStamp(absolute=True)
+                for (build, start) in sourcestamps]
+
+    def getBuildsForStamps(self, builder, stamps):
+        """Return a list with this builder's most recent build of each of the
+        given source stamps, or None where it has not built that stamp."""
+        builds = [None] * len(stamps)
+        positions = {}
+        for i in range(len(stamps)):
+            key = self.getSourceStampKey(stamps[i])
+            positions.setdefault(key, []).append(i)
+        missing = len(stamps)
+        for key, build in self.getRecentBuilds(builder):
+            if not missing:
+                break
+            for i in positions.get(key, []):
+                if builds[i] is None:
+                    builds[i] = build
+                    missing -= 1
+        return builds
 
 class GridStatusResource(HtmlResource, GridStatusMixin):
     # TODO: docs
@@ -152,20 +191,11 @@ class GridStatusResource(HtmlResource, GridStatusMixin):
         cxt['builders'] = []
 
         for bn in sortedBuilderNames:
-            builds = [None] * len(stamps)
-
             builder = status.getBuilder(bn)
             if categories and builder.category not in categories:
                 continue
 
-            build = builder.getBuild(-1)
-            while build and None in builds:
-                ss = build.getSourceStamp(absolute=True)
-                key= self.getSourceStampKey(ss)
-                for i in range(len(stamps)):
-                    if key == self.getSourceStampKey(stamps[i]) and builds[i] is None:
-                        builds[i] = build
-                build = build.getPreviousBuild()
+            builds = self.getBuildsForStamps(builder, stamps)
 
             b = self.builder_cxt(request, builder)
             b['builds'] = []
@@ -221,20 +251,11 @@ class TransposedGridStatusResource(HtmlResource, GridStatusMixin):
             cxt['range'].reverse()
         
         for bn in sortedBuilderNames:
-            builds = [None] * len(stamps)
-
             builder = status.getBuilder(bn)
             if categories and builder.category not in categories:
                 continue
 
-            build = builder.getBuild(-1)
-            while build and None in builds:
-                ss = build.getSourceStamp(absolute=True)
-                key = self.getSourceStampKey(ss)
-                for i in range(len(stamps)):
-                    if key == self.getSourceStampKey(stamps[i]) and builds[i] is None:
-                        builds[i] = build
-                build = build.getPreviousBuild()
+            builds = self.getBuildsForStamps(builder, stamps)
 
             builders.append(self.builder_cxt(request, builder))
             builder_builds.append(map(lambda b: self.build_cxt(request, b), builds))
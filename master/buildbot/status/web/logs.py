@@ -98,7 +98,17 @@ class TextLog(Resource):
             data = data.encode('utf-8')                   
             req.write(data)
 
-        self.original.subscribeConsumer(ChunkConsumer(req, self))
+        # ?tail=N shows just the last N lines, which an indexed log can
+        # seek to directly
+        startChunk = 0
+        tail = req.args.get("tail", [None])[0]
+        if tail:
+            try:
+                startChunk = self.original.getChunkForLine(-int(tail))
+            except (ValueError, AttributeError):
+                pass
+
+        self.original.subscribeConsumer(ChunkConsumer(req, self), startChunk)
         return server.NOT_DONE_YET
 
     def _setContentType(self, req):
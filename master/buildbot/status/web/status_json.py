@@ -8,6 +8,7 @@ import os
 import re
 
 from twisted.web import error, html, resource
+from twisted.web.util import DeferredResource
 
 from buildbot.status.web.base import HtmlResource
 from buildbot.util import json
@@ -388,8 +389,9 @@ class AllBuildsJsonResource(JsonResource):
     def getChild(self, path, request):
         # Dynamic childs.
         if isinstance(path, int) or _IS_INT.match(path):
-            build_status = self.builder_status.getBuild(int(path))
-            if build_status:
+            # load the build without blocking the reactor
+            d = self.builder_status.loadBuild(int(path))
+            def loaded(build_status):
                 build_status_number = str(build_status.getNumber())
                 # Happens with negative numbers.
                 child = self.children.get(build_status_number)
@@ -401,6 +403,11 @@ class AllBuildsJsonResource(JsonResource):
                 # TODO(maruel): Cleanup the cache once it's too heavy!
                 self.putChild(build_status_number, child)
                 return child
+            def missing(f):
+                f.trap(IndexError)
+                return JsonResource.getChild(self, path, request)
+            d.addCallbacks(loaded, missing)
+            return DeferredResource(d)
         return JsonResource.getChild(self, path, request)
 
     def asDict(self, request):
@@ -553,6 +560,20 @@ class ChangeSourcesJsonResource(JsonResource):
         return result
 
 
+class DatabaseJsonResource(JsonResource):
+    help = """Database query statistics: the count and latency of each shape
+of query, the worst first, and the time spent waiting for a connection.
+Histogram counts are for durations up to each of the listed buckets, in
+seconds, then for anything longer.
+"""
+    title = 'Database'
+
+    def asDict(self, request):
+        if self.status.db is None:
+            return {}
+        return self.status.db.query_stats.asDict()
+
+
 class ProjectJsonResource(JsonResource):
     help = """Project-wide settings.
 """
@@ -648,6 +669,7 @@ For help on any sub directory, use url /child/help
         self.level = 1
         self.putChild('builders', BuildersJsonResource(status))
         self.putChild('change_sources', ChangeSourcesJsonResource(status))
+        self.putChild('database', DatabaseJsonResource(status))
         self.putChild('project', ProjectJsonResource(status))
         self.putChild('slaves', SlavesJsonResource(status))
         # This needs to be called before the first HelpResource().body call.
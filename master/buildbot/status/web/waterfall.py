@@ -142,7 +142,8 @@ class BuildBox(components.Adapter):
             # of whether it succeeded or failed.
             class_ = build_get_class(b)
         return Box([text], class_="BuildStep " + class_)
-components.registerAdapter(BuildBox, builder.BuildStatus, IBox)
+# for both BuildStatus and BuildSummary
+components.registerAdapter(BuildBox, interfaces.IBuildStatus, IBox)
 
 class StepBox(components.Adapter):
     implements(IBox)
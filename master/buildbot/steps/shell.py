@@ -237,11 +237,13 @@ class TreeSize(ShellCommand):
         ShellCommand.__init__(self, *args, **kwargs)
 
     def commandComplete(self, cmd):
-        out = cmd.logs['stdio'].getText()
-        m = re.search(r'^(\d+)', out)
-        if m:
-            self.kib = int(m.group(1))
-            self.setProperty("tree-size-KiB", self.kib, "treesize")
+        # only the first line is needed
+        for line in cmd.logs['stdio'].readlines([STDOUT, STDERR]):
+            m = re.search(r'^(\d+)', line)
+            if m:
+                self.kib = int(m.group(1))
+                self.setProperty("tree-size-KiB", self.kib, "treesize")
+            break
 
     def evaluateCommand(self, cmd):
         if cmd.rc != 0:
@@ -275,6 +277,8 @@ class SetProperty(ShellCommand):
         self.property_changes = {}
 
     def commandComplete(self, cmd):
+        # the property value (or the extract_fn arguments) is the whole of
+        # the output, so there is no avoiding reading it all into a string
         if self.property:
             result = cmd.logs['stdio'].getText()
             if self.strip: result = result.strip()
@@ -524,9 +528,8 @@ class WarningCountingShellCommand(ShellCommand):
         # warnings regular expressions. If did, bump the warnings count and
         # add the line to the collection of lines with warnings
         warnings = []
-        # TODO: use log.readlines(), except we need to decide about stdout vs
-        # stderr
-        for line in log.getText().split("\n"):
+        for line in log.readlines([STDOUT, STDERR]):
+            line = line.rstrip("\n")
             if directoryEnterRe:
                 match = directoryEnterRe.search(line)
                 if match:
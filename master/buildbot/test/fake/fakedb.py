@@ -57,6 +57,10 @@ class FakeDBConn:
         self.changes.append(change)
         change.number = i
 
+    def addChangesToDatabase(self, changes):
+        for change in changes:
+            self.addChangeToDatabase(change)
+
     def get_sourcestampid(self, ss, t):
         i = len(self.sourcestamps)
         self.sourcestamps.append(ss)
@@ -90,6 +94,10 @@ class FakeDBConn:
         else:
             self.classified_changes[schedulerid][1].append(self.changes[changeid])
 
+    def scheduler_classify_changes(self, schedulerid, classifications, t):
+        for (changeid, important) in classifications:
+            self.scheduler_classify_change(schedulerid, changeid, important, t)
+
     def scheduler_retire_changes(self, schedulerid, changeids, t):
         if schedulerid not in self.classified_changes:
             return
@@ -0,0 +1,96 @@
+import os
+
+from twisted.trial import unittest
+from twisted.internet import defer, reactor
+
+from buildbot.changes import maildir
+
+class RecordingMaildirService(maildir.MaildirService):
+    def __init__(self, basedir):
+        maildir.MaildirService.__init__(self, basedir)
+        self.batches = []
+        self.received = []
+        self.waiter = None
+    def messagesReceived(self, filenames):
+        self.batches.append(filenames)
+        maildir.MaildirService.messagesReceived(self, filenames)
+        if self.waiter:
+            d, self.waiter = self.waiter, None
+            d.callback(None)
+    def messageReceived(self, filename):
+        if filename == 'bad':
+            raise RuntimeError('bad message')
+        self.received.append(filename)
+
+class MaildirService(unittest.TestCase):
+
+    def setUp(self):
+        self.maildir = os.path.abspath(self.mktemp())
+        for sub in ('', 'new', 'cur', 'tmp'):
+            os.mkdir(os.path.join(self.maildir, sub))
+        self.svc = RecordingMaildirService(self.maildir)
+        self.svc.newdir = os.path.join(self.maildir, 'new')
+
+    def tearDown(self):
+        if self.svc.running:
+            return self.svc.stopService()
+
+    def deliver(self, filename):
+        path = os.path.join(self.maildir, 'new', filename)
+        open(path, 'w').write('message')
+        return path
+
+    def test_poll_order(self):
+        self.deliver('b')
+        self.deliver('a')
+        self.deliver('c')
+        self.svc.poll()
+        # they are delivered in one batch, oldest first, with ties broken
+        # by filename
+        self.assertEqual(len(self.svc.batches), 1)
+        self.assertEqual(sorted(self.svc.received), ['a', 'b', 'c'])
+        ctimes = [ (os.stat(os.path.join(self.maildir, 'new', f)).st_ctime, f)
+                   for f in self.svc.received ]
+        self.assertEqual(ctimes, sorted(ctimes))
+
+    def test_poll_seen(self):
+        self.deliver('a')
+        self.svc.poll()
+        self.svc.poll()
+        self.assertEqual(self.svc.received, ['a'])
+        self.deliver('b')
+        self.svc.poll()
+        self.assertEqual(self.svc.batches, [['a'], ['b']])
+
+    def test_poll_forgets_removed(self):
+        path = self.deliver('a')
+        self.svc.poll()
+        os.unlink(path)
+        self.svc.poll()
+        self.assertEqual(self.svc.files, set())
+        # a new message with the same name is reported again
+        self.deliver('a')
+        self.svc.poll()
+        self.assertEqual(self.svc.received, ['a', 'a'])
+
+    def test_bad_message(self):
+        self.deliver('bad')
+        self.deliver('good')
+        self.svc.poll()
+        self.assertEqual(self.svc.received, ['good'])
+        self.assertEqual(len(self.flushLoggedErrors(RuntimeError)), 1)
+
+    def test_inotify(self):
+        if not maildir.inotify:
+            raise unittest.SkipTest("inotify is not available")
+        self.svc.startService()
+        if not self.svc.inotify:
+            raise unittest.SkipTest("inotify is not supported here")
+        d = self.svc.waiter = defer.Deferred()
+        # deliver two messages; one poll picks up both
+        reactor.callLater(0, self.deliver, 'a')
+        reactor.callLater(0, self.deliver, 'b')
+        def check(_):
+            self.assertEqual(self.svc.batches, [['a', 'b']])
+        d.addCallback(check)
+        return d
@@ -1,7 +1,16 @@
+import os
+
 from twisted.trial import unittest
+from twisted.python import log, threadable
 
+from buildbot import util
+from buildbot.changes.changes import Change
 from buildbot.db import dbspec, connector
+from buildbot.db.schema import manager
+from buildbot.sourcestamp import SourceStamp
+from buildbot.process.properties import Properties
 from buildbot.test.util import threads
+from buildbot.util import eventual
 
 class DBConnector_Basic(threads.ThreadLeakMixin, unittest.TestCase):
     """
@@ -64,9 +73,261 @@ class DBConnector_Basic(threads.ThreadLeakMixin, unittest.TestCase):
         self.assertRaises(Exception, lambda : 
             self.dbc.runInteractionNow(inter))
 
+    def test_log_sync_calls(self):
+        # make sure this thread counts as the reactor thread
+        self.patch(threadable, 'ioThread', threadable.getThreadID())
+        msgs = []
+        def observer(ev):
+            msgs.append(" ".join(map(str, ev['message'])))
+        log.addObserver(observer)
+        try:
+            self.dbc.setLogSyncCalls(True)
+            self.dbc.runQueryNow("SELECT 1")
+            self.dbc.setLogSyncCalls(False)
+            self.dbc.runQueryNow("SELECT 2")
+        finally:
+            log.removeObserver(observer)
+        msgs = [m for m in msgs if "synchronous DB call" in m]
+        self.assertEqual(len(msgs), 1)
+        self.failUnless("SELECT 1" in msgs[0])
+        self.failUnless("test_log_sync_calls" in msgs[0]) # the stack
+
+    def test_query_stats(self):
+        self.dbc.runQueryNow("SELECT 1")
+        d = self.dbc.runQuery("SELECT 2")
+        def check(res):
+            stats = self.dbc.query_stats.asDict()
+            self.assertEqual([(q['query'], q['sync'], q['async'])
+                              for q in stats['queries']],
+                             [("SELECT ?", 1, 1)])
+            self.assertEqual(stats['pool_wait']['count'], 1)
+        d.addCallback(check)
+        return d
+
     def test_runQuery_simple(self):
         d = self.dbc.runQuery("SELECT 1")
         def cb(res):
             self.assertEqual(res, [(1,)])
         d.addCallback(cb)
         return d
+
+class DBConnector_FullDB(unittest.TestCase):
+    """
+    Base for tests against a fully-created DB, containing three changes
+    """
+
+    def setUp(self):
+        self.basedir = os.path.abspath(self.mktemp())
+        os.makedirs(self.basedir)
+        spec = dbspec.DBSpec.from_url("sqlite:///state.sqlite", self.basedir)
+        manager.DBSchemaManager(spec, self.basedir).upgrade(quiet=True)
+        self.dbc = connector.DBConnector(spec)
+        self.dbc.start()
+
+        self.changes = []
+        for i in range(3):
+            c = Change(who="me", files=["b%d" % i, "a%d" % i],
+                       comments="change %d" % i, branch="br",
+                       links=["http://x/%d" % i])
+            c.properties.setProperty("num", i, "test")
+            self.dbc.addChangeToDatabase(c)
+            self.changes.append(c)
+        # start with an empty cache
+        self.dbc._change_cache = util.LRUCache()
+
+    def tearDown(self):
+        self.dbc.stop()
+
+    def makeBuildRequests(self):
+        # two buildsets, making requests for builders "a", "b" and "a"
+        def txn(t):
+            ss = SourceStamp(branch="br", changes=self.changes[:2])
+            ssid = self.dbc.get_sourcestampid(ss, t)
+            props = Properties(prop="value")
+            bsid1 = self.dbc.create_buildset(ssid, "first", props,
+                                             ["a", "b"], t)
+            bsid2 = self.dbc.create_buildset(ssid, "second", Properties(),
+                                             ["a"], t)
+            t.execute("SELECT id FROM buildrequests ORDER BY id")
+            return [brid for (brid,) in t.fetchall()]
+        return self.dbc.runInteractionNow(txn)
+
+    def checkChange(self, c, i):
+        self.assertEqual(c.number, self.changes[i].number)
+        self.assertEqual(c.comments, "change %d" % i)
+        self.assertEqual(c.files, ["a%d" % i, "b%d" % i])
+        self.assertEqual(c.links, ["http://x/%d" % i])
+        self.assertEqual(c.properties.getProperty("num"), i)
+
+class DBConnector_Changes(DBConnector_FullDB):
+    """
+    Tests of the change-fetching methods
+    """
+
+    def test_getChangesByIdsNow(self):
+        ids = [c.number for c in self.changes]
+        changes = self.dbc.getChangesByIdsNow([ids[2], 999, ids[0]])
+        self.checkChange(changes[0], 2)
+        self.assertEqual(changes[1], None)
+        self.checkChange(changes[2], 0)
+        # the fetched changes are cached
+        self.assertEqual(sorted(self.dbc._change_cache.keys()),
+                         [ids[0], ids[2]])
+        self.failUnless(self.dbc.getChangeNumberedNow(ids[2]) is changes[0])
+
+    def test_getChangesByIdsNow_batches(self):
+        ids = [c.number for c in self.changes]
+        queries = []
+        realGetChangesBatch = self.dbc._txn_getChangesBatch
+        def _txn_getChangesBatch(t, changeids):
+            queries.append(changeids)
+            return realGetChangesBatch(t, changeids)
+        self.dbc._txn_getChangesBatch = _txn_getChangesBatch
+        changes = self.dbc.getChangesByIdsNow(ids * 2)
+        self.assertEqual(queries, [ids])
+        for i in range(3):
+            self.checkChange(changes[i], i)
+            self.failUnless(changes[i] is changes[i+3])
+
+    def test_getChangesByIds(self):
+        ids = [c.number for c in self.changes]
+        d = self.dbc.getChangesByIds([ids[1], ids[0]])
+        def check(changes):
+            self.checkChange(changes[0], 1)
+            self.checkChange(changes[1], 0)
+            self.assertEqual(sorted(self.dbc._change_cache.keys()),
+                             [ids[0], ids[1]])
+        d.addCallback(check)
+        return d
+
+    def test_getChangesGreaterThan(self):
+        ids = [c.number for c in self.changes]
+        changes = self.dbc.getChangesGreaterThan(ids[0])
+        self.assertEqual([c.number for c in changes], ids[1:])
+        self.checkChange(changes[1], 2)
+
+    def test_changeEventGenerator(self):
+        changes = list(self.dbc.changeEventGenerator(branches=["br"]))
+        self.assertEqual([c.comments for c in changes],
+                         ["change 2", "change 1", "change 0"])
+
+class DBConnector_Schedulers(DBConnector_FullDB):
+    """
+    Tests of the scheduler_changes methods
+    """
+
+    def queryCount(self, prefix):
+        return sum([q['count']
+                    for q in self.dbc.query_stats.asDict()['queries']
+                    if q['query'].startswith(prefix)])
+
+    def test_classify_and_retire(self):
+        numbers = [c.number for c in self.changes]
+        def classify(t):
+            self.dbc.scheduler_classify_changes(1,
+                    [(numbers[0], True), (numbers[1], False),
+                     (numbers[2], 1)], t)
+        self.dbc.runInteractionNow(classify)
+        # all of the rows were inserted by one executemany()
+        self.assertEqual(self.queryCount("INSERT INTO scheduler_changes"), 1)
+        def get(t):
+            important, unimportant = \
+                self.dbc.scheduler_get_classified_changes(1, t)
+            return ([c.number for c in important],
+                    [c.number for c in unimportant])
+        self.assertEqual(self.dbc.runInteractionNow(get),
+                         ([numbers[0], numbers[2]], [numbers[1]]))
+        def retire(t):
+            self.dbc.scheduler_retire_changes(1, set(numbers[:2]), t)
+        self.dbc.runInteractionNow(retire)
+        self.assertEqual(self.dbc.runInteractionNow(get), ([numbers[2]], []))
+
+    def test_get_sourcestampid_changes(self):
+        def txn(t):
+            ss = SourceStamp(branch="br", changes=self.changes)
+            return self.dbc.get_sourcestampid(ss, t)
+        ssid = self.dbc.runInteractionNow(txn)
+        self.assertEqual(
+                self.queryCount("INSERT INTO sourcestamp_changes"), 1)
+        ss = self.dbc.getSourceStampNumberedNow(ssid)
+        self.assertEqual(sorted([c.number for c in ss.changes]),
+                         sorted([c.number for c in self.changes]))
+
+class DBConnector_BuildRequests(DBConnector_FullDB):
+    """
+    Tests of the buildrequest-fetching methods
+    """
+
+    def setUp(self):
+        DBConnector_FullDB.setUp(self)
+        self.brids = self.makeBuildRequests()
+
+    def test_getBuildRequestsWithNumbers(self):
+        brs = self.dbc.getBuildRequestsWithNumbers(
+                [self.brids[2], 999, self.brids[0], self.brids[1]])
+        self.assertEqual([br and br.reason for br in brs],
+                         ["second", None, "first", "first"])
+        self.assertEqual(brs[2].builderName, "a")
+        self.assertEqual(brs[3].builderName, "b")
+        self.assertEqual(brs[2].properties.getProperty("prop"), "value")
+        self.assertEqual(brs[0].properties.getProperty("prop"), None)
+        # the sourcestamp is shared, and its changes are loaded
+        self.failUnless(brs[0].source is brs[2].source)
+        self.assertEqual([c.comments for c in brs[0].source.changes],
+                         ["change 0", "change 1"])
+
+    def test_getBuildRequestWithNumber(self):
+        br = self.dbc.getBuildRequestWithNumber(self.brids[1])
+        self.assertEqual((br.id, br.reason, br.builderName),
+                         (self.brids[1], "first", "b"))
+        self.assertEqual(self.dbc.getBuildRequestWithNumber(999), None)
+
+    def test_get_unclaimed_buildrequests(self):
+        def txn(t):
+            return self.dbc.get_unclaimed_buildrequests("a", 1, "master", 1,
+                                                        t)
+        brs = self.dbc.runInteractionNow(txn)
+        self.assertEqual([br.id for br in brs],
+                         [self.brids[0], self.brids[2]])
+
+    def test_get_unclaimed_buildrequests_for_builders(self):
+        def txn(t):
+            return self.dbc.get_unclaimed_buildrequests_for_builders(
+                    ["a", "b", "c"], 1, "master", 1, t)
+        brs = self.dbc.runInteractionNow(txn)
+        self.assertEqual(sorted(brs.keys()), ["a", "b"])
+        self.assertEqual([br.id for br in brs["a"]],
+                         [self.brids[0], self.brids[2]])
+        self.assertEqual([br.builderName for br in brs["b"]], ["b"])
+
+    def _collectBuildRequestNotifications(self):
+        added = {}
+        def observer(category, buildername, *brids):
+            added.setdefault(buildername, []).extend(brids)
+        self.dbc.subscribe_to("add-buildrequest", observer)
+        return added
+
+    def test_create_buildset_notifications(self):
+        # the notifications from setUp are still in the eventual queue
+        added = self._collectBuildRequestNotifications()
+        d = eventual.flushEventualQueue()
+        def check(_):
+            self.assertEqual(added, {"a": [self.brids[0], self.brids[2]],
+                                     "b": [self.brids[1]]})
+        d.addCallback(check)
+        return d
+
+    def test_resubmit_notifications(self):
+        d = eventual.flushEventualQueue()
+        def resubmit(_):
+            self.added = self._collectBuildRequestNotifications()
+            return self.dbc.resubmit_buildrequests(self.brids[:])
+        d.addCallback(resubmit)
+        d.addCallback(lambda _ : eventual.flushEventualQueue())
+        def check(_):
+            for brids in self.added.values():
+                brids.sort()
+            self.assertEqual(self.added, {"a": [self.brids[0], self.brids[2]],
+                                          "b": [self.brids[1]]})
+        d.addCallback(check)
+        return d
@@ -0,0 +1,77 @@
+from twisted.trial import unittest
+from twisted.python import log
+
+from buildbot.db import stats
+
+class Normalize(unittest.TestCase):
+
+    def test_whitespace(self):
+        self.assertEqual(stats.normalize("SELECT  a,\n b FROM  t "),
+                         "SELECT a, b FROM t")
+
+    def test_literals(self):
+        self.assertEqual(
+            stats.normalize("SELECT * FROM t1 WHERE x=12 AND y='it''s'"),
+            "SELECT * FROM t1 WHERE x=? AND y=?")
+
+    def test_in_list(self):
+        self.assertEqual(stats.normalize("DELETE FROM t WHERE id IN (?,?, ?)"),
+                         "DELETE FROM t WHERE id IN (...)")
+        self.assertEqual(stats.normalize("DELETE FROM t WHERE id IN (%s)"),
+                         "DELETE FROM t WHERE id IN (...)")
+
+class Histogram(unittest.TestCase):
+
+    def test_add(self):
+        h = stats.Histogram()
+        for elapsed in (0.0005, 0.001, 0.05, 20):
+            h.add(elapsed)
+        d = h.asDict()
+        self.assertEqual(d['histogram'], [2, 0, 1, 0, 0, 1])
+        self.assertEqual(d['count'], 4)
+        self.assertEqual(d['max'], 20)
+        self.assertAlmostEqual(d['mean'], 20.0515 / 4)
+
+class QueryStats(unittest.TestCase):
+
+    def test_shapes(self):
+        qs = stats.QueryStats()
+        qs.addQuery("SELECT * FROM t WHERE id IN (?,?)", 0.5, 'sync')
+        qs.addQuery("SELECT * FROM t WHERE id IN (?)", 0.25, 'async')
+        qs.addQuery("SELECT 1", 1.0, 'async')
+        d = qs.asDict()
+        self.assertEqual((d['sync'], d['async']), (1, 2))
+        self.assertEqual([(q['query'], q['count'], q['sync'], q['async'])
+                          for q in d['queries']],
+                         [("SELECT ?", 1, 0, 1),
+                          ("SELECT * FROM t WHERE id IN (...)", 2, 1, 1)])
+        self.assertEqual(d['queries'][1]['total'], 0.75)
+        self.failUnless("SELECT ?" in qs.report())
+
+    def test_max_shapes(self):
+        qs = stats.QueryStats()
+        qs.MAX_SHAPES = 2
+        for table in "abc":
+            qs.addQuery("SELECT * FROM %s" % table, 0.1, 'sync')
+        self.assertEqual(sorted(qs.queries.keys()),
+                         ["(other)", "SELECT * FROM a", "SELECT * FROM b"])
+
+    def test_slow_query_log(self):
+        msgs = []
+        def observer(ev):
+            msgs.append(" ".join(map(str, ev['message'])))
+        log.addObserver(observer)
+        try:
+            qs = stats.QueryStats(slow_query_time=1.0)
+            qs.addQuery("SELECT 1", 0.5, 'sync')
+            qs.addQuery("SELECT 2", 1.5, 'async')
+        finally:
+            log.removeObserver(observer)
+        msgs = [m for m in msgs if "slow DB query" in m]
+        self.assertEqual(msgs, ["slow DB query (1.500s, async): SELECT ?"])
+
+    def test_pool_wait(self):
+        qs = stats.QueryStats()
+        qs.addPoolWait(0.002)
+        self.assertEqual(qs.asDict()['pool_wait']['histogram'],
+                         [0, 1, 0, 0, 0, 0])
@@ -1,74 +1,180 @@
 from twisted.trial import unittest
-from exceptions import Exception
+from twisted.internet import defer
+from mock import Mock
 from buildbot.changes import gitpoller
 
-class GitOutputHelper:
-    """just used to keep shared vars out of the global namespace"""
-    desiredOutput = None
+def git_log(*commits):
+    """Make the output of 'git log' with gitpoller.LOG_FORMAT and
+    --name-only for the given (rev, timestamp, name, comments, files)"""
+    output = ''
+    for rev, timestamp, name, comments, files in commits:
+        output += '\x01%s\x02%s\x02%s\x02%s\x02\n' % (rev, timestamp, name,
+                                                     comments)
+        if files:
+            output += '\n' + ''.join([ f + '\n' for f in files ])
+    return output
 
-# single instance
-helper = GitOutputHelper()
+class GitOutputParsing(unittest.TestCase):
+    """Test GitPoller._parse_log"""
 
-# the following methods are used in place of 
-# GitPoller._get_git_output(self, args)
-def produce_desired_git_output(args):
-    return helper.desiredOutput
-    
-def produce_empty_git_output(args):
-    return ''
+    def setUp(self):
+        self.gp = gitpoller.GitPoller('git@example.com:foo/baz.git')
 
-def produce_exception_git_output(args):
-   raise Exception('fake')
+    def test_parse_log(self):
+        output = git_log(
+            ('12345abcde', '1273258009', 'Sammy Jankis',
+             'this is a commit message\n\nthat is multiline\n',
+             ['file1', 'file 2']),
+            ('abcde12345', '1273258010', 'Leonard', 'empty\n', []))
+        changes = self.gp._parse_log(output, 'master')
+        self.assertEqual([ c.revision for c in changes ],
+                         ['12345abcde', 'abcde12345'])
+        c = changes[0]
+        self.assertEqual(c.who, 'Sammy Jankis')
+        self.assertEqual(c.comments,
+                         'this is a commit message\n\nthat is multiline\n')
+        self.assertEqual(sorted(c.files), ['file 2', 'file1'])
+        self.assertEqual(c.when, 1273258009.0)
+        self.assertEqual(c.branch, 'master')
+        self.assertEqual(c.repository, 'git@example.com:foo/baz.git')
+        self.assertEqual(changes[1].files, [])
+
+    def test_parse_log_empty(self):
+        self.assertEqual(self.gp._parse_log('', 'master'), [])
+
+    def test_parse_log_no_timestamps(self):
+        self.gp.usetimestamps = False
+        output = git_log(('12345abcde', '1273258009', 'Sammy', 'msg', []))
+        changes = self.gp._parse_log(output, 'master')
+        self.failIf(changes[0].when == 1273258009.0)
+
+    def test_parse_log_no_name(self):
+        output = git_log(('12345abcde', '1273258009', '', 'msg', []))
+        self.assertRaises(EnvironmentError,
+                          self.gp._parse_log, output, 'master')
+
+    def test_parse_log_no_comments(self):
+        output = git_log(('12345abcde', '1273258009', 'Sammy', '\n', []))
+        self.assertRaises(EnvironmentError,
+                          self.gp._parse_log, output, 'master')
+
+    def test_parse_log_garbled(self):
+        self.assertRaises(EnvironmentError,
+                          self.gp._parse_log, '\x01garbage\n', 'master')
+
+class Polling(unittest.TestCase):
 
-class GitOutputParsing(unittest.TestCase):
-    """Test GitPoller methods that rely on GitPoller._get_git_output()"""
-    gp = None
-    
     def setUp(self):
-        self.gp = gitpoller.GitPoller('git@example.com:foo/baz.git')
-        
-    def _perform_git_output_test(self, methodToTest,
-                                 desiredGoodOutput, desiredGoodResult,
-                                 emptyRaisesException=True):
-        """
-        This method will monkey-patch the GitPoller instance's _get_git_output() 
-        method to produce different scenarios for testing methods which
-        """
-        dummyRevStr = '12345abcde'
-
-        # we should get an Exception with empty output from git
-        self.gp._get_git_output = produce_empty_git_output
-        
-        if emptyRaisesException:
-            self.assertRaises(Exception, methodToTest, dummyRevStr)
-        else:
-            try:
-                methodToTest(dummyRevStr)
-            except Exception, e:
-                self.fail('unexpected exception \'%s\' from empty output' % e)
-        
-        # and the method shouldn't supress any exceptions
-        self.gp._get_git_output = produce_exception_git_output
-        self.assertRaises(Exception, methodToTest, dummyRevStr)
-        
-        # finally we should get what's expected from good output
-        helper.desiredOutput = desiredGoodOutput
-        self.gp._get_git_output = produce_desired_git_output
-        self.assertEquals(methodToTest(dummyRevStr), desiredGoodResult)
-        
-    def test_get_commit_name(self):
-        nameStr = 'Sammy Jankis'
-        self._perform_git_output_test(self.gp._get_commit_name, nameStr, nameStr)
-        
-    def test_get_commit_comments(self):
-        commentStr = 'this is a commit message\n\nthat is multiline'
-        self._perform_git_output_test(self.gp._get_commit_comments, commentStr, commentStr)
-        
-    def test_get_commit_files(self):
-        filesStr = 'file1\nfile2'
-        self._perform_git_output_test(self.gp._get_commit_files, filesStr, 
-                                      filesStr.split(), emptyRaisesException=False)    
-        
-    def test_get_commit_timestamp(self):
-        stampStr = '1273258009'
-        self._perform_git_output_test(self.gp._get_commit_timestamp, stampStr, float(stampStr))
+        self.calls = []
+        self.refs = ''
+        self.logs = {}
+
+    def makePoller(self, **kwargs):
+        gp = gitpoller.GitPoller('git@example.com:foo/baz.git', **kwargs)
+        gp.parent = Mock()
+        gp._dovccmd = self.dovccmd
+        return gp
+
+    def dovccmd(self, args, env=None):
+        self.calls.append(args)
+        if args[0] == 'for-each-ref':
+            return defer.succeed(self.refs)
+        if args[0] == 'fetch':
+            return defer.succeed('')
+        if args[0] == 'log':
+            return defer.succeed(self.logs[args[-1]])
+        if args[0] == 'update-ref':
+            return defer.succeed('')
+        return defer.fail(EnvironmentError('unexpected git call'))
+
+    def updates(self):
+        return [ c for c in self.calls if c[0] == 'update-ref' ]
+
+    def test_poll(self):
+        gp = self.makePoller(branches=['master', 'release'])
+        self.refs = ('refs/buildbot/master 1111\n'
+                     'refs/buildbot/release 2222\n')
+        self.logs['1111..refs/buildbot-fetch/master'] = git_log(
+            ('aaaa', '100', 'Sammy', 'one\n', ['f1']),
+            ('bbbb', '101', 'Sammy', 'two\n', ['f2']))
+        self.logs['2222..refs/buildbot-fetch/release'] = git_log(
+            ('cccc', '102', 'Leonard', 'three\n', ['f3']))
+        d = gp.poll()
+        def check(_):
+            # a single fetch, for both branches
+            fetches = [ c for c in self.calls if c[0] == 'fetch' ]
+            self.assertEqual(fetches, [['fetch', 'git@example.com:foo/baz.git',
+                                '+master:refs/buildbot-fetch/master',
+                                '+release:refs/buildbot-fetch/release']])
+            # and a single log for each branch
+            self.assertEqual(len([ c for c in self.calls if c[0] == 'log' ]),
+                             2)
+            # the changes are submitted together
+            self.assertEqual(len(gp.parent.addChanges.call_args_list), 1)
+            changes = gp.parent.addChanges.call_args[0][0]
+            self.assertEqual([ (c.revision, c.branch) for c in changes ],
+                             [('aaaa', 'master'), ('bbbb', 'master'),
+                              ('cccc', 'release')])
+            # then, and only then, the tracking refs catch up
+            self.assertEqual(self.updates(), [
+                ['update-ref', 'refs/buildbot/master',
+                 'refs/buildbot-fetch/master'],
+                ['update-ref', 'refs/buildbot/release',
+                 'refs/buildbot-fetch/release']])
+            self.failIf(gp.working)
+        d.addCallback(check)
+        return d
+
+    def test_poll_first_time(self):
+        gp = self.makePoller(branches=['master', 'release'])
+        self.logs['HEAD..refs/buildbot-fetch/master'] = git_log(
+            ('aaaa', '100', 'Sammy', 'one\n', ['f1']))
+        d = gp.poll()
+        def check(_):
+            # the main branch is compared with the working copy, and the
+            # other is only watched from now on
+            logs = [ c[-1] for c in self.calls if c[0] == 'log' ]
+            self.assertEqual(logs, ['HEAD..refs/buildbot-fetch/master'])
+            changes = gp.parent.addChanges.call_args[0][0]
+            self.assertEqual([ c.revision for c in changes ], ['aaaa'])
+            # both are tracked from now on
+            self.assertEqual(len(self.updates()), 2)
+        d.addCallback(check)
+        return d
+
+    def test_poll_nothing_new(self):
+        gp = self.makePoller()
+        self.refs = 'refs/buildbot/master 1111\n'
+        self.logs['1111..refs/buildbot-fetch/master'] = ''
+        d = gp.poll()
+        def check(_):
+            self.failIf(gp.parent.addChanges.called)
+        d.addCallback(check)
+        return d
+
+    def test_poll_failure(self):
+        gp = self.makePoller()
+        self.refs = 'refs/buildbot/master 1111\n'
+        self.logs['1111..refs/buildbot-fetch/master'] = '\x01garbage'
+        d = gp.poll()
+        def check(_):
+            self.failIf(gp.parent.addChanges.called)
+            # the commits are read again next time
+            self.assertEqual(self.updates(), [])
+            # and the next poll can go ahead
+            self.failIf(gp.working)
+        d.addCallback(check)
+        return d
+
+    def test_poll_submit_failure(self):
+        gp = self.makePoller()
+        self.refs = 'refs/buildbot/master 1111\n'
+        self.logs['1111..refs/buildbot-fetch/master'] = git_log(
+            ('aaaa', '100', 'Sammy', 'one\n', ['f1']))
+        gp.parent.addChanges.side_effect = RuntimeError('db is down')
+        d = gp.poll()
+        def check(_):
+            self.assertEqual(self.updates(), [])
+            self.failIf(gp.working)
+        d.addCallback(check)
+        return d
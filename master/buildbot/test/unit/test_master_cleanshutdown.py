@@ -122,7 +122,8 @@ class TestCleanShutdown(unittest.TestCase):
         self.master.builders = Mock()
         self.master.builders.values.return_value = [builder]
 
-        self.assertEquals(self.master._get_processors(), [builder.run])
+        self.assertEquals(self.master._get_processors(),
+                          [self.master._dispatch])
 
         d_shutdown = self.master.cleanShutdown()
 
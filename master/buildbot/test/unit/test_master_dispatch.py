@@ -0,0 +1,110 @@
+from buildbot.master import BotMaster
+from buildbot.test.unit.test_db_connector import DBConnector_FullDB
+
+class FakeSlave:
+    def __init__(self, max_builds=None):
+        self.max_builds = max_builds
+        self.slavebuilders = {}
+
+class FakeSlaveBuilder:
+    def __init__(self, slave, name):
+        self.slave = slave
+        slave.slavebuilders[name] = self
+    def isBusy(self):
+        return False
+
+class FakeBuilder:
+    running = True
+    request_generation = 0
+
+    def __init__(self, name, slaves):
+        self.name = name
+        self.slaves = slaves
+        self.claimed = None
+    def getAvailableSlaves(self):
+        return self.slaves[:]
+    def getOldestRequestTime(self):
+        return None
+    def assignBuildRequests(self, available_slaves, requests):
+        # one request per slave, no merging
+        assignments = {}
+        brids = []
+        while available_slaves and requests:
+            sb = available_slaves.pop(0)
+            br = requests.pop(0)
+            assignments[sb] = [br]
+            brids.append(br.id)
+        return (assignments, brids, None)
+    def buildRequestsClaimed(self, res, generation):
+        assignments, oldest = res
+        self.claimed = sorted([brs[0].id
+                               for brs in assignments.values()])
+
+class Dispatch(DBConnector_FullDB):
+
+    def setUp(self):
+        DBConnector_FullDB.setUp(self)
+        self.brids = self.makeBuildRequests()
+        self.botmaster = BotMaster()
+        self.botmaster.db = self.dbc
+        self.botmaster.setMasterName("master", "incarnation")
+
+    def claimedBy(self):
+        def txn(t):
+            t.execute("SELECT id FROM buildrequests"
+                      " WHERE claimed_by_name IS NOT NULL ORDER BY id")
+            return [brid for (brid,) in t.fetchall()]
+        return self.dbc.runInteractionNow(txn)
+
+    def test_dispatch(self):
+        slave = FakeSlave()
+        a = FakeBuilder("a", [FakeSlaveBuilder(slave, "a")])
+        b = FakeBuilder("b", [FakeSlaveBuilder(slave, "b")])
+        self.botmaster.builders = {"a": a, "b": b}
+        d = self.botmaster._dispatch()
+        def check(_):
+            self.assertEqual(a.claimed, [self.brids[0]])
+            self.assertEqual(b.claimed, [self.brids[1]])
+            self.assertEqual(self.claimedBy(),
+                             [self.brids[0], self.brids[1]])
+        d.addCallback(check)
+        return d
+
+    def test_dispatch_max_builds(self):
+        # both builders share a slave that may only run one build
+        slave = FakeSlave(max_builds=1)
+        a = FakeBuilder("a", [FakeSlaveBuilder(slave, "a")])
+        b = FakeBuilder("b", [FakeSlaveBuilder(slave, "b")])
+        self.botmaster.builders = {"a": a, "b": b}
+        self.botmaster.prioritizeBuilders = lambda master, builders: [b, a]
+        d = self.botmaster._dispatch()
+        def check(_):
+            self.assertEqual(a.claimed, [])
+            self.assertEqual(b.claimed, [self.brids[1]])
+            self.assertEqual(self.claimedBy(), [self.brids[1]])
+        d.addCallback(check)
+        return d
+
+    def test_dispatch_builder_fails(self):
+        slave = FakeSlave()
+        a = FakeBuilder("a", [FakeSlaveBuilder(slave, "a")])
+        b = FakeBuilder("b", [FakeSlaveBuilder(slave, "b")])
+        def assignBuildRequests(available_slaves, requests):
+            raise RuntimeError("bad mergeRequests")
+        a.assignBuildRequests = assignBuildRequests
+        self.botmaster.builders = {"a": a, "b": b}
+        d = self.botmaster._dispatch()
+        def check(_):
+            # only the failing builder claims nothing
+            self.assertEqual(a.claimed, None)
+            self.assertEqual(b.claimed, [self.brids[1]])
+            self.assertEqual(self.claimedBy(), [self.brids[1]])
+            self.assertEqual(len(self.flushLoggedErrors(RuntimeError)), 1)
+        d.addCallback(check)
+        return d
+
+    def test_dispatch_no_slaves(self):
+        a = FakeBuilder("a", [])
+        self.botmaster.builders = {"a": a}
+        self.assertEqual(self.botmaster._dispatch(), None)
+        self.assertEqual(self.claimedBy(), [])
@@ -5,7 +5,8 @@ import shutil
 from twisted.trial import unittest
 
 from buildbot.status.persistent_queue import DequeMemoryQueue, DiskQueue, \
-    IQueue, ListMemoryQueue, MemoryQueue, PersistentQueue, WriteFile
+    IQueue, JournalQueue, ListMemoryQueue, MemoryQueue, PersistentQueue, \
+    WriteFile
 
 class test_Queues(unittest.TestCase):
     def setUp(self):
@@ -131,8 +132,61 @@ class test_Queues(unittest.TestCase):
     def testDiskQueue(self):
         self._test_helper(DiskQueue('fake_dir', maxItems=8))
 
+    def testJournalQueue(self):
+        self._test_helper(JournalQueue('fake_dir', maxItems=8))
+
+    def testJournalQueueSmallSegments(self):
+        # every record gets a segment of its own
+        self._test_helper(JournalQueue('fake_dir', maxItems=8, segmentSize=1,
+                                       fsync='always'))
+
     def testPersistentQueue(self):
         self._test_helper(PersistentQueue(MemoryQueue(3),
                                           DiskQueue('fake_dir', 5)))
 
+    def testPersistentJournalQueue(self):
+        self._test_helper(PersistentQueue(MemoryQueue(3),
+                                          JournalQueue('fake_dir', 5)))
+
+    def testJournalQueueLegacy(self):
+        # items left by a DiskQueue are moved into the journal
+        os.mkdir('fake_dir')
+        WriteFile(os.path.join('fake_dir', '3'), 'foo3')
+        WriteFile(os.path.join('fake_dir', '5'), 'foo5')
+        queue = PersistentQueue(MemoryQueue(1),
+            JournalQueue('fake_dir', 5, pickleFn=str, unpickleFn=str))
+        self.assertEqual(['foo3', 'foo5'], queue.items())
+        self.failIf('3' in os.listdir('fake_dir'))
+        self.assertEqual(['foo3', 'foo5'], queue.popChunk(2))
+
+    def testJournalQueueReload(self):
+        q = JournalQueue('fake_dir', 100, segmentSize=20)
+        for i in range(10):
+            q.pushItem(i)
+        self.assertEqual([0, 1, 2], q.popChunk(3))
+        q.insertBackChunk([1, 2])
+        q.save()
+        # a new queue picks up where the old one stopped
+        q = JournalQueue('fake_dir', 100, segmentSize=20)
+        self.assertEqual(9, q.nbItems())
+        self.assertEqual(range(1, 10), q.items())
+        q.pushItem(10)
+        self.assertEqual(range(1, 11), q.popChunk())
+        self.assertEqual([], os.listdir('fake_dir'))
+
+    def testJournalQueueTruncated(self):
+        q = JournalQueue('fake_dir', 100, pickleFn=str, unpickleFn=str)
+        q.pushItem('foo')
+        q.pushItem('bar')
+        q.save()
+        # simulate a crash in the middle of writing the second record
+        path = os.path.join('fake_dir', 'segment.0')
+        f = open(path, 'r+b')
+        f.truncate(os.path.getsize(path) - 1)
+        f.close()
+        q = JournalQueue('fake_dir', 100, pickleFn=str, unpickleFn=str)
+        self.assertEqual(['foo'], q.items())
+        q.pushItem('baz')
+        self.assertEqual(['foo', 'baz'], q.popChunk())
+
 # vim: set ts=4 sts=4 sw=4 et:
@@ -1,8 +1,12 @@
 import re
+import zlib
+from cStringIO import StringIO
 
 from twisted.trial import unittest
+from mock import Mock
 
-from buildbot.process.buildstep import LoggingBuildStep, regex_log_evaluator
+from buildbot.process.buildstep import LoggingBuildStep, regex_log_evaluator, \
+     RemoteShellCommand, LoggedRemoteCommand
 from buildbot.status.builder import FAILURE, SUCCESS, WARNINGS, EXCEPTION
 
 class FakeLogFile:
@@ -12,6 +16,9 @@ class FakeLogFile:
     def getText(self):
         return self.text
 
+    def readlines(self, channel=None):
+        return StringIO(self.text).readlines()
+
 class FakeCmd:
     def __init__(self, stdout, stderr, rc=0):
         self.logs = {'stdout': FakeLogFile(stdout),
@@ -51,6 +58,20 @@ class TestRegexLogEvaluator(unittest.TestCase):
         new_status = regex_log_evaluator(cmd, step_status, r)
         self.assertEqual(new_status, WARNINGS, "regex_log_evaluator returned %d, should've returned %d" % (new_status, WARNINGS))
 
+    def test_multiline(self):
+        cmd = FakeCmd("compiling\nerror: oops\n", "")
+        step_status = FakeStepStatus()
+        # these can only match across lines, so see the whole log
+        for r in [("compiling\nerror", FAILURE),
+                  (r"compiling\nerror", FAILURE),
+                  (re.compile("compiling.error", re.DOTALL), FAILURE)]:
+            self.assertEqual(regex_log_evaluator(cmd, step_status, [r]),
+                             FAILURE)
+        # but '.' in a string does not match a newline
+        self.assertEqual(regex_log_evaluator(cmd, step_status,
+                                             [("compiling.error", FAILURE)]),
+                         SUCCESS)
+
 
 class TestLoggingBuildStep(unittest.TestCase):
     def test_evaluateCommand_success(self):
@@ -72,3 +93,42 @@ class TestLoggingBuildStep(unittest.TestCase):
         lbs = LoggingBuildStep(log_eval_func=eval)
         status = lbs.evaluateCommand(cmd)
         self.assertEqual(status, WARNINGS, "evaluateCommand didn't call log_eval_func or overrode its results")
+
+class TestRemoteCommand(unittest.TestCase):
+
+    def makeCommand(self):
+        cmd = RemoteShellCommand('build', ['make'], compress=True)
+        cmd.buildslave = Mock()
+        cmd.active = True
+        cmd.updates = {}
+        cmd.stdout = []
+        cmd.addStdout = cmd.stdout.append
+        cmd.logged = []
+        cmd.addToLog = lambda name, data : cmd.logged.append((name, data))
+        return cmd
+
+    def test_remote_update_compressed(self):
+        cmd = self.makeCommand()
+        data = "compile output\n" * 100
+        cmd.remote_update([
+            [{'stdout': zlib.compress(data), 'compressed': 'zlib'}, 0],
+            [{'log': ('build.log', zlib.compress(data)),
+              'compressed': 'zlib'}, 0],
+            [{'stdout': 'plain'}, 0]])
+        self.assertEqual(cmd.stdout, [data, 'plain'])
+        self.assertEqual(cmd.logged, [('build.log', data)])
+
+    def test_compress_old_slave(self):
+        for version, compress in [('2.11', False), ('2.12', True),
+                                  (None, False)]:
+            cmd = self.makeCommand()
+            step = Mock()
+            step.slaveVersion.return_value = version
+            step.slaveVersionIsOlderThan = lambda command, minversion : \
+                    version is None or version < minversion
+            cmd.step = step
+            # stop short of actually running it
+            cmd.run = lambda *args : None
+            self.patch(LoggedRemoteCommand, 'start', lambda self : None)
+            cmd.start()
+            self.assertEqual(cmd.args['compress'], compress)
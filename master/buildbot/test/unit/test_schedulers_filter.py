@@ -109,3 +109,43 @@ class ChangeFilter(unittest.TestCase):
                 "all match and fn returns True -> False")
         self.check()
 
+
+class ChangeFilterIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.calls = []
+        def counting(name, **kwargs):
+            f = filter.ChangeFilter(**kwargs)
+            orig = f.filter_change
+            def filter_change(change):
+                self.calls.append(name)
+                return orig(change)
+            f.filter_change = filter_change
+            return (f, name)
+        shared = counting("shared", category="c")
+        self.index = filter.ChangeFilterIndex([
+            counting("branch", branch="b"),
+            counting("branches", branch=["b", "b2"], project="p"),
+            counting("project", project="p"),
+            counting("regex", branch_re="b.*"),
+            counting("default"),
+            shared,
+            (shared[0], "shared2"),
+            counting("trunk", branch=None),
+        ])
+
+    def test_match_indexed(self):
+        self.assertEqual(self.index.match(Change(branch="b", project="p")),
+                         ["branch", "branches", "project", "regex", "default"])
+        # the indexed filters for other values were not consulted
+        self.assertEqual(sorted(self.calls),
+                         ["branch", "branches", "default", "project", "regex"])
+
+    def test_match_none(self):
+        self.assertEqual(self.index.match(Change(branch=None)),
+                         ["default", "trunk"])
+
+    def test_match_shared_filter(self):
+        self.assertEqual(self.index.match(Change(branch="x", category="c")),
+                         ["default", "shared", "shared2"])
+        self.assertEqual(self.calls.count("shared"), 1)
@@ -0,0 +1,91 @@
+from buildbot.schedulers import basic, manager
+from buildbot.test.unit.test_db_connector import DBConnector_FullDB
+
+class FakeChangeManager:
+    def __init__(self, db):
+        self.db = db
+    def getLatestChangeNumberNow(self, branch=None, t=None):
+        return self.db.getLatestChangeNumberNow(branch=branch, t=t)
+    def getChangesGreaterThan(self, last_changeid, t=None):
+        self.fetches += 1
+        return self.db.getChangesGreaterThan(last_changeid, t)
+    fetches = 0
+
+class Classify(DBConnector_FullDB):
+
+    def setUp(self):
+        DBConnector_FullDB.setUp(self)
+        self.cm = FakeChangeManager(self.dbc)
+        self.sm = manager.SchedulerManager(None, self.dbc, self.cm)
+        self.numbers = [c.number for c in self.changes]
+
+    def addSchedulers(self, schedulers, last_processed):
+        d = self.dbc.addSchedulers(schedulers)
+        def set_states(_):
+            def txn(t):
+                for s, lp in zip(schedulers, last_processed):
+                    self.dbc.scheduler_set_state(s.schedulerid, t,
+                                                 {"last_processed": lp})
+            self.dbc.runInteractionNow(txn)
+            return self.sm.updateSchedulers(schedulers)
+        d.addCallback(set_states)
+        return d
+
+    def getClassified(self, s):
+        def txn(t):
+            important, unimportant = \
+                self.dbc.scheduler_get_classified_changes(s.schedulerid, t)
+            return (sorted([c.number for c in important]),
+                    sorted([c.number for c in unimportant]))
+        return self.dbc.runInteractionNow(txn)
+
+    def getLastProcessed(self, s):
+        def txn(t):
+            return self.dbc.scheduler_get_state(s.schedulerid, t)
+        return self.dbc.runInteractionNow(txn)["last_processed"]
+
+    def test_classify_changes(self):
+        s1 = basic.Scheduler(name="s1", branch="br", treeStableTimer=None,
+                             builderNames=["a"])
+        s2 = basic.Scheduler(name="s2", branch="other", treeStableTimer=None,
+                             builderNames=["a"])
+        s3 = basic.AnyBranchScheduler(name="s3", treeStableTimer=None,
+                builderNames=["a"],
+                fileIsImportant=lambda c : c.comments == "change 2")
+        # s4's state has never been set, so it starts from the latest change
+        s4 = basic.AnyBranchScheduler(name="s4", treeStableTimer=None,
+                                      builderNames=["a"])
+        d = self.addSchedulers([s1, s2, s3, s4], [self.numbers[0], 0, 0, None])
+        d.addCallback(lambda _ : self.sm.classify_changes())
+        def check(_):
+            # the changes were only loaded once, for all schedulers
+            self.assertEqual(self.cm.fetches, 1)
+            self.assertEqual(self.getClassified(s1),
+                             (self.numbers[1:], []))
+            self.assertEqual(self.getClassified(s2), ([], []))
+            self.assertEqual(self.getClassified(s3),
+                             (self.numbers[2:], self.numbers[:2]))
+            self.assertEqual(self.getClassified(s4), ([], []))
+            for s in s1, s2, s3, s4:
+                self.assertEqual(self.getLastProcessed(s), self.numbers[2])
+        d.addCallback(check)
+        return d
+
+    def test_classify_changes_error(self):
+        def fileIsImportant(c):
+            raise RuntimeError("oops")
+        s1 = basic.AnyBranchScheduler(name="s1", treeStableTimer=None,
+                                      builderNames=["a"],
+                                      fileIsImportant=fileIsImportant)
+        s2 = basic.AnyBranchScheduler(name="s2", treeStableTimer=None,
+                                      builderNames=["a"])
+        d = self.addSchedulers([s1, s2], [0, 0])
+        d.addCallback(lambda _ : self.sm.classify_changes())
+        def check(_):
+            self.assertEqual(len(self.flushLoggedErrors(RuntimeError)), 1)
+            # s1 will try again next time
+            self.assertEqual(self.getClassified(s1), ([], []))
+            self.assertEqual(self.getLastProcessed(s1), 0)
+            self.assertEqual(self.getClassified(s2), (self.numbers, []))
+        d.addCallback(check)
+        return d
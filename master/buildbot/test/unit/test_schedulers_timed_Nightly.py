@@ -1,4 +1,4 @@
-import time
+import os, time, random
 
 from twisted.trial import unittest
 
@@ -114,3 +114,107 @@ class Nightly(unittest.TestCase):
             self.assertEquals(len(important+unimportant), 0)
         d.addCallback(checkTables)
         return d
+
+class NextRunTime(unittest.TestCase):
+
+    # POSIX TZ strings, so that the tests do not depend on the zoneinfo
+    # database: no DST, DST starting and ending at 2am, and a half-hour
+    # DST shift
+    ZONES = ["UTC0", "EST5EDT,M3.2.0,M11.1.0",
+             "LHST-10:30LHDT-11,M10.1.0,M4.1.0"]
+
+    def setTZ(self, tz):
+        old = os.environ.get('TZ')
+        def restore():
+            if old is None:
+                del os.environ['TZ']
+            else:
+                os.environ['TZ'] = old
+            time.tzset()
+        self.addCleanup(restore)
+        os.environ['TZ'] = tz
+        time.tzset()
+
+    def bruteForce(self, s, now):
+        # the original implementation, which tries every minute
+        dateTime = time.localtime(now)
+        dateTime = s._addTime(dateTime, 60-dateTime[5])
+        yearLimit = dateTime[0]+2
+        while not s._isRunTime(dateTime):
+            dateTime = s._addTime(dateTime, 60)
+            assert dateTime[0] < yearLimit
+        return time.mktime(dateTime)
+
+    def makeNightly(self, **kwargs):
+        return timed.Nightly(name="n", builderNames=["b"], **kwargs)
+
+    def check(self, s, now):
+        self.assertEqual(s._calculateNextRunTimeFrom(now),
+                         self.bruteForce(s, now),
+                         "%r from %s" % (dict(minute=s.minute, hour=s.hour,
+                                              dayOfMonth=s.dayOfMonth,
+                                              month=s.month,
+                                              dayOfWeek=s.dayOfWeek),
+                                         time.ctime(now)))
+
+    def randomField(self, rng, low, high, wildcard=0.5):
+        r = rng.random()
+        if r < wildcard:
+            return '*'
+        if r < wildcard + (1-wildcard)/2:
+            return rng.randint(low, high)
+        return rng.sample(range(low, high+1), rng.randint(1, 4))
+
+    def test_fuzz(self):
+        rng = random.Random(1234)
+        for tz in self.ZONES:
+            self.setTZ(tz)
+            # times around the 2010 DST changes in both hemispheres, and
+            # some others
+            starts = [time.mktime((2010, 3, 14, 1, 0, 0, 0, 0, -1)),
+                      time.mktime((2010, 11, 7, 0, 30, 0, 0, 0, -1)),
+                      time.mktime((2010, 4, 4, 1, 0, 0, 0, 0, -1)),
+                      time.mktime((2010, 10, 3, 1, 0, 0, 0, 0, -1))]
+            for i in range(25):
+                s = self.makeNightly(
+                        minute=self.randomField(rng, 0, 59, wildcard=0.1),
+                        hour=self.randomField(rng, 0, 23),
+                        dayOfMonth=self.randomField(rng, 1, 31, wildcard=0.7),
+                        dayOfWeek=self.randomField(rng, 0, 6, wildcard=0.7))
+                now = rng.choice(starts) + rng.randint(0, 4*3600)
+                self.check(s, now)
+                self.check(s, rng.randint(1262304000, 1325376000))
+
+    def test_sparse(self):
+        self.setTZ("EST5EDT,M3.2.0,M11.1.0")
+        now = time.mktime((2010, 6, 15, 12, 34, 56, 0, 0, -1))
+        for kwargs in [dict(month=7, dayOfMonth=1, hour=0, minute=0),
+                       dict(month=[6, 7], dayOfMonth=15, minute=34),
+                       dict(dayOfMonth=31, hour=3, minute=0),
+                       dict(month=12, dayOfMonth=24, hour=12, minute=0)]:
+            self.check(self.makeNightly(**kwargs), now)
+
+    def test_dst_gap(self):
+        # 2:30am does not exist on the day DST starts, so is skipped
+        self.setTZ("EST5EDT,M3.2.0,M11.1.0")
+        s = self.makeNightly(hour=2, minute=30)
+        now = time.mktime((2010, 3, 14, 0, 0, 0, 0, 0, -1))
+        self.assertEqual(time.localtime(s._calculateNextRunTimeFrom(now))[:5],
+                         (2010, 3, 15, 2, 30))
+
+    def test_dst_repeat(self):
+        # 1:15am happens twice on the day DST ends; the first one wins, but
+        # the second one is used if we are already past the first
+        self.setTZ("EST5EDT,M3.2.0,M11.1.0")
+        s = self.makeNightly(hour=1, minute=15)
+        now = time.mktime((2010, 11, 7, 0, 0, 0, 0, 0, -1))
+        first = s._calculateNextRunTimeFrom(now)
+        self.assertEqual(time.localtime(first)[:5], (2010, 11, 7, 1, 15))
+        second = s._calculateNextRunTimeFrom(first)
+        self.assertEqual(second - first, 3600)
+
+    def test_impossible(self):
+        s = self.makeNightly(month=2, dayOfMonth=30)
+        self.assertRaises(AssertionError, s._calculateNextRunTimeFrom,
+                          time.time())
+
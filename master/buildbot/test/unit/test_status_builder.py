@@ -1,10 +1,13 @@
 import os
+from cStringIO import StringIO
 
 from buildbot.status import builder
+from buildbot import sourcestamp, util
 #from buildbot.util import json
 from mock import Mock
 
 from twisted.trial import unittest
+from twisted.internet import defer
 
 class TestBuildStepStatus(unittest.TestCase):
     def setupBuilder(self, buildername, category=None):
@@ -27,3 +30,528 @@ class TestBuildStepStatus(unittest.TestCase):
         self.assertEquals('step_2', bss2.getName())
         self.assertEquals(1, bss2.asDict()['step_number'])
         self.assertEquals([bss1, bss2], bs.getSteps())
+
+class TestLogFileIndex(unittest.TestCase):
+    def setupLog(self):
+        b = builder.BuilderStatus(buildername='builder_1', category=None)
+        b.basedir = os.path.abspath(self.mktemp())
+        os.mkdir(b.basedir)
+        b.determineNextBuildNumber()
+        bs = b.newBuild()
+        step = bs.addStepWithName('step_1')
+        step.started = True
+        return step.addLog('stdio')
+
+    def fillLog(self, l, count=50):
+        l.chunkSize = 20
+        for i in range(count):
+            l.addStdout("out line %d\n" % i)
+            l.addStderr("err line %d\n" % i)
+
+    def testIndexWritten(self):
+        l = self.setupLog()
+        self.fillLog(l)
+        l.finish()
+        self.failUnless(os.path.exists(l.getFilename() + ".idx"))
+        self.assertEquals(l.getNumChunks(), 100)
+        self.assertEquals(l.numLines, 100)
+        offset, channel, lines = l.getIndex()[3]
+        self.assertEquals(channel, builder.STDERR)
+        self.assertEquals(lines, 3)
+
+    def testChunkRange(self):
+        l = self.setupLog()
+        self.fillLog(l)
+        l.finish()
+        everything = list(l.getChunks())
+        self.assertEquals(list(l.getChunks(start=10, end=20)),
+                          everything[10:20])
+        self.assertEquals(list(l.getChunks(start=-7)), everything[-7:])
+        self.assertEquals(list(l.getChunks([builder.STDERR], onlyText=True,
+                                           start=-4)),
+                          [c[1] for c in everything[-4:]
+                           if c[0] == builder.STDERR])
+
+    def testChunkRangeWithoutIndex(self):
+        l = self.setupLog()
+        self.fillLog(l)
+        l.finish()
+        everything = list(l.getChunks())
+        os.unlink(l.getFilename() + ".idx")
+        l.index = None
+        self.assertEquals(l.getIndex(), None)
+        self.assertEquals(list(l.getChunks(start=10, end=20)),
+                          everything[10:20])
+        self.assertEquals(list(l.getChunks(start=-7)), everything[-7:])
+
+    def testChunkRangeUnfinished(self):
+        l = self.setupLog()
+        self.fillLog(l, 5)
+        l.addStdout("not merged")
+        chunks = list(l.getChunks(start=-2))
+        self.assertEquals(chunks[-1], (builder.STDOUT, "not merged"))
+        self.assertEquals(len(chunks), 3)
+
+    def testReadlinesTail(self):
+        l = self.setupLog()
+        self.fillLog(l)
+        l.finish()
+        self.assertEquals(l.readlines(tail=3),
+                          ["out line 47\n", "out line 48\n", "out line 49\n"])
+        self.assertEquals(l.readlines(builder.STDERR, tail=100),
+                          list(l.readlines(builder.STDERR)))
+
+    def testChunkForLine(self):
+        l = self.setupLog()
+        self.fillLog(l)
+        l.finish()
+        chunk = l.getChunkForLine(-10)
+        text = "".join(l.getChunks(onlyText=True, start=chunk))
+        self.failUnless(text.endswith("err line 45\nout line 46\n"
+                "err line 46\nout line 47\nerr line 47\nout line 48\n"
+                "err line 48\nout line 49\nerr line 49\n"), text)
+        self.failUnless(text.count("\n") < 15)
+
+class TestLogFileCompression(unittest.TestCase):
+    def setupLog(self):
+        b = builder.BuilderStatus(buildername='builder_1', category=None)
+        b.basedir = os.path.abspath(self.mktemp())
+        os.mkdir(b.basedir)
+        b.determineNextBuildNumber()
+        b.setLogCompressionLimit(1024)
+        b.setLogCompressionMethod("blocks")
+        bs = b.newBuild()
+        step = bs.addStepWithName('step_1')
+        step.started = True
+        l = step.addLog('stdio')
+        l.compressFrameSize = 4096
+        return l
+
+    def testBlockCompression(self):
+        l = self.setupLog()
+        for i in range(3000):
+            l.addStdout("line %d\n" % i)
+        # frames are being compressed while the log is still running
+        self.failUnless(l.framedLength > 0)
+        l.finish()
+        expected = l.getText()
+        d = l.compressLog()
+        def check(_):
+            self.failUnless(os.path.exists(l.getFilename() + ".blocks"))
+            self.failIf(os.path.exists(l.getFilename() + ".blocks.tmp"))
+            self.failUnless(isinstance(l.getFile(), builder.BlockFile))
+            self.assertEqual(l.getText(), expected)
+            self.assertEqual(l.readlines(tail=2),
+                             ["line 2998\n", "line 2999\n"])
+        d.addCallback(check)
+        return d
+
+class TestLinesFromChunks(unittest.TestCase):
+    def testSplitLines(self):
+        chunks = ["one\ntw", "o", "\nthree\nfo", "ur"]
+        self.assertEqual(list(builder.linesFromChunks(chunks)),
+                         ["one\n", "two\n", "three\n", "four"])
+
+    def testEmpty(self):
+        self.assertEqual(list(builder.linesFromChunks(["", ""])), [])
+
+    def testPullDriven(self):
+        def chunks():
+            yield "first\nsec"
+            yield "ond\n"
+            raise AssertionError("read too far")
+        lines = builder.linesFromChunks(chunks())
+        self.assertEqual(lines.next(), "first\n")
+        self.assertEqual(lines.next(), "second\n")
+
+class TestLogFileReadlines(unittest.TestCase):
+    def setupLog(self):
+        b = builder.BuilderStatus(buildername='builder_1', category=None)
+        b.basedir = os.path.abspath(self.mktemp())
+        os.mkdir(b.basedir)
+        b.determineNextBuildNumber()
+        bs = b.newBuild()
+        step = bs.addStepWithName('step_1')
+        step.started = True
+        return step.addLog('stdio')
+
+    def testReadlines(self):
+        l = self.setupLog()
+        l.chunkSize = 7
+        l.addHeader("header\n")
+        l.addStdout("out line 1\nout ")
+        l.addStderr("err line\n")
+        l.addStdout("line 2\n")
+        l.finish()
+        self.assertEqual(list(l.readlines()),
+                         ["out line 1\n", "out line 2\n"])
+        self.assertEqual(list(l.readlines([builder.STDOUT, builder.STDERR])),
+                         ["out line 1\n", "out err line\n", "line 2\n"])
+        self.assertEqual(list(l.readlines([builder.STDOUT, builder.STDERR])),
+                         StringIO(l.getText()).readlines())
+
+class TestBuildCache(unittest.TestCase):
+    def setUp(self):
+        basedir = os.path.abspath(self.mktemp())
+        os.mkdir(basedir)
+        self.status = builder.Status(Mock(), basedir)
+
+    def addBuilder(self, name, numBuilds):
+        b = self.status.builderAdded(name, name)
+        for i in range(numBuilds):
+            bs = b.newBuild()
+            bs.finished = True
+            bs.saveYourself()
+        b.determineNextBuildNumber()
+        return b
+
+    def testSharedCache(self):
+        b1 = self.addBuilder('b1', 20)
+        b2 = self.addBuilder('b2', 20)
+        self.assertEqual(self.status.getBuildCacheStats()['maxBuilds'], 30)
+        # an idle builder leaves room for a busy one
+        for i in range(20):
+            b1.getBuildByNumber(i)
+        for i in range(10):
+            b2.getBuildByNumber(i)
+        self.assertEqual(len(self.status.buildCache), 30)
+        stats = self.status.getBuildCacheStats()
+        self.assertEqual((stats['hits'], stats['misses']), (0, 30))
+        b1.getBuildByNumber(19)
+        self.assertEqual(self.status.getBuildCacheStats()['hits'], 1)
+
+    def testMaxBytes(self):
+        b1 = self.addBuilder('b1', 10)
+        size = b1.getBuildByNumber(0).estimatedSize
+        self.failUnless(size > 0)
+        self.status.setBuildCacheMaxBytes(size * 3)
+        for i in range(10):
+            b1.getBuildByNumber(i)
+        self.assertEqual(len(self.status.buildCache), 3)
+
+    def testBuilderRemoved(self):
+        self.addBuilder('b1', 0)
+        self.addBuilder('b2', 0)
+        self.status.builderRemoved('b2')
+        self.assertEqual(self.status.getBuildCacheStats()['maxBuilds'], 15)
+
+class TestRecentBuilds(unittest.TestCase):
+    def setUp(self):
+        basedir = os.path.abspath(self.mktemp())
+        os.mkdir(basedir)
+        self.status = builder.Status(Mock(), basedir)
+        self.now = 1000
+        self.patch(util, 'now', lambda _reactor=None: self.now)
+
+    def addBuilder(self, name, category=None):
+        return self.status.builderAdded(name, name, category)
+
+    def runBuild(self, b, results=builder.SUCCESS, branch=None):
+        bs = b.newBuild()
+        bs.setSourceStamp(sourcestamp.SourceStamp(branch=branch))
+        bs.setReason('because')
+        bs.setBlamelist([])
+        bs.buildStarted(Mock())
+        bs.setText(['build'])
+        bs.setResults(results)
+        self.now += 10
+        bs.buildFinished()
+        return bs
+
+    def finished(self, **kwargs):
+        return [ (b.getBuilder().getName(), b.getNumber()) for b in
+                 self.status.generateFinishedBuilds(**kwargs) ]
+
+    def testOrder(self):
+        b1 = self.addBuilder('b1', 'cat1')
+        b2 = self.addBuilder('b2', 'cat2')
+        self.runBuild(b1)
+        self.runBuild(b2, results=builder.FAILURE)
+        self.runBuild(b2, branch='br')
+        self.runBuild(b1, results=builder.FAILURE)
+        d = defer.gatherResults([b1.waitUntilSaved(), b2.waitUntilSaved()])
+        def check(_):
+            self.assertEqual(self.finished(),
+                [('b1', 1), ('b2', 1), ('b2', 0), ('b1', 0)])
+            self.assertEqual(self.finished(num_builds=2),
+                [('b1', 1), ('b2', 1)])
+            self.assertEqual(self.finished(builders=['b2']),
+                [('b2', 1), ('b2', 0)])
+            self.assertEqual(self.finished(categories=['cat1']),
+                [('b1', 1), ('b1', 0)])
+            self.assertEqual(self.finished(results=[builder.FAILURE]),
+                [('b1', 1), ('b2', 0)])
+            self.assertEqual(self.finished(branches=['br']), [('b2', 1)])
+            self.assertEqual(self.finished(finished_before=1030),
+                [('b2', 0), ('b1', 0)])
+            self.assertEqual(self.finished(max_search=1),
+                [('b1', 1), ('b2', 1)])
+        d.addCallback(check)
+        return d
+
+    def testLoadedFromSummaries(self):
+        b1 = self.addBuilder('b1')
+        for i in range(3):
+            self.runBuild(b1)
+        d = b1.waitUntilSaved()
+        def check(_):
+            # a new Status reads the summaries when it is first asked
+            status = builder.Status(Mock(), self.status.basedir)
+            b1 = status.builderAdded('b1', 'b1')
+            self.assertEqual(len(status.recentBuilds), 3)
+            builds = list(status.generateFinishedBuilds())
+            self.assertEqual([ b.getNumber() for b in builds ], [2, 1, 0])
+            self.failIf(b1.isBuildInMemory(2))
+            # and is told about new ones
+            self.runBuild(b1)
+            self.assertEqual(len(status.recentBuilds), 4)
+            # and about pruned ones
+            b1.buildHorizon = 2
+            b1.prune()
+            self.assertEqual([ e[2] for e in
+                               status.recentBuilds.generateEntries() ], [3, 2])
+            return b1.waitUntilSaved()
+        d.addCallback(check)
+        return d
+
+    def testUpgradedWithoutSummaries(self):
+        b1 = self.addBuilder('b1')
+        for i in range(3):
+            self.runBuild(b1)
+        d = b1.waitUntilSaved()
+        def check(_):
+            # as if the builds were saved before the summary index existed
+            os.unlink(b1.getSummaryFilename())
+            status = builder.Status(Mock(), self.status.basedir)
+            b2 = status.builderAdded('b1', 'b1')
+            b2.backfillBatchSize = 2
+            # they are summarized in the background; meanwhile the answer
+            # comes from the summaries there are
+            self.assertEqual(list(status.generateFinishedBuilds()), [])
+            d = b2.backfillSummaries()
+            d.addCallback(check2, status, b2)
+            return d
+        def check2(_, status, b2):
+            builds = list(status.generateFinishedBuilds())
+            self.assertEqual([ b.getNumber() for b in builds ], [2, 1, 0])
+            self.assertEqual([ b.getNumber() for b in
+                               b2.generateFinishedBuilds() ], [2, 1, 0])
+            # and they are in the index from now on
+            self.assertEqual(sorted(b2.getSummaries().keys()), [0, 1, 2])
+            # without going through the build cache
+            for i in range(3):
+                self.failIf(b2.isBuildInMemory(i))
+        d.addCallback(check)
+        return d
+
+    def testBuilderRemoved(self):
+        b1 = self.addBuilder('b1')
+        self.runBuild(b1)
+        self.addBuilder('b2')
+        self.status.builderRemoved('b1')
+        self.assertEqual(self.finished(), [])
+        return b1.waitUntilSaved()
+
+    def testAddedWhileGenerating(self):
+        b1 = self.addBuilder('b1')
+        self.runBuild(b1)
+        self.runBuild(b1)
+        g = self.status.recentBuilds.generateEntries()
+        self.assertEqual(g.next()[2], 1)
+        self.runBuild(b1)
+        self.assertEqual([ e[2] for e in g ], [0])
+        return b1.waitUntilSaved()
+
+class BuilderFilesMixin:
+    """Set up a BuilderStatus with some finished builds saved on disk"""
+    def setupBuilder(self, numBuilds):
+        b = builder.BuilderStatus(buildername='builder_1', category=None)
+        b.basedir = os.path.abspath(self.mktemp())
+        os.mkdir(b.basedir)
+        b.determineNextBuildNumber()
+        b.status = Mock()
+        for i in range(numBuilds):
+            bs = b.newBuild()
+            bs.setSourceStamp(sourcestamp.SourceStamp(
+                        branch='branch%d' % (i % 2), revision=str(i)))
+            bs.setReason('because')
+            bs.setBlamelist([])
+            bs.buildStarted(Mock())
+            bs.setText(['build', str(i)])
+            bs.setResults(builder.SUCCESS)
+            bs.buildFinished()
+        # builds are saved in a thread
+        d = b.waitUntilSaved()
+        d.addCallback(lambda _ : b)
+        return d
+
+    def reloadBuilder(self, b):
+        # a new BuilderStatus, with nothing in memory
+        b2 = builder.BuilderStatus(buildername='builder_1', category=None)
+        b2.basedir = b.basedir
+        b2.determineNextBuildNumber()
+        b2.status = Mock()
+        return b2
+
+class TestBuildSummaries(BuilderFilesMixin, unittest.TestCase):
+    def testSummariesWritten(self):
+        d = self.setupBuilder(3)
+        def check(b):
+            b2 = self.reloadBuilder(b)
+            self.assertEqual(sorted(b2.getSummaries().keys()), [0, 1, 2])
+            build = b2.getBuild(1)
+            self.failUnless(isinstance(build, builder.BuildSummary))
+            self.assertEqual(build.getText(), ['build', '1'])
+            self.assertEqual(build.getResults(), builder.SUCCESS)
+            self.assertEqual(build.getBranch(), 'branch1')
+            # nothing was unpickled to answer those
+            self.failIf(b2.isBuildInMemory(1))
+        d.addCallback(check)
+        return d
+
+    def testSummaryLoadsBuild(self):
+        d = self.setupBuilder(2)
+        def check(b):
+            b2 = self.reloadBuilder(b)
+            build = b2.getBuild(0)
+            self.assertEqual(build.getReason(), 'because')
+            self.assertEqual(build.getSteps(), [])
+            self.failUnless(b2.isBuildInMemory(0))
+            self.failUnless(isinstance(b2.getBuild(0), builder.BuildStatus))
+        d.addCallback(check)
+        return d
+
+    def testGenerateFinishedBuilds(self):
+        d = self.setupBuilder(6)
+        def check(b):
+            b2 = self.reloadBuilder(b)
+            builds = list(b2.generateFinishedBuilds(branches=['branch0']))
+            self.assertEqual([ bs.getNumber() for bs in builds ], [4, 2, 0])
+            self.failIf(b2.isBuildInMemory(4))
+        d.addCallback(check)
+        return d
+
+    def testMissingSummaryAdded(self):
+        d = self.setupBuilder(2)
+        def check(b):
+            os.unlink(b.getSummaryFilename())
+            b2 = self.reloadBuilder(b)
+            self.failUnless(isinstance(b2.getBuild(1), builder.BuildStatus))
+            b3 = self.reloadBuilder(b)
+            self.assertEqual(b3.getSummaries().keys(), [1])
+        d.addCallback(check)
+        return d
+
+    def testPrune(self):
+        d = self.setupBuilder(5)
+        def check(b):
+            b.buildHorizon = 2
+            b.prune()
+            b2 = self.reloadBuilder(b)
+            self.assertEqual(sorted(b2.getSummaries().keys()), [3, 4])
+        d.addCallback(check)
+        return d
+
+    def testEquality(self):
+        d = self.setupBuilder(2)
+        def check(b):
+            b2 = self.reloadBuilder(b)
+            s1, s2 = b2.getBuild(1), b2.getBuild(1)
+            self.failIf(s1 is s2)
+            self.assertEqual(s1, s2)
+            self.assertEqual(hash(s1), hash(s2))
+            self.assertNotEqual(s1, b2.getBuild(0))
+            self.assertEqual(len(set([s1, s2, b2.getBuild(0)])), 2)
+            # without loading either build
+            self.failIf(b2.isBuildInMemory(0) or b2.isBuildInMemory(1))
+        d.addCallback(check)
+        return d
+
+    def testWebBox(self):
+        from buildbot.status.web.base import IBox
+        from buildbot.status.web import waterfall
+        d = self.setupBuilder(1)
+        def check(b):
+            b2 = self.reloadBuilder(b)
+            summary = b2.getBuild(0)
+            self.failUnless(isinstance(IBox(summary), waterfall.BuildBox))
+        d.addCallback(check)
+        return d
+
+class TestBuildPersistence(BuilderFilesMixin, unittest.TestCase):
+    def testLoadBuild(self):
+        d = self.setupBuilder(2)
+        def load(b):
+            b2 = self.reloadBuilder(b)
+            d1 = b2.loadBuild(1)
+            d2 = b2.loadBuild(1)
+            # both share one read
+            self.assertEqual(b2.buildsLoading.keys(), [1])
+            d = defer.gatherResults([d1, d2])
+            d.addCallback(check, b2)
+            return d
+        def check((build1, build2), b2):
+            self.failUnless(build1 is build2)
+            self.failUnless(isinstance(build1, builder.BuildStatus))
+            self.assertEqual(build1.getNumber(), 1)
+            self.failUnless(b2.getBuildByNumber(1) is build1)
+            self.assertEqual(b2.buildsLoading, {})
+        d.addCallback(load)
+        return d
+
+    def testLoadMissingBuild(self):
+        d = self.setupBuilder(1)
+        def load(b):
+            return self.assertFailure(b.loadBuild(10), IndexError)
+        d.addCallback(load)
+        return d
+
+    def testSaveCoalesced(self):
+        d = self.setupBuilder(1)
+        saves = []
+        def save(b):
+            build = b.getBuildByNumber(0)
+            realWrite = builder.BuildStatus.writePickle
+            def countingWrite(self, data):
+                saves.append(None)
+                realWrite(self, data)
+            builder.BuildStatus.writePickle = countingWrite
+            self.addCleanup(setattr, builder.BuildStatus, 'writePickle',
+                            realWrite)
+            build.setText(['changed'])
+            d = defer.gatherResults([ b.saveBuild(build) for i in range(5) ])
+            d.addCallback(lambda _ : b)
+            return d
+        def check(b):
+            # one save in progress, then one more for the other four
+            self.assertEqual(len(saves), 2)
+            b2 = self.reloadBuilder(b)
+            self.assertEqual(b2.getBuildByNumber(0).getText(), ['changed'])
+        d.addCallback(save)
+        d.addCallback(check)
+        return d
+
+    def testLoadNegativeBuild(self):
+        d = self.setupBuilder(3)
+        def load(b):
+            b2 = self.reloadBuilder(b)
+            return b2.loadBuild(-1)
+        def check(build):
+            self.assertEqual(build.getNumber(), 2)
+        d.addCallback(load)
+        d.addCallback(check)
+        return d
+
+    def testSaveFailure(self):
+        d = self.setupBuilder(1)
+        def save(b):
+            build = b.getBuildByNumber(0)
+            realWrite = builder.BuildStatus.writePickle
+            def failingWrite(self, data):
+                raise IOError("disk full")
+            builder.BuildStatus.writePickle = failingWrite
+            self.addCleanup(setattr, builder.BuildStatus, 'writePickle',
+                            realWrite)
+            return self.assertFailure(b.saveBuild(build), IOError)
+        d.addCallback(save)
+        return d
@@ -0,0 +1,161 @@
+import gzip, urllib
+from cStringIO import StringIO
+
+from twisted.trial import unittest
+from twisted.internet import defer
+from twisted.python import failure
+
+from mock import Mock
+
+from buildbot.status import status_push
+from buildbot.util import json
+
+class TestHttpStatusPush(unittest.TestCase):
+
+    def setUp(self):
+        self.posts = []
+        def getPage(url, method, postdata, headers, agent):
+            d = defer.Deferred()
+            self.posts.append((postdata, headers, d))
+            return d
+        self.patch(status_push.client, 'getPage', getPage)
+
+    def tearDown(self):
+        if self.sp.task and self.sp.task.active():
+            self.sp.task.cancel()
+
+    def makePush(self, nbItems, **kwargs):
+        self.sp = status_push.HttpStatusPush('http://example.com/',
+                                             maxDiskItems=0, chunkSize=1,
+                                             **kwargs)
+        for i in range(nbItems):
+            self.sp.queue.pushItem({'id': i})
+        return self.sp
+
+    def queuedIds(self):
+        return [self.sp._encodedItem(item)[0]
+                for item in self.sp.queue.items()]
+
+    def failPost(self, n):
+        self.posts[n][2].errback(failure.Failure(RuntimeError('down')))
+
+    def succeedPost(self, n):
+        self.posts[n][2].callback('ok')
+
+    def test_maxInFlight(self):
+        sp = self.makePush(5, maxInFlight=3)
+        sp.pushHttp()
+        self.assertEqual(len(self.posts), 3)
+        self.assertEqual(sp.getMetrics()['in_flight'], 3)
+        self.assertEqual(sp.getMetrics()['backlog'], 2)
+        for n in range(5):
+            self.succeedPost(n)
+        metrics = sp.getMetrics()
+        self.assertEqual((metrics['pushes'], metrics['events'],
+                          metrics['in_flight']), (5, 5, 0))
+        # the next push is queued
+        self.failUnless(sp.task.active())
+
+    def test_pipelined(self):
+        sp = self.makePush(5, maxInFlight=3)
+        sp.pushHttp()
+        # a POST completing out of order frees no slot, since the older
+        # ones are still outstanding
+        self.succeedPost(1)
+        self.assertEqual(len(self.posts), 3)
+        # once it is acknowledged, both free slots are refilled at once,
+        # without waiting for the last POST
+        self.succeedPost(0)
+        self.assertEqual(len(self.posts), 5)
+        self.assertEqual(sp.getMetrics()['in_flight'], 3)
+        self.assertEqual(sp.getMetrics()['backlog'], 0)
+        self.failIf(sp.task)
+        for n in (2, 3, 4):
+            self.succeedPost(n)
+        self.assertEqual(sp.getMetrics()['events'], 5)
+        self.failUnless(sp.task.active())
+
+    def test_bufferDelay(self):
+        sp = self.makePush(3)
+        sp.pushHttp()
+        self.succeedPost(0)
+        # with one request at a time, the next waits for bufferDelay
+        self.assertEqual(len(self.posts), 1)
+        self.failUnless(sp.task.active())
+
+    def test_stopWaitsForQueue(self):
+        sp = self.makePush(3)
+        sp.status = Mock()
+        sp.status.getProjectName.return_value = 'proj'
+        sp.status.asDict.return_value = {}
+        sp.running = 1
+        sp.pushHttp()
+        stopped = []
+        d = sp.stopService()
+        d.addCallback(stopped.append)
+        # the shutdown event was queued as well; each POST is chained to the
+        # previous one until they are all sent
+        for n in range(4):
+            self.failIf(stopped)
+            self.succeedPost(n)
+        self.failUnless(stopped)
+        self.assertEqual(sp.queue.nbItems(), 0)
+        self.assertEqual(sp.inFlight, [])
+        return d
+
+    def test_orderedFailures(self):
+        sp = self.makePush(5, maxInFlight=3)
+        sp.pushHttp()
+        # complete out of order: the failed items must go back in order
+        self.failPost(1)
+        self.assertEqual(self.queuedIds(), [3, 4])
+        self.succeedPost(2)
+        self.failPost(0)
+        self.assertEqual(self.queuedIds(), [0, 1, 3, 4])
+        self.failIf(sp.wasLastPushSuccessful())
+        self.assertEqual(sp.getMetrics()['failures'], 2)
+        # while the server is down, only one request is sent at a time
+        sp.task.cancel()
+        sp.pushHttp()
+        self.assertEqual(len(self.posts), 4)
+
+    def test_compress(self):
+        sp = self.makePush(1, compress=True)
+        sp.pushHttp()
+        body, headers, d = self.posts[0]
+        self.assertEqual(headers['Content-Encoding'], 'gzip')
+        data = gzip.GzipFile(fileobj=StringIO(body)).read()
+        self.failUnless(data.startswith('packets='))
+        self.succeedPost(0)
+
+    def test_popChunk_size(self):
+        sp = self.makePush(0, maxHttpRequestSize=200)
+        sp.chunkSize = 10
+        packets = [{'id': i, 'payload': 'x' * 40} for i in range(5)]
+        packets.insert(1, {'id': 99, 'payload': 'y' * 300})
+        for packet in packets:
+            sp.queue.pushItem(sp.encodePacket(packet))
+        # the first fits, but not with the huge one; that is dropped alone
+        data, items = sp.popChunk()
+        self.assertEqual([item[0] for item in items], [0])
+        self.assertEqual(data, urllib.urlencode(
+            {'packets': json.dumps(packets[:1], separators=(',',':'))}))
+        data, items = sp.popChunk()
+        self.assertEqual([item[0] for item in items], [1, 2])
+        self.failUnless(len(data) < 200)
+        self.assertEqual(self.queuedIds(), [3, 4])
+
+    def test_encodedOnce(self):
+        sp = self.makePush(0, maxHttpRequestSize=200)
+        sp.chunkSize = 10
+        encoded = []
+        realDumps = status_push.json.dumps
+        def dumps(obj, **kwargs):
+            encoded.append(obj['id'])
+            return realDumps(obj, **kwargs)
+        self.patch(status_push.json, 'dumps', dumps)
+        for i in range(5):
+            sp.queue.pushItem(sp.encodePacket({'id': i, 'payload': 'x' * 60}))
+        while sp.queue.nbItems():
+            sp.popChunk()
+        self.assertEqual(encoded, range(5))
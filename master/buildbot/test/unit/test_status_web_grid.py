@@ -0,0 +1,90 @@
+import os
+from mock import Mock
+from twisted.trial import unittest
+
+from buildbot.status import builder
+from buildbot.status.web import grid
+from buildbot import sourcestamp
+
+class FakeStatus:
+    def __init__(self, builders):
+        self.builders = builders
+    def getBuilderNames(self):
+        return [b.name for b in self.builders]
+    def getBuilder(self, name):
+        return [b for b in self.builders if b.name == name][0]
+
+class GridStatusMixin(unittest.TestCase):
+
+    def setupBuilder(self, name, stamps):
+        b = builder.BuilderStatus(buildername=name, category=None)
+        b.basedir = os.path.abspath(self.mktemp())
+        os.mkdir(b.basedir)
+        b.determineNextBuildNumber()
+        b.status = Mock()
+        for i, (branch, revision, start) in enumerate(stamps):
+            bs = b.newBuild()
+            bs.setSourceStamp(sourcestamp.SourceStamp(branch=branch,
+                                                      revision=revision))
+            bs.setReason('because')
+            bs.setBlamelist([])
+            bs.buildStarted(Mock())
+            bs.started = start
+            bs.setText(['build', str(i)])
+            bs.setResults(builder.SUCCESS)
+            bs.buildFinished()
+        d = b.waitUntilSaved()
+        def reload(_):
+            # a new BuilderStatus, with nothing in memory
+            b2 = builder.BuilderStatus(buildername=name, category=None)
+            b2.basedir = b.basedir
+            b2.determineNextBuildNumber()
+            b2.status = Mock()
+            return b2
+        d.addCallback(reload)
+        return d
+
+    def setUp(self):
+        self.mixin = grid.GridStatusMixin()
+        d = self.setupBuilder('b1', [('br', '1', 100), ('br', '2', 200),
+                                     ('other', '1', 250), ('br', '3', 300)])
+        def second(b1):
+            self.b1 = b1
+            return self.setupBuilder('b2', [('br', '2', 150),
+                                            ('br', '3', 350)])
+        d.addCallback(second)
+        def done(b2):
+            self.b2 = b2
+            self.status = FakeStatus([self.b1, self.b2])
+        d.addCallback(done)
+        return d
+
+    def test_getRecentSourcestamps(self):
+        stamps = self.mixin.getRecentSourcestamps(self.status, 3, [],
+                                                  grid.ANYBRANCH)
+        # sorted by the earliest start of each; 'br 2' was first built on b2
+        self.assertEqual([(ss.branch, ss.revision) for ss in stamps],
+                         [('br', '2'), ('other', '1'), ('br', '3')])
+        # only the builds chosen for their source stamps were loaded
+        self.assertEqual([n for n in range(4) if self.b1.isBuildInMemory(n)],
+                         [2, 3])
+        self.assertEqual([n for n in range(2) if self.b2.isBuildInMemory(n)],
+                         [0])
+
+    def test_getRecentSourcestamps_branch(self):
+        stamps = self.mixin.getRecentSourcestamps(self.status, 5, [], 'br')
+        self.assertEqual([ss.revision for ss in stamps], ['1', '2', '3'])
+
+    def test_getRecentSourcestamps_bounded(self):
+        self.mixin.max_search = 2
+        stamps = self.mixin.getRecentSourcestamps(self.status, 5, [], 'br')
+        # b1's first build is too old to be looked at
+        self.assertEqual([ss.revision for ss in stamps], ['2', '3'])
+
+    def test_getBuildsForStamps(self):
+        stamps = [sourcestamp.SourceStamp(branch='br', revision='2'),
+                  sourcestamp.SourceStamp(branch='br', revision='9'),
+                  sourcestamp.SourceStamp(branch='other', revision='1')]
+        builds = self.mixin.getBuildsForStamps(self.b1, stamps)
+        self.assertEqual([b and b.getNumber() for b in builds], [1, None, 2])
+        self.failIf([n for n in range(4) if self.b1.isBuildInMemory(n)])
@@ -0,0 +1,212 @@
+from twisted.trial import unittest
+from twisted.internet import defer, error, task
+from twisted.python import failure
+from mock import Mock
+
+from buildbot.changes import svnpoller
+
+# 'svn info --xml' output for a poller watching /proj in the repository
+info_output = """<?xml version="1.0"?>
+<info>
+<entry kind="dir" path="proj" revision="12">
+<url>svn://example.com/repo/proj</url>
+<repository>
+<root>svn://example.com/repo</root>
+</repository>
+</entry>
+</info>
+"""
+
+def make_log(*revisions):
+    """Make 'svn log --xml --verbose' output, newest first, for the given
+    (revision, author, msg, [(action, path)]) tuples."""
+    entries = []
+    for (rev, author, msg, paths) in revisions:
+        pathxml = "".join([ '<path action="%s">%s</path>\n' % (action, path)
+                            for (action, path) in paths ])
+        entries.append('<logentry revision="%d">\n'
+                       '<author>%s</author>\n'
+                       '<date>2010-01-01T00:00:00.000000Z</date>\n'
+                       '<paths>\n%s</paths>\n'
+                       '<msg>%s</msg>\n'
+                       '</logentry>\n' % (rev, author, pathxml, msg))
+    entries.reverse()
+    return '<?xml version="1.0"?>\n<log>\n%s</log>\n' % "".join(entries)
+
+class SVNLogParser(unittest.TestCase):
+
+    def parse(self, output, chunk_size=None):
+        parser = svnpoller.SVNLogParser()
+        if chunk_size is None:
+            chunk_size = len(output)
+        for i in range(0, len(output), chunk_size):
+            parser.feed(output[i:i+chunk_size])
+        return parser.close()
+
+    def test_parse(self):
+        output = make_log(
+            (11, 'alice', 'first', [('M', '/proj/trunk/a.c')]),
+            (12, 'bob', 'second &amp; last',
+             [('A', '/proj/trunk/b.c'), ('D', '/proj/trunk/c.c')]))
+        # fed a few bytes at a time, as it arrives from svn
+        entries = self.parse(output, chunk_size=7)
+        self.assertEqual([ e.revision for e in entries ], [11, 12])
+        self.assertEqual(entries[1].author, 'bob')
+        self.assertEqual(entries[1].msg, 'second & last')
+        self.assertEqual(entries[1].paths, [('A', '/proj/trunk/b.c'),
+                                            ('D', '/proj/trunk/c.c')])
+
+    def test_parse_no_paths(self):
+        output = ('<?xml version="1.0"?>\n<log>\n'
+                  '<logentry revision="3"><msg>m</msg></logentry>\n</log>\n')
+        entries = self.parse(output)
+        self.assertEqual(entries[0].paths, None)
+        self.assertEqual(entries[0].author, '<unknown>')
+
+    def test_parse_garbled(self):
+        parser = svnpoller.SVNLogParser()
+        self.assertRaises(svnpoller.xml.parsers.expat.ExpatError,
+                          parser.feed, '<log><logentry revision="1"></log>')
+
+class SVNLogProtocol(unittest.TestCase):
+
+    def setUp(self):
+        self.d = defer.Deferred()
+        self.p = svnpoller.SVNLogProtocol(svnpoller.SVNLogParser(), self.d)
+
+    def test_success(self):
+        self.p.outReceived(make_log((5, 'alice', 'msg', [])))
+        self.p.processEnded(failure.Failure(error.ProcessDone(0)))
+        self.d.addCallback(lambda entries :
+                self.assertEqual([ e.revision for e in entries ], [5]))
+        return self.d
+
+    def test_exit_code(self):
+        self.p.errReceived('svn: No such revision 7\n')
+        self.p.processEnded(failure.Failure(error.ProcessTerminated(1)))
+        return self.assertFailure(self.d, EnvironmentError)
+
+    def test_garbled(self):
+        self.p.outReceived('<log><logentry revision="1"></log>')
+        self.p.outReceived('more')
+        self.p.processEnded(failure.Failure(error.ProcessDone(0)))
+        return self.assertFailure(self.d,
+                                  svnpoller.xml.parsers.expat.ExpatError)
+
+class Polling(unittest.TestCase):
+
+    def setUp(self):
+        self.log_args = []
+        self.log_output = None
+        self.poller = svnpoller.SVNPoller('svn://example.com/repo/proj',
+                            split_file=svnpoller.split_file_branches)
+        self.poller.parent = Mock()
+        self.poller.getProcessOutput = lambda args : defer.succeed(info_output)
+        self.poller.getLogEntries = self.getLogEntries
+
+    def getLogEntries(self, args):
+        self.log_args.append(args)
+        parser = svnpoller.SVNLogParser()
+        parser.feed(self.log_output)
+        return defer.succeed(parser.close())
+
+    def test_first_poll(self):
+        self.log_output = make_log((10, 'alice', 'msg',
+                                    [('M', '/proj/trunk/a.c')]))
+        d = self.poller.checksvn()
+        def check(_):
+            self.assertEqual(self.poller.last_change, 10)
+            # only the latest revision was asked for, without its paths
+            self.failUnless('--limit=1' in self.log_args[0])
+            self.failIf('--verbose' in self.log_args[0])
+            self.failIf(self.poller.parent.addChanges.called)
+        d.addCallback(check)
+        return d
+
+    def test_new_revisions(self):
+        self.poller.last_change = 10
+        self.log_output = make_log(
+            (10, 'alice', 'old', [('M', '/proj/trunk/a.c')]),
+            (11, 'bob', 'on trunk', [('M', '/proj/trunk/b.c')]),
+            (12, 'carol', 'on a branch',
+             [('M', '/proj/branches/1.0/c.c'), ('M', '/proj/trunk/d.c')]))
+        d = self.poller.checksvn()
+        def check(_):
+            args = self.log_args[0]
+            self.failUnless('--revision=10:HEAD' in args)
+            self.failUnless('--limit=101' in args)
+            self.assertEqual(self.poller.last_change, 12)
+            changes = self.poller.parent.addChanges.call_args[0][0]
+            changes = [ (c.revision, c.branch, c.files, c.who)
+                        for c in changes ]
+            changes.sort()
+            self.assertEqual(changes,
+                [('11', None, ['b.c'], 'bob'),
+                 ('12', None, ['d.c'], 'carol'),
+                 ('12', 'branches/1.0', ['c.c'], 'carol')])
+        d.addCallback(check)
+        return d
+
+    def test_nothing_new(self):
+        self.poller.last_change = 10
+        self.log_output = make_log(
+            (10, 'alice', 'old', [('M', '/proj/trunk/a.c')]))
+        d = self.poller.checksvn()
+        def check(_):
+            self.assertEqual(self.poller.last_change, 10)
+            self.failIf(self.poller.parent.addChanges.called)
+        d.addCallback(check)
+        return d
+
+class Backoff(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = task.Clock()
+        self.poller = svnpoller.SVNPoller('svn://example.com/repo/proj',
+                                          pollinterval=60)
+        self.poller.loop.clock = self.clock
+        self.polls = []
+        def checksvn():
+            # a poll which runs until the test finishes it
+            d = defer.Deferred()
+            self.polls.append(d)
+            self.poller.working = True
+            self.poller.poll_started = self.clock.seconds()
+            def done(_):
+                self.poller.working = False
+                self.poller.adjust_interval()
+            d.addCallback(done)
+            return d
+        self.poller.loop.f = checksvn
+        self.poller.loop.start(60)
+
+    def tearDown(self):
+        self.poller.loop.stop()
+
+    def finishPoll(self, duration):
+        self.clock.advance(duration)
+        self.polls[-1].callback(None)
+        return self.poller.loop.interval
+
+    def runPoll(self, duration):
+        # wait for the next poll to start, and make it take this long
+        n = len(self.polls)
+        while len(self.polls) == n:
+            self.clock.advance(1)
+        return self.finishPoll(duration)
+
+    def test_slow_polls(self):
+        # a poll which takes most of the interval doubles it
+        self.assertEqual(self.finishPoll(40), 120)
+        self.assertEqual(self.runPoll(70), 240)
+        # up to max_backoff times pollinterval
+        self.poller.max_backoff = 4
+        self.assertEqual(self.runPoll(200), 240)
+        # and quick polls bring it back
+        self.assertEqual(self.runPoll(10), 120)
+        self.assertEqual(self.runPoll(10), 60)
+        self.assertEqual(self.runPoll(10), 60)
+
+    def test_overrun(self):
+        self.poller.overrun = True
+        self.assertEqual(self.finishPoll(0), 120)
@@ -145,6 +145,42 @@ class LRUCache(unittest.TestCase):
         self.lru.add("x", self.x)
         self.assertEqual(self.lru.get("z"), 0)
 
+    def test_hits_and_misses(self):
+        self.lru.add("a", self.a)
+        self.lru.get("a")
+        self.lru.get("b")
+        self.lru.get("a")
+        self.assertEqual((self.lru.hits, self.lru.misses), (2, 1))
+
+    def test_remove(self):
+        self.lru.add("a", self.a)
+        self.lru.add("b", self.b)
+        self.lru.remove("a")
+        self.lru.remove("x") # not there; ignored
+        self.assertEqual(self.lru.get("a"), None)
+        self.assertEqual(len(self.lru), 1)
+
+    def test_max_weight(self):
+        lru = util.LRUCache(10, max_weight=100)
+        lru.add("a", self.a, 40)
+        lru.add("b", self.b, 40)
+        lru.add("x", self.x, 40)
+        self.assertEqual((lru.get('a'), lru.get('b'), lru.weight),
+                         (None, self.b, 80))
+
+    def test_max_weight_keeps_newest(self):
+        lru = util.LRUCache(10, max_weight=100)
+        lru.add("a", self.a, 40)
+        lru.add("x", self.x, 400)
+        self.assertEqual((lru.get('a'), lru.get('x')), (None, self.x))
+
+    def test_setMaxSize_shrinks(self):
+        self.lru.add("a", self.a)
+        self.lru.add("b", self.b)
+        self.lru.add("x", self.x)
+        self.lru.setMaxSize(1)
+        self.assertEqual(self.lru.keys(), ["x"])
+
 class none_or_str(unittest.TestCase):
 
     def test_none(self):
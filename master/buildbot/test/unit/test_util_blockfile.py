@@ -0,0 +1,47 @@
+from twisted.trial import unittest
+
+from buildbot.util import blockfile
+
+class BlockFile(unittest.TestCase):
+
+    def setUp(self):
+        self.filename = self.mktemp()
+        self.data = "".join([ "line %d\n" % i for i in range(10000) ])
+        w = blockfile.BlockFileWriter(self.filename)
+        for i in range(0, len(self.data), 4096):
+            w.writeFrame(self.data[i:i+4096])
+        w.close()
+
+    def test_read_all(self):
+        f = blockfile.BlockFile(self.filename)
+        self.assertEqual(f.read(), self.data)
+        self.assertEqual(f.read(), "")
+
+    def test_read_sequential(self):
+        f = blockfile.BlockFile(self.filename)
+        pieces = []
+        while True:
+            piece = f.read(1000)
+            if not piece:
+                break
+            pieces.append(piece)
+        self.assertEqual("".join(pieces), self.data)
+
+    def test_seek(self):
+        f = blockfile.BlockFile(self.filename)
+        f.seek(50000)
+        self.assertEqual(f.read(10000), self.data[50000:60000])
+        self.assertEqual(f.tell(), 60000)
+        f.seek(-10, 2)
+        self.assertEqual(f.read(), self.data[-10:])
+        self.assertEqual(f.tell(), len(self.data))
+
+    def test_empty(self):
+        filename = self.mktemp()
+        blockfile.BlockFileWriter(filename).close()
+        self.assertEqual(blockfile.BlockFile(filename).read(), "")
+
+    def test_not_blockfile(self):
+        filename = self.mktemp()
+        open(filename, "w").write("not compressed at all")
+        self.assertRaises(IOError, lambda : blockfile.BlockFile(filename))
@@ -215,6 +215,26 @@ class DelegateLoop(unittest.TestCase, TestLoopMixin):
             self.assertEqual(res, [ "here" ])
         return self.whenQuiet(check)
 
+    def test_trigger_processors(self):
+        procs = [ self.make_cb(tag) for tag in "abcd" ]
+        self.loop = loop.DelegateLoop(lambda : procs)
+        self.loop.startService()
+        # only the triggered processors run, in get_processors order
+        self.loop.trigger_processors([procs[3], procs[1]])
+        def check(res):
+            self.assertEqual(res, [ "b", "d" ])
+        return self.whenQuiet(check)
+
+    def test_trigger_processors_removed(self):
+        procs = [ self.make_cb(tag) for tag in "ab" ]
+        other = self.make_cb("x")
+        self.loop = loop.DelegateLoop(lambda : procs)
+        self.loop.startService()
+        self.loop.trigger_processors([other, procs[0]])
+        def check(res):
+            self.assertEqual(res, [ "a" ])
+        return self.whenQuiet(check)
+
 class MultiServiceLoop(unittest.TestCase, TestLoopMixin):
 
     def setUp(self):
@@ -85,36 +85,93 @@ class LRUCache:
     an item's memory will not necessarily be free if other code maintains a reference
     to it, but this class will "lose track" of it all the same.  Without caution, this
     can lead to duplicate items in memory simultaneously.
+
+    Items may optionally be given a weight (such as an estimate of their size
+    in bytes) when they are added, in which case the cache also evicts items
+    until their total weight is within max_weight.  All operations take
+    constant time.  The hits and misses attributes count the results of get().
     """
 
-    synchronized = ["get", "add"]
+    synchronized = ["get", "add", "remove", "setMaxSize", "setMaxWeight"]
+
+    # each entry is a node in a circular, doubly-linked list, ordered from
+    # least- to most-recently used: [prev, next, id, thing, weight]
+    PREV, NEXT, ID, THING, WEIGHT = range(5)
 
-    def __init__(self, max_size=50):
+    def __init__(self, max_size=50, max_weight=None):
         self._max_size = max_size
-        self._cache = {} # basic LRU cache
-        self._cached_ids = [] # = [LRU .. MRU]
+        self._max_weight = max_weight
+        self._cache = {} # id -> node
+        self._root = root = []
+        root[:] = [root, root, None, None, 0]
+        self.weight = 0
+        self.hits = 0
+        self.misses = 0
+
+    def _unlink(self, node):
+        node[self.PREV][self.NEXT] = node[self.NEXT]
+        node[self.NEXT][self.PREV] = node[self.PREV]
+
+    def _link(self, node):
+        # link at the most-recently-used end
+        last = self._root[self.PREV]
+        node[self.PREV] = last
+        node[self.NEXT] = self._root
+        last[self.NEXT] = self._root[self.PREV] = node
 
     def get(self, id):
-        thing = self._cache.get(id, None)
-        if thing is not None:
-            self._cached_ids.remove(id)
-            self._cached_ids.append(id)
-        return thing
+        node = self._cache.get(id)
+        if node is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._unlink(node)
+        self._link(node)
+        return node[self.THING]
     __getitem__ = get
 
-    def add(self, id, thing):
-        if id in self._cache:
-            self._cached_ids.remove(id)
-            self._cached_ids.append(id)
+    def add(self, id, thing, weight=1):
+        node = self._cache.get(id)
+        if node is not None:
+            self._unlink(node)
+            self._link(node)
             return
-        while len(self._cached_ids) >= self._max_size:
-            del self._cache[self._cached_ids.pop(0)]
-        self._cache[id] = thing
-        self._cached_ids.append(id)
+        node = [None, None, id, thing, weight]
+        self._link(node)
+        self._cache[id] = node
+        self.weight += weight
+        self._shrink()
     __setitem__ = add
 
+    def remove(self, id):
+        node = self._cache.pop(id, None)
+        if node is not None:
+            self._unlink(node)
+            self.weight -= node[self.WEIGHT]
+
+    def __contains__(self, id):
+        return id in self._cache
+
+    def __len__(self):
+        return len(self._cache)
+
+    def keys(self):
+        return self._cache.keys()
+
+    def _shrink(self):
+        # evict least-recently-used items, but always keep the newest one
+        while len(self._cache) > 1 and (len(self._cache) > self._max_size or
+                (self._max_weight is not None and
+                 self.weight > self._max_weight)):
+            self.remove(self._root[self.NEXT][self.ID])
+
     def setMaxSize(self, max_size):
         self._max_size = max_size
+        self._shrink()
+
+    def setMaxWeight(self, max_weight):
+        self._max_weight = max_weight
+        self._shrink()
 
 threadable.synchronize(LRUCache)
 
@@ -0,0 +1,108 @@
+# -*- test-case-name: buildbot.test.unit.test_util_blockfile -*-
+
+"""Block-compressed files, which can be read from any offset without
+decompressing everything that comes before it.
+
+The file is a series of independently zlib-compressed frames, followed by an
+index with one record per frame and a short trailer:
+
+  frame 0 | frame 1 | ... | index records | trailer
+
+Each index record gives the frame's offset in the uncompressed data, and its
+offset and length in the compressed file. The trailer gives the total
+uncompressed size, the number of frames, and a magic string."""
+
+import zlib, struct, bisect
+
+MAGIC = "BBZB"
+RECORD = "!QQI" # uncompressed offset, compressed offset, compressed length
+RECORD_SIZE = struct.calcsize(RECORD)
+TRAILER = "!QI4s" # uncompressed size, number of frames, magic
+TRAILER_SIZE = struct.calcsize(TRAILER)
+
+class BlockFileWriter:
+    """I write a block-compressed file, one frame per call to writeFrame.
+    Frames can be of any size, but should be large enough (say, 1MB) to
+    compress well. The file is not readable until close() is called."""
+
+    def __init__(self, filename, level=6):
+        self.f = open(filename, "wb")
+        self.level = level
+        self.frames = []
+        self.size = 0
+
+    def writeFrame(self, data):
+        if not data:
+            return
+        compressed = zlib.compress(data, self.level)
+        self.frames.append((self.size, self.f.tell(), len(compressed)))
+        self.f.write(compressed)
+        self.size += len(data)
+
+    def close(self):
+        for frame in self.frames:
+            self.f.write(struct.pack(RECORD, *frame))
+        self.f.write(struct.pack(TRAILER, self.size, len(self.frames), MAGIC))
+        self.f.close()
+
+class BlockFile:
+    """I am a read-only, seekable file object for a block-compressed file.
+    Reads only decompress the frames that cover the requested range. The
+    most recently decompressed frame is kept, since reads tend to be
+    sequential."""
+
+    def __init__(self, filename):
+        self.f = open(filename, "rb")
+        try:
+            self.f.seek(-TRAILER_SIZE, 2)
+            self.size, count, magic = struct.unpack(TRAILER,
+                                                    self.f.read(TRAILER_SIZE))
+            if magic != MAGIC:
+                raise IOError("%s is not a block-compressed file" % filename)
+            self.f.seek(-TRAILER_SIZE - count * RECORD_SIZE, 2)
+            data = self.f.read(count * RECORD_SIZE)
+        except (IOError, struct.error):
+            self.f.close()
+            raise IOError("%s is not a block-compressed file" % filename)
+        self.frames = [ struct.unpack(RECORD, data[i:i+RECORD_SIZE])
+                        for i in range(0, len(data), RECORD_SIZE) ]
+        self.starts = [ frame[0] for frame in self.frames ]
+        self.pos = 0
+        self.cached_frame = None
+        self.cached_data = None
+
+    def _getFrame(self, n):
+        if n != self.cached_frame:
+            start, offset, length = self.frames[n]
+            self.f.seek(offset)
+            self.cached_data = zlib.decompress(self.f.read(length))
+            self.cached_frame = n
+        return self.cached_data
+
+    def read(self, size=-1):
+        if size < 0 or self.pos + size > self.size:
+            size = self.size - self.pos
+        pieces = []
+        while size > 0:
+            n = bisect.bisect_right(self.starts, self.pos) - 1
+            data = self._getFrame(n)
+            skip = self.pos - self.starts[n]
+            piece = data[skip:skip+size]
+            pieces.append(piece)
+            self.pos += len(piece)
+            size -= len(piece)
+        return "".join(pieces)
+
+    def seek(self, offset, whence=0):
+        if whence == 1:
+            offset += self.pos
+        elif whence == 2:
+            offset += self.size
+        self.pos = max(0, offset)
+
+    def tell(self):
+        return self.pos
+
+    def close(self):
+        self.f.close()
+        self.cached_data = None
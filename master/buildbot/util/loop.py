@@ -62,6 +62,11 @@ Scheduler that is waiting for a tree-stable-timer to expire, or a Periodic
 scheduler that wants to fire once every six hours. This delayed call will
 obey the same one-at-a-time behavior as the run-everything trigger.
 
+When only some of the processing functions could have work to do, the loop
+can be triggered for just those with trigger_processors(). They are run in
+the order given by get_processors(), after any run that is already under
+way, but the other functions are not run.
+
 Each function's return-value-timer value will replace the previous timer. Any
 outstanding timer will be cancelled just before invoking a processing
 function. As a result, these functions should basically be idempotent: if the
@@ -124,6 +129,16 @@ class LoopBase(service.MultiService):
             return
         self._mark_runnable(run_everything=True)
 
+    def trigger_processors(self, processors):
+        # ring the doorbell for just these processors. They are given an
+        # already-expired timer, so they will be picked up by the next
+        # partial run along with any other processors whose time has come.
+        if not self.running:
+            return
+        for p in processors:
+            self._timers[p] = 0
+        self._mark_runnable(run_everything=False)
+
     def _mark_runnable(self, run_everything):
         if run_everything:
             self._everything_needs_to_run = True
@@ -147,15 +162,19 @@ class LoopBase(service.MultiService):
         else:
             self._remaining = []
             now = util.now(self._reactor)
-            all_processors = self.get_processors()
+            due = {}
             for p in list(self._timers.keys()):
                 if self._timers[p] <= now:
                     del self._timers[p]
-                    # don't run a processor that was removed while it still
-                    # had a timer running
-                    if p in all_processors:
+                    due[p] = None
+            # run them in the order that get_processors() prefers. Processors
+            # that were removed while they still had a timer running are not
+            # run.
+            if due:
+                for p in self.get_processors():
+                    if p in due:
+                        del due[p]
                         self._remaining.append(p)
-                # consider sorting by 'when'
         self._loop_next()
 
     def _loop_next(self):
@@ -1,5 +1,6 @@
 import os.path
 import sys
+from collections import deque
 
 from twisted.spread import pb
 from twisted.python import log
@@ -15,6 +16,23 @@ from buildslave.commands import registry, base
 class UnknownCommand(pb.Error):
     pass
 
+def updateSize(data):
+    """Estimate the number of bytes an update dictionary will take on the
+    wire; only the strings in it count for much."""
+    size = 0
+    for value in data.itervalues():
+        if isinstance(value, basestring):
+            size += len(value)
+        elif isinstance(value, (tuple, list)):
+            for v in value:
+                if isinstance(v, basestring):
+                    size += len(v)
+                else:
+                    size += 8
+        else:
+            size += 8
+    return size
+
 class SlaveBuilder(pb.Referenceable, service.Service):
 
     """This is the local representation of a single Builder: it handles a
@@ -40,9 +58,25 @@ class SlaveBuilder(pb.Referenceable, service.Service):
     # useful for replacing the reactor in tests
     _reactor = reactor
 
+    # Updates are sent to the master through a window: at most
+    # maxUpdateBytesInFlight bytes of updates may be unacknowledged at once.
+    # Updates which arrive while earlier ones are in flight are queued, and
+    # sent together in calls of about updateBatchSize bytes. If more than
+    # maxUpdateBytesQueued bytes are waiting, the producers (the RunProcess
+    # instances of the running command) are paused until the queue drains
+    # below updateBatchSize.
+    updateBatchSize = 256*1024
+    maxUpdateBytesInFlight = 1024*1024
+    maxUpdateBytesQueued = 1024*1024
+
     def __init__(self, name):
         #service.Service.__init__(self) # Service has no __init__ method
         self.setName(name)
+        self.updateQueue = deque()
+        self.updateBytesQueued = 0
+        self.updateBytesInFlight = 0
+        self.producers = []
+        self.producersPaused = False
 
     def __repr__(self):
         return "<SlaveBuilder '%s' at %d>" % (self.name, id(self))
@@ -90,6 +124,7 @@ class SlaveBuilder(pb.Referenceable, service.Service):
     def lostRemoteStep(self, remotestep):
         log.msg("lost remote step")
         self.remoteStep = None
+        self._dropQueuedUpdates()
         if self.stopCommandOnShutdown:
             self.stopCommand()
 
@@ -155,25 +190,94 @@ class SlaveBuilder(pb.Referenceable, service.Service):
     # sendUpdate is invoked by the Commands we spawn
     def sendUpdate(self, data):
         """This sends the status update to the master-side
-        L{buildbot.process.step.RemoteCommand} object, giving it a sequence
-        number in the process. It adds the update to a queue, and asks the
-        master to acknowledge the update so it can be removed from that
-        queue."""
+        L{buildbot.process.step.RemoteCommand} object. It adds the update to
+        a queue, which is sent to the master as the window of unacknowledged
+        updates allows."""
 
         if not self.running:
             # .running comes from service.Service, and says whether the
             # service is running or not. If we aren't running, don't send any
             # status messages.
             return
-        # the update[1]=0 comes from the leftover 'updateNum', which the
-        # master still expects to receive. Provide it to avoid significant
-        # interoperability issues between new slaves and old masters.
-        if self.remoteStep:
-            update = [data, 0]
-            updates = [update]
+        if not self.remoteStep:
+            return
+        size = updateSize(data)
+        self.updateQueue.append((data, size))
+        self.updateBytesQueued += size
+        self._sendQueuedUpdates()
+        if self.updateBytesQueued > self.maxUpdateBytesQueued:
+            self._pauseProducers()
+
+    def _sendQueuedUpdates(self, flush=False):
+        """Send queued updates to the master. An update is sent as soon as
+        it arrives if nothing is in flight; otherwise only full batches are
+        sent, and only while the window has room. If flush is true,
+        everything in the queue is sent."""
+        while self.updateQueue and self.remoteStep:
+            if self.updateBytesInFlight and not flush:
+                if self.updateBytesQueued < self.updateBatchSize:
+                    break
+                if self.updateBytesInFlight + self.updateBatchSize > \
+                        self.maxUpdateBytesInFlight:
+                    break
+            # the update[1]=0 comes from the leftover 'updateNum', which the
+            # master still expects to receive. Provide it to avoid
+            # significant interoperability issues between new slaves and old
+            # masters.
+            updates = []
+            batch_size = 0
+            while self.updateQueue and batch_size < self.updateBatchSize:
+                data, size = self.updateQueue.popleft()
+                updates.append([data, 0])
+                batch_size += size
+            self.updateBytesQueued -= batch_size
+            self.updateBytesInFlight += batch_size
             d = self.remoteStep.callRemote("update", updates)
             d.addCallback(self.ackUpdate)
             d.addErrback(self._ackFailed, "SlaveBuilder.sendUpdate")
+            d.addBoth(self._updatesAcked, batch_size)
+        if self.updateBytesQueued < self.updateBatchSize:
+            self._resumeProducers()
+
+    def _updatesAcked(self, res, batch_size):
+        self.updateBytesInFlight -= batch_size
+        self._sendQueuedUpdates()
+
+    def _dropQueuedUpdates(self):
+        # once the master-side step is gone, there is nowhere to send the
+        # queued updates, and the command must not be held up waiting for
+        # them
+        self.updateQueue.clear()
+        self.updateBytesQueued = 0
+        self._resumeProducers()
+
+    def registerProducer(self, producer):
+        """Register an object with pauseProducing and resumeProducing
+        methods (such as a L{buildslave.runprocess.RunProcess}), which will be
+        paused while too many updates are waiting to be sent."""
+        self.producers.append(producer)
+        if self.producersPaused:
+            producer.pauseProducing()
+
+    def unregisterProducer(self, producer):
+        if producer in self.producers:
+            self.producers.remove(producer)
+            if self.producersPaused:
+                producer.resumeProducing()
+
+    def _pauseProducers(self):
+        if self.producersPaused:
+            return
+        self.producersPaused = True
+        for producer in self.producers[:]:
+            producer.pauseProducing()
+
+    def _resumeProducers(self):
+        if not self.producersPaused:
+            return
+        self.producersPaused = False
+        for producer in self.producers[:]:
+            producer.resumeProducing()
 
     def ackUpdate(self, acknum):
         self.activity() # update the "last activity" timer
@@ -201,8 +305,12 @@ class SlaveBuilder(pb.Referenceable, service.Service):
         self.command = None
         if not self.running:
             log.msg(" but we weren't running, quitting silently")
+            self._dropQueuedUpdates()
             return
         if self.remoteStep:
+            # send whatever is left in the queue before the completion, so
+            # that the master sees everything in order
+            self._sendQueuedUpdates(flush=True)
             self.remoteStep.dontNotifyOnDisconnect(self.lostRemoteStep)
             d = self.remoteStep.callRemote("complete", failure)
             d.addCallback(self.ackComplete)
@@ -35,6 +35,7 @@ class SlaveShellCommand(base.Command):
                         watched just like 'tail -f', and all changes will be
                         written to 'log' status updates.
         - ['logEnviron']: False to not log the environment variables on the slave
+        - ['compress']: True to send output compressed with zlib
 
     ShellCommand creates the following status messages:
         - {'stdout': data} : when stdout data is available
@@ -42,6 +43,9 @@ class SlaveShellCommand(base.Command):
         - {'header': data} : when headers (command start/stop) are available
         - {'log': (logfile_name, data)} : when log files have new contents
         - {'rc': rc} : when the process has terminated
+
+    With 'compress', the stdout, stderr and log updates may be compressed;
+    those have an additional 'compressed': 'zlib' key.
     """
 
     def start(self):
@@ -65,6 +69,7 @@ class SlaveShellCommand(base.Command):
                          logfiles=args.get('logfiles', {}),
                          usePTY=args.get('usePTY', "slave-config"),
                          logEnviron=args.get('logEnviron', True),
+                         compress=args.get('compress', False),
                          )
         c._reactor = self._reactor
         self.command = c
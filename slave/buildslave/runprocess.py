@@ -9,6 +9,7 @@ import types
 import re
 import traceback
 import stat
+import zlib
 from collections import deque
 
 from twisted.python import runtime, log
@@ -164,11 +165,23 @@ class RunProcess:
     KILL = "KILL"
     CHUNK_LIMIT = 128*1024
 
-    # Don't send any data until at least BUFFER_SIZE bytes have been collected
-    # or BUFFER_TIMEOUT elapsed
+    # Don't send any data until the buffer holds buffer_size bytes or the
+    # buffer timer fires. Both adapt to the output: the timer starts at
+    # MIN_BUFFER_TIMEOUT, so that sparse output reaches the master quickly,
+    # and doubles (up to BUFFER_TIMEOUT) whenever it fires on output which
+    # arrived in several pieces, or the buffer fills. A full buffer also
+    # doubles buffer_size, up to MAX_BUFFER_SIZE. They shrink again as the
+    # output slows down, and start over after BUFFER_TIMEOUT seconds of
+    # silence.
     BUFFER_SIZE = 64*1024
+    MAX_BUFFER_SIZE = 512*1024
+    MIN_BUFFER_TIMEOUT = 0.1
     BUFFER_TIMEOUT = 5
 
+    # with compress=True, messages with at least this much output are sent
+    # compressed
+    COMPRESS_MIN = 1024
+
     # For sending elapsed time:
     startTime = None
     elapsedTime = None
@@ -186,7 +199,8 @@ class RunProcess:
                  sendStdout=True, sendStderr=True, sendRC=True,
                  timeout=None, maxTime=None, initialStdin=None,
                  keepStdinOpen=False, keepStdout=False, keepStderr=False,
-                 logEnviron=True, logfiles={}, usePTY="slave-config"):
+                 logEnviron=True, logfiles={}, usePTY="slave-config",
+                 compress=False):
         """
 
         @param keepStdout: if True, we keep a copy of all the stdout text
@@ -197,6 +211,11 @@ class RunProcess:
 
         @param usePTY: "slave-config" -> use the SlaveBuilder's usePTY;
             otherwise, true to use a PTY, false to not use a PTY.
+
+        @param compress: if True, send stdout, stderr and logfile data
+                         zlib-compressed, marking those updates with
+                         'compressed': 'zlib'. Only do this for masters
+                         which asked for it.
         """
 
         self.builder = builder
@@ -261,14 +280,22 @@ class RunProcess:
         self.logEnviron = logEnviron
         self.timeout = timeout
         self.timer = None
+        # set while the no-output timer is suspended by pauseProducing
+        self.timerPaused = False
+        self.killed = False
         self.maxTime = maxTime
         self.maxTimer = None
         self.keepStdout = keepStdout
         self.keepStderr = keepStderr
 
+        self.compress = compress
+
         self.buffered = deque()
         self.buflen = 0
         self.buftimer = None
+        self.buffer_size = self.BUFFER_SIZE
+        self.buffer_timeout = self.MIN_BUFFER_TIMEOUT
+        self.lastOutput = None
 
         if usePTY == "slave-config":
             self.usePTY = self.builder.usePTY
@@ -448,6 +475,9 @@ class RunProcess:
         if not self.process:
             self.process = p
 
+        # let the builder pause us if the master falls behind
+        self.builder.registerProducer(self)
+
         # connectionMade also closes stdin as long as we're not using a PTY.
         # This is intended to kill off inappropriately interactive commands
         # better than the (long) hung-command timeout. ProcessPTY should be
@@ -487,6 +517,38 @@ class RunProcess:
                 retval[log] = data
         return retval
 
+    def _compressMsg(self, msg):
+        """
+        Compress the output in a collapsed msg, if it is large enough for
+        that to be worthwhile and it gets smaller. Only the output (stdout,
+        stderr and log) is compressed, since that is all the master
+        decompresses; anything else, such as a header, is sent as it is.
+        """
+        size = 0
+        for key, value in msg.items():
+            if key == 'log':
+                size += len(value[1])
+            elif key in ('stdout', 'stderr'):
+                size += len(value)
+        if size < self.COMPRESS_MIN:
+            return msg
+        compressed = {}
+        compressed_size = 0
+        for key, value in msg.items():
+            if key == 'log':
+                data = zlib.compress(value[1])
+                compressed[key] = (value[0], data)
+            elif key in ('stdout', 'stderr'):
+                data = compressed[key] = zlib.compress(value)
+            else:
+                compressed[key] = value
+                continue
+            compressed_size += len(data)
+        if compressed_size >= size:
+            return msg
+        compressed['compressed'] = 'zlib'
+        return compressed
+
     def _sendMessage(self, msg):
         """
         Collapse and send msg to the master
@@ -494,10 +556,22 @@ class RunProcess:
         if not msg:
             return
         msg = self._collapseMsg(msg)
+        if self.compress:
+            msg = self._compressMsg(msg)
         self.sendStatus(msg)
 
     def _bufferTimeout(self):
         self.buftimer = None
+        if len(self.buffered) > 1:
+            # several pieces of output within the timeout: wait longer next
+            # time, so that they are sent in fewer messages
+            self.buffer_timeout = min(self.buffer_timeout * 2,
+                                      self.BUFFER_TIMEOUT)
+        else:
+            self.buffer_timeout = max(self.buffer_timeout / 2.0,
+                                      self.MIN_BUFFER_TIMEOUT)
+        if self.buflen < self.buffer_size / 2:
+            self.buffer_size = max(self.buffer_size / 2, self.BUFFER_SIZE)
         self._sendBuffers()
 
     def _sendBuffers(self):
@@ -555,18 +629,31 @@ class RunProcess:
     def _addToBuffers(self, logname, data):
         """
         Add data to the buffer for logname
-        Start a timer to send the buffers if BUFFER_TIMEOUT elapses.
-        If adding data causes the buffer size to grow beyond BUFFER_SIZE, then
+        Start a timer to send the buffers if buffer_timeout elapses.
+        If adding data causes the buffer size to grow beyond buffer_size, then
         the buffers will be sent.
         """
         n = len(data)
 
+        now = util.now(self._reactor)
+        if self.lastOutput is None or \
+                now - self.lastOutput > self.BUFFER_TIMEOUT:
+            # the output has started (again), so send it promptly
+            self.buffer_size = self.BUFFER_SIZE
+            self.buffer_timeout = self.MIN_BUFFER_TIMEOUT
+        self.lastOutput = now
+
         self.buflen += n
         self.buffered.append((logname, data))
-        if self.buflen > self.BUFFER_SIZE:
+        if self.buflen > self.buffer_size:
             self._sendBuffers()
+            # heavy output: collect more of it into each message
+            self.buffer_size = min(self.buffer_size * 2, self.MAX_BUFFER_SIZE)
+            self.buffer_timeout = min(self.buffer_timeout * 2,
+                                      self.BUFFER_TIMEOUT)
         elif not self.buftimer:
-            self.buftimer = self._reactor.callLater(self.BUFFER_TIMEOUT, self._bufferTimeout)
+            self.buftimer = self._reactor.callLater(self.buffer_timeout,
+                                                    self._bufferTimeout)
 
     def addStdout(self, data):
         if self.sendStdout:
@@ -592,7 +679,29 @@ class RunProcess:
         if self.timer:
             self.timer.reset(self.timeout)
 
+    def pauseProducing(self):
+        """Stop reading the child's output until resumeProducing is called;
+        the child will block once the pipes fill up. Since the child's silence
+        is then our doing, the no-output timeout is suspended meanwhile."""
+        if hasattr(self.process, 'pauseProducing'):
+            self.process.pauseProducing()
+        # once the child is being killed, self.timer is the backup timer
+        if self.timer and not self.killed:
+            self.timer.cancel()
+            self.timer = None
+            self.timerPaused = True
+
+    def resumeProducing(self):
+        if hasattr(self.process, 'resumeProducing'):
+            self.process.resumeProducing()
+        if self.timerPaused:
+            self.timerPaused = False
+            if not self.killed:
+                self.timer = self._reactor.callLater(self.timeout,
+                                                     self.doTimeout)
+
     def finished(self, sig, rc):
+        self.builder.unregisterProducer(self)
         self.elapsedTime = util.now(self._reactor) - self.startTime
         log.msg("command finished with signal %s, exit code %s, elapsedTime: %0.6f" % (sig,rc,self.elapsedTime))
         for w in self.logFileWatchers:
@@ -624,6 +733,7 @@ class RunProcess:
             log.msg("Hey, command %s finished twice" % self)
 
     def failed(self, why):
+        self.builder.unregisterProducer(self)
         self._sendBuffers()
         log.msg("RunProcess.failed: command failed: %s" % (why,))
         if self.timer:
@@ -655,6 +765,7 @@ class RunProcess:
     def kill(self, msg):
         # This may be called by the timeout, or when the user has decided to
         # abort this build.
+        self.killed = True
         self._sendBuffers()
         if self.timer:
             self.timer.cancel()
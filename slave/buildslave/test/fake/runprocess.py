@@ -79,7 +79,8 @@ class FakeRunProcess:
                  sendStdout=True, sendStderr=True, sendRC=True,
                  timeout=None, maxTime=None, initialStdin=None,
                  keepStdinOpen=False, keepStdout=False, keepStderr=False,
-                 logEnviron=True, logfiles={}, usePTY="slave-config")
+                 logEnviron=True, logfiles={}, usePTY="slave-config",
+                 compress=False)
 
         if not self._expectations:
             raise AssertionError("unexpected instantiation: %s" % (kwargs,))
@@ -9,6 +9,7 @@ class FakeSlaveBuilder:
     debug = False
     def __init__(self, usePTY=False, basedir="/slavebuilder/basedir"):
         self.updates = []
+        self.producers = []
         self.basedir = basedir
         self.usePTY = usePTY
 
@@ -17,6 +18,13 @@ class FakeSlaveBuilder:
             print "FakeSlaveBuilder.sendUpdate", data
         self.updates.append(data)
 
+    def registerProducer(self, producer):
+        self.producers.append(producer)
+
+    def unregisterProducer(self, producer):
+        if producer in self.producers:
+            self.producers.remove(producer)
+
     def show(self):
         return pprint.pformat(self.updates)
 
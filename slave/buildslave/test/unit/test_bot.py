@@ -303,3 +303,110 @@ class TestSlaveBuilder(command.CommandTestMixin, unittest.TestCase):
             self.assertTrue(isinstance(st.actions[0][1], failure.Failure))
         d.addCallback(check)
         return d
+
+class SlowStep(object):
+    "A fake master-side BuildStep which acknowledges updates when told to."
+    def __init__(self):
+        self.calls = []
+
+    def remote_update(self, updates):
+        d = defer.Deferred()
+        self.calls.append((updates, d))
+        return d
+
+    def ack(self):
+        updates, d = self.calls.pop(0)
+        d.callback(None)
+
+class FakeProducer(object):
+    paused = False
+    def pauseProducing(self):
+        self.paused = True
+    def resumeProducing(self):
+        self.paused = False
+
+class TestSlaveBuilderUpdates(unittest.TestCase):
+
+    def setUp(self):
+        self.sb = bot.SlaveBuilder('sb')
+        self.sb.running = True
+        self.sb.updateBatchSize = 10
+        self.sb.maxUpdateBytesInFlight = 20
+        self.sb.maxUpdateBytesQueued = 30
+        self.step = SlowStep()
+        self.sb.remoteStep = FakeRemote(self.step)
+
+    def sent(self):
+        return [ [ u[0]['stdout'] for u in updates ]
+                 for updates, d in self.step.calls ]
+
+    def test_updateSize(self):
+        self.assertEqual(bot.updateSize({'stdout' : 'abc'}), 3)
+        self.assertEqual(bot.updateSize({'log' : ('foo', 'abcd')}), 7)
+        self.assertEqual(bot.updateSize({'rc' : 0}), 8)
+
+    def test_coalesce(self):
+        # the first update goes straight out
+        self.sb.sendUpdate({'stdout' : 'a'})
+        self.assertEqual(self.sent(), [['a']])
+        # later ones wait for the first to be acknowledged
+        self.sb.sendUpdate({'stdout' : 'b'})
+        self.sb.sendUpdate({'stdout' : 'c'})
+        self.assertEqual(self.sent(), [['a']])
+        # and are then sent together
+        self.step.ack()
+        self.assertEqual(self.sent(), [['b', 'c']])
+        self.step.ack()
+        self.assertEqual(self.sb.updateBytesInFlight, 0)
+
+    def test_window(self):
+        self.sb.sendUpdate({'stdout' : 'a'})
+        # a full batch is sent even with updates in flight..
+        self.sb.sendUpdate({'stdout' : 'b' * 10})
+        self.assertEqual(self.sent(), [['a'], ['b' * 10]])
+        # ..until the window is full
+        self.sb.sendUpdate({'stdout' : 'c' * 10})
+        self.assertEqual(self.sent(), [['a'], ['b' * 10]])
+        self.step.ack()
+        self.assertEqual(self.sent(), [['b' * 10], ['c' * 10]])
+
+    def test_backpressure(self):
+        producer = FakeProducer()
+        self.sb.registerProducer(producer)
+        self.sb.sendUpdate({'stdout' : 'a'})
+        for i in range(4):
+            self.sb.sendUpdate({'stdout' : 'x' * 10})
+        self.failIf(producer.paused)
+        self.sb.sendUpdate({'stdout' : 'x' * 10})
+        self.failUnless(producer.paused)
+        # a producer registered meanwhile starts out paused
+        other = FakeProducer()
+        self.sb.registerProducer(other)
+        self.failUnless(other.paused)
+        self.sb.unregisterProducer(other)
+        self.failIf(other.paused)
+        # once the queue drains, the producer is resumed
+        while self.step.calls:
+            self.step.ack()
+        self.failIf(producer.paused)
+        self.assertEqual(self.sb.updateBytesQueued, 0)
+
+    def test_lostRemoteStep(self):
+        producer = FakeProducer()
+        self.sb.registerProducer(producer)
+        self.sb.stopCommandOnShutdown = False
+        self.sb.sendUpdate({'stdout' : 'a'})
+        for i in range(5):
+            self.sb.sendUpdate({'stdout' : 'x' * 10})
+        self.failUnless(producer.paused)
+        self.sb.lostRemoteStep(None)
+        self.failIf(producer.paused)
+        self.assertEqual(len(self.sb.updateQueue), 0)
+
+    def test_commandComplete_flushes(self):
+        self.sb.sendUpdate({'stdout' : 'a'})
+        self.sb.sendUpdate({'stdout' : 'b'})
+        self.step.remote_complete = lambda f : self.step.calls.append('complete')
+        self.sb.commandComplete(None)
+        self.assertEqual(self.step.calls[1][0], [[{'stdout' : 'b'}, 0]])
+        self.assertEqual(self.step.calls[2], 'complete')
@@ -36,4 +36,19 @@ class TestSlaveShellCommand(CommandTestMixin, unittest.TestCase):
         d.addCallback(check)
         return d
 
+    def test_compress(self):
+        self.make_command(shell.SlaveShellCommand, dict(
+            command=[ 'echo', 'hello' ],
+            workdir='workdir',
+            compress=True,
+        ))
+
+        self.patch_runprocess(
+            Expect([ 'echo', 'hello' ], self.basedir_workdir, compress=True)
+            + { 'rc' : 0 }
+            + 0,
+        )
+
+        return self.run_command()
+
     # TODO: test all functionality that SlaveShellCommand adds atop RunProcess
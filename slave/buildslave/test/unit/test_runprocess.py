@@ -1,10 +1,11 @@
 import sys
 import re
 import os
+import zlib
 
 import twisted
 from twisted.trial import unittest
-from twisted.internet import task, defer
+from twisted.internet import task, defer, reactor
 from twisted.python import runtime
 
 from buildslave.test.util.misc import nl
@@ -37,6 +38,26 @@ class TestRunProcess(unittest.TestCase):
         d.addCallback(check)
         return d
 
+    def testPauseProducing(self):
+        basedir = "test_slave_commands_base.runprocess.pause"
+        b = FakeSlaveBuilder(False, basedir)
+        s = runprocess.RunProcess(b, stdoutCommand('hello'), basedir)
+
+        d = s.start()
+        # the process is registered with the builder while it runs, and
+        # nothing is read from it while it is paused
+        self.assertEqual(b.producers, [s])
+        s.pauseProducing()
+        def resume():
+            self.failIf({'stdout': nl('hello\n')} in b.updates, b.show())
+            s.resumeProducing()
+        reactor.callLater(0.2, resume)
+        def check(ign):
+            self.failUnless({'stdout': nl('hello\n')} in b.updates, b.show())
+            self.assertEqual(b.producers, [])
+        d.addCallback(check)
+        return d
+
     def testNoStdout(self):
         basedir = "test_slave_commands_base.runprocess.nostdout"
         b = FakeSlaveBuilder(False, basedir)
@@ -130,6 +151,26 @@ class TestRunProcess(unittest.TestCase):
         clock.advance(6)
         return d
 
+    def testPausedTimeout(self):
+        basedir = "test_slave_commands_base.runprocess.pausedtimeout"
+        b = FakeSlaveBuilder(False, basedir)
+        s = runprocess.RunProcess(b, stdoutCommand('hello'), basedir,
+                                  timeout=5)
+        clock = task.Clock()
+        s._reactor = clock
+        d = s.start()
+        # no output is read while paused, so that silence is not timed
+        s.pauseProducing()
+        clock.advance(6)
+        self.failIf(s.killed)
+        s.resumeProducing()
+        self.failUnless(s.timer.active())
+        def check(ign):
+            self.failUnless({'stdout': nl('hello\n')} in b.updates, b.show())
+            self.failUnless({'rc': 0} in b.updates, b.show())
+        d.addCallback(check)
+        return d
+
     def testCommandMaxTime(self):
         basedir = "test_slave_commands_base.runprocess.maxtime"
         b = FakeSlaveBuilder(False, basedir)
@@ -269,6 +310,84 @@ class TestLogging(unittest.TestCase):
         s._addToBuffers('stdout', data)
         self.failUnlessEqual(len(b.updates), 1)
 
+    def testSendSparse(self):
+        basedir = "test_slave_commands_base.logging.sendSparse"
+        b = FakeSlaveBuilder(False, basedir)
+        s = runprocess.RunProcess(b, stdoutCommand('hello'), basedir)
+        clock = s._reactor = task.Clock()
+        # sparse output goes out after MIN_BUFFER_TIMEOUT
+        s._addToBuffers('stdout', 'hello\n')
+        clock.advance(s.MIN_BUFFER_TIMEOUT)
+        self.failUnlessEqual(b.updates, [{'stdout': 'hello\n'}])
+        self.failUnlessEqual(s.buffer_timeout, s.MIN_BUFFER_TIMEOUT)
+
+    def testSendChatty(self):
+        basedir = "test_slave_commands_base.logging.sendChatty"
+        b = FakeSlaveBuilder(False, basedir)
+        s = runprocess.RunProcess(b, stdoutCommand('hello'), basedir)
+        clock = s._reactor = task.Clock()
+        # output in several pieces makes the timer back off..
+        timeouts = []
+        for i in range(8):
+            s._addToBuffers('stdout', 'a')
+            s._addToBuffers('stdout', 'b')
+            timeouts.append(s.buffer_timeout)
+            clock.advance(s.buffer_timeout)
+        self.failUnlessEqual(timeouts,
+                [0.1, 0.2, 0.4, 0.8, 1.6, 3.2, 5, 5])
+        self.failUnlessEqual(len(b.updates), 8)
+        # ..and a single piece brings it back down
+        s._addToBuffers('stdout', 'c')
+        clock.advance(s.buffer_timeout)
+        self.failUnlessEqual(s.buffer_timeout, 2.5)
+        # as does a silence
+        clock.advance(s.BUFFER_TIMEOUT + 1)
+        s._addToBuffers('stdout', 'd')
+        self.failUnlessEqual(s.buffer_timeout, s.MIN_BUFFER_TIMEOUT)
+
+    def testSendHeavy(self):
+        basedir = "test_slave_commands_base.logging.sendHeavy"
+        b = FakeSlaveBuilder(False, basedir)
+        s = runprocess.RunProcess(b, stdoutCommand('hello'), basedir)
+        s._reactor = task.Clock()
+        # each full buffer doubles the buffer size
+        s._addToBuffers('stdout', "x" * (s.BUFFER_SIZE + 1))
+        self.failUnlessEqual(s.buffer_size, s.BUFFER_SIZE * 2)
+        s._addToBuffers('stdout', "x" * (s.BUFFER_SIZE + 1))
+        self.failUnlessEqual(len(b.updates), 1)
+        for i in range(10):
+            s._addToBuffers('stdout', "x" * (s.MAX_BUFFER_SIZE + 1))
+        self.failUnlessEqual(s.buffer_size, s.MAX_BUFFER_SIZE)
+
+    def testSendCompressed(self):
+        basedir = "test_slave_commands_base.logging.sendCompressed"
+        b = FakeSlaveBuilder(False, basedir)
+        s = runprocess.RunProcess(b, stdoutCommand('hello'), basedir,
+                                  compress=True)
+        data = "hello world\n" * 1000
+        s._addToBuffers('stdout', data)
+        s._addToBuffers(('log', 'build.log'), data)
+        s._addToBuffers('stdout', 'short')
+        s._sendBuffers()
+        self.failUnlessEqual(b.updates[0]['compressed'], 'zlib')
+        self.failUnlessEqual(zlib.decompress(b.updates[0]['stdout']), data)
+        self.failUnlessEqual(b.updates[1]['log'][0], 'build.log')
+        self.failUnlessEqual(zlib.decompress(b.updates[1]['log'][1]), data)
+        # small messages are not worth compressing
+        self.failUnlessEqual(b.updates[2], {'stdout': 'short'})
+
+    def testHeaderNotCompressed(self):
+        basedir = "test_slave_commands_base.logging.headerNotCompressed"
+        b = FakeSlaveBuilder(False, basedir)
+        s = runprocess.RunProcess(b, stdoutCommand('hello'), basedir,
+                                  compress=True)
+        # the master only decompresses output, so a large header (such as
+        # the environment) must be sent as it is
+        header = "VAR=value\n" * 1000
+        s._addToBuffers('header', header)
+        s._sendBuffers()
+        self.failUnlessEqual(b.updates, [{'header': header}])
+
 class TestLogFileWatcher(unittest.TestCase):
     def makeRP(self):
         b = FakeSlaveBuilder(False, 'base')